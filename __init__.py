@@ -8,8 +8,13 @@
 from trytond.pool import Pool
 
 from product import Template, Product
-from rental import RentalContract, RentalContractLine
+from rental import RentalContract, RentalContractLine, \
+    BillContractStart, BillContract, RenewContractStart, RenewContract
 from configuration import Configuration
+from price_list import PriceList, PriceListLine
+from asset import Asset
+from job import ContractJob, ContractJobContract
+from utilization import UtilizationBucket, Utilization
 from invoice import InvoiceLine
 from stock import Move
 
@@ -19,9 +24,23 @@ def register():
         Template,
         Product,
         Configuration,
+        PriceList,
+        PriceListLine,
         RentalContract,
         RentalContractLine,
+        Asset,
+        ContractJob,
+        ContractJobContract,
+        UtilizationBucket,
+        Utilization,
+        BillContractStart,
+        RenewContractStart,
         InvoiceLine,
         Move,
         module='rental', type_='model'
     )
+    Pool.register(
+        BillContract,
+        RenewContract,
+        module='rental', type_='wizard'
+    )
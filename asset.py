@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+    asset.py
+
+    :copyright: (c) 2015 by Fulfil.IO Inc.
+    :license: see LICENSE.
+"""
+from math import ceil
+
+from trytond import backend
+from trytond.model import ModelSQL, ModelView, fields
+from trytond.pool import Pool
+from trytond.transaction import Transaction
+
+__all__ = ['Asset']
+
+
+class Asset(ModelSQL, ModelView):
+    'Rental Asset'
+    __name__ = 'rental.asset'
+    _rec_name = 'serial'
+
+    product = fields.Many2One(
+        'product.product', 'Product', required=True, select=True,
+        domain=[('rental_serialized', '=', True)]
+    )
+    serial = fields.Char('Serial', required=True, select=True)
+    status = fields.Selection([
+        ('available', 'Available'),
+        ('rented', 'Rented'),
+        ('unavailable', 'Unavailable'),
+    ], 'Status', required=True, select=True)
+    contract_line = fields.Many2One(
+        'rental.contract.line', 'Contract Line', readonly=True, select=True,
+        ondelete='RESTRICT',
+        help='The contract line on which the asset is currently rented'
+    )
+
+    @classmethod
+    def __setup__(cls):
+        super(Asset, cls).__setup__()
+        cls._sql_constraints += [
+            ('serial_uniq', 'UNIQUE(product, serial)',
+                'The serial of an asset must be unique per product.'),
+        ]
+
+    @classmethod
+    def __register__(cls, module_name):
+        TableHandler = backend.get('TableHandler')
+        cursor = Transaction().cursor
+
+        super(Asset, cls).__register__(module_name)
+
+        table = TableHandler(cursor, cls, module_name)
+        table.index_action(['product', 'status'], 'add')
+
+    @staticmethod
+    def default_status():
+        return 'available'
+
+    @classmethod
+    def pick(cls, lines):
+        '''
+        Pick free assets for the lines of serialized products.
+        Return a dictionary with the line ids as keys and the ids of the
+        assets picked as values and the ids of the lines for which there are
+        not enough free assets.
+        The free assets of all the products are read with one query.
+        On PostgreSQL the free assets are locked until the end of the
+        transaction and those locked by a concurrent activation are skipped
+        so no asset is picked twice.
+        '''
+        Uom = Pool().get('product.uom')
+        cursor = Transaction().cursor
+
+        lines = [
+            l for l in lines
+            if l.type == 'line' and l.product and l.product.rental_serialized
+        ]
+        if not lines:
+            return {}, []
+
+        table = cls.__table__()
+        query, params = tuple(table.select(
+            table.id, table.product,
+            where=(table.status == 'available')
+            & table.product.in_(list(set(l.product.id for l in lines))),
+            order_by=[table.product.asc, table.id.asc]
+        ))
+        if backend.name() == 'postgresql':  # pragma: no cover
+            query += ' FOR UPDATE SKIP LOCKED'
+        cursor.execute(query, params)
+        free = {}
+        for asset_id, product_id in cursor.fetchall():
+            free.setdefault(product_id, []).append(asset_id)
+
+        picked = {}
+        missing = []
+        for line in lines:
+            quantity = Uom.compute_qty(
+                line.unit, line.quantity, line.product.default_uom
+            )
+            needed = int(ceil(quantity))
+            assets = free.get(line.product.id, [])
+            if len(assets) < needed:
+                missing.append(line.id)
+                continue
+            picked[line.id] = assets[:needed]
+            free[line.product.id] = assets[needed:]
+        return picked, missing
+
+    @classmethod
+    def assign(cls, picked):
+        '''
+        Rent the assets picked for the lines with a single write
+        '''
+        args = []
+        for line_id, asset_ids in picked.iteritems():
+            if asset_ids:
+                args.extend((cls.browse(asset_ids), {
+                    'status': 'rented',
+                    'contract_line': line_id,
+                }))
+        if args:
+            cls.write(*args)
+
+    @classmethod
+    def release(cls, lines):
+        '''
+        Make the assets rented on the lines available again
+        '''
+        assets = cls.search([
+            ('contract_line', 'in', [l.id for l in lines]),
+        ])
+        if assets:
+            cls.write(assets, {
+                'status': 'available',
+                'contract_line': None,
+            })
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+    availability.py
+
+    :copyright: (c) 2015 by Fulfil.IO Inc.
+    :license: see LICENSE.
+"""
+from bisect import bisect_left, bisect_right
+from itertools import chain
+
+__all__ = ['IntervalIndex']
+
+
+class IntervalIndex(object):
+    """
+    Index of the quantities committed over half-open intervals [start, end).
+
+    The bounds of the intervals split the time line in elementary segments
+    which are the leaves of a segment tree storing the maximum and the
+    minimum committed quantity of its range. Adding or removing an interval
+    and querying the peak quantity over a window are both O(log n) and the
+    first free window is found by descending the tree.
+
+    bounds are extra coordinates of the time line. The intervals added later
+    within them do not rebuild the tree, so the index of a batch is built
+    once with the bounds of all its intervals.
+    """
+
+    def __init__(self, intervals=None, bounds=None):
+        self.intervals = []
+        self.bounds = []
+        self._build(intervals or [], bounds or [])
+
+    def _build(self, intervals, bounds=()):
+        self.intervals = [(s, e, q) for s, e, q in intervals if s < e]
+        self.bounds = sorted(set(chain(bounds, chain.from_iterable(
+            (s, e) for s, e, _ in self.intervals
+        ))))
+        self.size = max(len(self.bounds) - 1, 0)
+        self.tree = [0] * (4 * self.size or 1)
+        self.floor = [0] * (4 * self.size or 1)
+        self.lazy = [0] * (4 * self.size or 1)
+        for start, end, quantity in self.intervals:
+            self._update(start, end, quantity)
+
+    def __len__(self):
+        return len(self.intervals)
+
+    def _segments(self, start, end):
+        "Return the range of elementary segments overlapping [start, end)"
+        low = max(bisect_right(self.bounds, start) - 1, 0)
+        high = min(bisect_left(self.bounds, end) - 1, self.size - 1)
+        return low, high
+
+    def _add(self, node, low, high, first, last, quantity):
+        if last < low or high < first:
+            return
+        if first <= low and high <= last:
+            self.tree[node] += quantity
+            self.floor[node] += quantity
+            self.lazy[node] += quantity
+            return
+        middle = (low + high) // 2
+        self._add(2 * node, low, middle, first, last, quantity)
+        self._add(2 * node + 1, middle + 1, high, first, last, quantity)
+        self.tree[node] = self.lazy[node] + max(
+            self.tree[2 * node], self.tree[2 * node + 1]
+        )
+        self.floor[node] = self.lazy[node] + min(
+            self.floor[2 * node], self.floor[2 * node + 1]
+        )
+
+    def _max(self, node, low, high, first, last):
+        if last < low or high < first:
+            return None
+        if first <= low and high <= last:
+            return self.tree[node]
+        middle = (low + high) // 2
+        values = [v for v in (
+            self._max(2 * node, low, middle, first, last),
+            self._max(2 * node + 1, middle + 1, high, first, last),
+        ) if v is not None]
+        return self.lazy[node] + max(values)
+
+    def _first(self, node, low, high, first, limit, blocked, pending=0):
+        """
+        Return the first elementary segment from first whose committed
+        quantity is above limit if blocked or not above limit otherwise or
+        None. pending is the quantity added by the ancestors of node.
+        """
+        if high < first:
+            return None
+        if blocked and pending + self.tree[node] <= limit:
+            return None
+        if not blocked and pending + self.floor[node] > limit:
+            return None
+        if low == high:
+            return low
+        pending += self.lazy[node]
+        middle = (low + high) // 2
+        result = self._first(
+            2 * node, low, middle, first, limit, blocked, pending
+        )
+        if result is None:
+            result = self._first(
+                2 * node + 1, middle + 1, high, first, limit, blocked, pending
+            )
+        return result
+
+    def _update(self, start, end, quantity):
+        first, last = self._segments(start, end)
+        if first <= last:
+            self._add(1, 0, self.size - 1, first, last, quantity)
+
+    def add(self, start, end, quantity):
+        "Commit quantity over [start, end)"
+        if not start < end:
+            return
+        if start in self.bounds and end in self.bounds:
+            self.intervals.append((start, end, quantity))
+            self._update(start, end, quantity)
+        else:
+            # New bounds change the elementary segments
+            self._build(
+                self.intervals + [(start, end, quantity)], self.bounds
+            )
+
+    def remove(self, start, end, quantity):
+        "Release a quantity previously committed with add"
+        if not start < end:
+            return
+        self.intervals.remove((start, end, quantity))
+        self._update(start, end, -quantity)
+
+    def peak(self, start, end):
+        "Return the maximum quantity committed at any time in [start, end)"
+        if not self.size or not start < end:
+            return 0
+        first, last = self._segments(start, end)
+        if first > last:
+            return 0
+        return max(self._max(1, 0, self.size - 1, first, last), 0)
+
+    def free(self, capacity, start, end):
+        "Return the quantity out of capacity available over [start, end)"
+        return capacity - self.peak(start, end)
+
+    def first_free(self, capacity, quantity, duration, after):
+        """
+        Return the earliest start not before after from which quantity is
+        available for duration or None if it can never be.
+
+        The tree is descended to the first segment from the start which can
+        not hold quantity. If it begins after the window the start is
+        returned, otherwise the next start is the first segment after it
+        which can hold quantity. Each step is O(log n) and skips a whole run
+        of full segments.
+        """
+        if quantity > capacity:
+            return
+        limit = capacity - quantity
+        start = after
+        while self.size:
+            first = max(bisect_right(self.bounds, start) - 1, 0)
+            blocked = self._first(1, 0, self.size - 1, first, limit, True)
+            if blocked is None or start + duration <= self.bounds[blocked]:
+                break
+            free = self._first(1, 0, self.size - 1, blocked, limit, False)
+            if free is None:
+                # Nothing is committed after the last bound
+                free = self.size
+            start = self.bounds[free]
+        return start
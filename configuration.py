@@ -5,7 +5,11 @@
     :copyright: (c) 2015 by Fulfil.IO Inc.
     :license: see LICENSE.
 """
+from sql import Column, Null
+
 from trytond.model import ModelSingleton, ModelSQL, ModelView, fields
+from trytond.transaction import Transaction
+from trytond.cache import Cache
 
 __all__ = ['Configuration']
 
@@ -33,3 +37,124 @@ class Configuration(ModelSingleton, ModelSQL, ModelView):
         'stock.location', 'Rent Location', domain=[('type', '=', 'customer')],
         required=True,
     )
+    billing_chunk_size = fields.Integer(
+        'Billing Chunk Size', required=True,
+        help='Number of contracts billed and committed together by the '
+        'recurring billing'
+    )
+
+    overdue_batch_size = fields.Integer(
+        'Overdue Batch Size', required=True,
+        help='Number of contracts read and committed together by the '
+        'overdue check'
+    )
+    reservation_chunk_size = fields.Integer(
+        'Reservation Chunk Size',
+        help='If set, the contracts with more lines are reserved and '
+        'committed by chunks of this number of lines'
+    )
+    asynchronous_workflow = fields.Boolean(
+        'Asynchronous Workflow',
+        help='Queue the quote, reserve, activate and close buttons as jobs '
+        'run by the workers'
+    )
+    job_batch_size = fields.Integer(
+        'Job Batch Size', required=True,
+        help='Number of contracts processed by each job'
+    )
+    late_fee_product = fields.Many2One(
+        'product.product', 'Late Fee Product',
+        domain=[('type', '=', 'service')],
+        help='If set, the overdue check invoices late fees with this product'
+    )
+
+    _values_cache = Cache('rental.configuration.values', context=False)
+
+    # Fields which are not cached by get_cached
+    _cached_excluded = set([
+        'id', 'create_uid', 'create_date', 'write_uid', 'write_date',
+    ])
+
+    @classmethod
+    def __setup__(cls):
+        super(Configuration, cls).__setup__()
+        cls._error_messages.update({
+            'missing_rent_location': (
+                'The rent location must be set in the rental configuration.'
+            ),
+        })
+
+    @classmethod
+    def __register__(cls, module_name):
+        cursor = Transaction().cursor
+        table = cls.__table__()
+
+        super(Configuration, cls).__register__(module_name)
+
+        # Migration from 3.4.0.1: fill the required sizes
+        for name in [
+                'billing_chunk_size', 'overdue_batch_size', 'job_batch_size']:
+            column = Column(table, name)
+            cursor.execute(*table.update(
+                [column], [getattr(cls, 'default_%s' % name)()],
+                where=column == Null
+            ))
+
+    @classmethod
+    def create(cls, vlist):
+        configurations = super(Configuration, cls).create(vlist)
+        cls._values_cache.clear()
+        return configurations
+
+    @classmethod
+    def write(cls, *args):
+        super(Configuration, cls).write(*args)
+        cls._values_cache.clear()
+
+    @classmethod
+    def delete(cls, configurations):
+        super(Configuration, cls).delete(configurations)
+        cls._values_cache.clear()
+
+    @classmethod
+    def get_cached(cls):
+        """
+        Return the configuration built from the values cached per database
+        and company so it is read once until it is written
+        """
+        key = Transaction().context.get('company')
+        values = cls._values_cache.get(key)
+        if values is None:
+            configuration = cls(1)
+            values = {}
+            for name, field in cls._fields.iteritems():
+                if name in cls._cached_excluded or isinstance(field, (
+                            fields.Function, fields.One2Many,
+                            fields.Many2Many)):
+                    continue
+                value = getattr(configuration, name)
+                if isinstance(field, fields.Many2One):
+                    value = value.id if value else None
+                values[name] = value
+            cls._values_cache.set(key, values)
+        return cls(1, **values)
+
+    @classmethod
+    def get_rent_location(cls):
+        "Return the rent location of the configuration or raise an error"
+        location = cls.get_cached().rent_location
+        if not location:
+            cls.raise_user_error('missing_rent_location')
+        return location
+
+    @staticmethod
+    def default_billing_chunk_size():
+        return 500
+
+    @staticmethod
+    def default_overdue_batch_size():
+        return 1000
+
+    @staticmethod
+    def default_job_batch_size():
+        return 50
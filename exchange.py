@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+"""
+    exchange.py
+
+    Export and import of the rental contracts with their lines as JSON Lines.
+
+    :copyright: (c) 2015 by Fulfil.IO Inc.
+    :license: see LICENSE.
+"""
+import datetime
+import json
+from collections import defaultdict
+from decimal import Decimal
+
+from dateutil.parser import parse
+
+from trytond.pool import Pool
+from trytond.rpc import RPC
+from trytond.transaction import Transaction
+
+__all__ = ['ContractExchangeMixin']
+
+
+def json_default(value):
+    "Serialize the decimals, dates and datetimes in JSON"
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    raise TypeError('%r is not JSON serializable' % value)
+
+
+def parse_datetime(value):
+    "Return the datetime of the ISO formatted value or None"
+    if value:
+        return parse(value)
+
+
+class ContractExchangeMixin(object):
+    "Export and import of the rental contracts mixed in RentalContract"
+
+    @classmethod
+    def __setup__(cls):
+        super(ContractExchangeMixin, cls).__setup__()
+        cls.__rpc__.update({
+            'export_page': RPC(),
+            'import_jsonl': RPC(readonly=False),
+        })
+        cls._error_messages.update({
+            'import_missing': 'Missing %(field)s on line %(line)s.',
+            'import_reference': (
+                'Unknown %(field)s "%(value)s" on line %(line)s.'
+            ),
+            'import_ambiguous': (
+                'Ambiguous %(field)s "%(value)s" on line %(line)s.'
+            ),
+            'import_json': 'Invalid JSON on line %(line)s: %(error)s.',
+        })
+
+    def _get_export_values(self):
+        """
+        Return the values of the contract and of its lines to export. The
+        related records are referenced by their codes, the products and the
+        units also by their ids as their codes and symbols are not unique.
+        """
+        return {
+            'id': self.id,
+            'reference': self.reference,
+            'description': self.description,
+            'state': self.state,
+            'party': self.party.code,
+            'currency': self.currency.code,
+            'warehouse': self.warehouse.code if self.warehouse else None,
+            'start_date': self.start_date,
+            'end_date': self.end_date,
+            'billing_method': self.billing_method,
+            'billing_type': self.billing_type,
+            'billing_frequency': self.billing_frequency,
+            'lines': [{
+                'sequence': l.sequence,
+                'type': l.type,
+                'product': l.product.code if l.product else None,
+                'product_id': l.product.id if l.product else None,
+                'quantity': l.quantity,
+                'unit': l.unit.symbol if l.unit else None,
+                'unit_id': l.unit.id if l.unit else None,
+                'warehouse': l.warehouse.code if l.warehouse else None,
+                'unit_price': l.unit_price,
+                'description': l.description,
+                'note': l.note,
+            } for l in self.lines],
+        }
+
+    @classmethod
+    def _export_page(cls, domain, last_id, limit):
+        """
+        Return the JSON lines of the next limit contracts after last_id
+        matching domain and the id of the last one or None at the end
+        """
+        contracts = cls.search(
+            [('id', '>', last_id or 0)] + list(domain or []),
+            order=[('id', 'ASC')], limit=limit
+        )
+        if not contracts:
+            return [], None
+        return [
+            json.dumps(
+                c._get_export_values(), default=json_default, sort_keys=True
+            ) for c in contracts
+        ], contracts[-1].id
+
+    @classmethod
+    def iter_export(cls, domain=None, page_size=500):
+        """
+        Yield the contracts matching domain with their lines as JSON lines.
+        The contracts are read by pages of page_size with keyset pagination
+        on id so only one page is in memory.
+        """
+        last_id = 0
+        while last_id is not None:
+            lines, last_id = cls._export_page(domain, last_id, page_size)
+            for line in lines:
+                yield line
+
+    @classmethod
+    def export_page(cls, domain, last_id, limit):
+        """
+        Return a dictionary with the JSON Lines of the next limit contracts
+        after last_id and the last_id of the next call which is None at the
+        end
+        """
+        lines, last_id = cls._export_page(domain, last_id, limit)
+        return {
+            'data': '\n'.join(lines),
+            'last_id': last_id,
+        }
+
+    @classmethod
+    def _get_import_maps(cls, records):
+        """
+        Return the dictionaries of the lists of the records referenced by
+        the records to import by code and of the products and units by id,
+        read with one search per model
+        """
+        pool = Pool()
+        Party = pool.get('party.party')
+        Currency = pool.get('currency.currency')
+        Location = pool.get('stock.location')
+        Product = pool.get('product.product')
+        Uom = pool.get('product.uom')
+
+        lines = [l for r in records for l in r.get('lines', [])]
+
+        def codes(values, name):
+            return list(set(v[name] for v in values if v.get(name)))
+
+        def group(records, key):
+            grouped = defaultdict(list)
+            for record in records:
+                grouped[getattr(record, key)].append(record)
+            return grouped
+        products = Product.search([
+            ('code', 'in', codes(lines, 'product')),
+        ])
+        products_by_id = Product.search([
+            ('id', 'in', codes(lines, 'product_id')),
+        ])
+        units = Uom.search([
+            ('symbol', 'in', codes(lines, 'unit')),
+        ])
+        units_by_id = Uom.search([
+            ('id', 'in', codes(lines, 'unit_id')),
+        ])
+        return {
+            'party': group(Party.search([
+                ('code', 'in', codes(records, 'party')),
+            ]), 'code'),
+            'currency': group(Currency.search([
+                ('code', 'in', codes(records, 'currency')),
+            ]), 'code'),
+            'warehouse': group(Location.search([
+                ('code', 'in', codes(records + lines, 'warehouse')),
+                ('type', '=', 'warehouse'),
+            ]), 'code'),
+            'product': group(products, 'code'),
+            'product_id': dict((p.id, p) for p in products_by_id),
+            'unit': group(units, 'symbol'),
+            'unit_id': dict((u.id, u) for u in units_by_id),
+        }
+
+    @classmethod
+    def _import_lookup(cls, maps, name, values, number, required=False):
+        """
+        Return the record referenced by name in values or None.
+        The record is found by its code if it is unique and otherwise by
+        the id of name_id in values if there is one.
+        """
+        code = values.get(name)
+        records = maps[name].get(code, []) if code else []
+        if len(records) == 1:
+            return records[0]
+        id_ = values.get(name + '_id')
+        record = maps.get(name + '_id', {}).get(id_)
+        if record is not None:
+            return record
+        if records:
+            cls.raise_user_error('import_ambiguous', {
+                'field': name,
+                'value': code,
+                'line': number,
+            })
+        if not code and not id_:
+            if required:
+                cls.raise_user_error('import_missing', {
+                    'field': name,
+                    'line': number,
+                })
+            return None
+        cls.raise_user_error('import_reference', {
+            'field': name,
+            'value': code or id_,
+            'line': number,
+        })
+
+    @classmethod
+    def _get_import_line_values(cls, values, maps, number):
+        "Return the values of the contract line to create from values"
+        product = cls._import_lookup(
+            maps, 'product', values, number, required=True
+        )
+        unit = cls._import_lookup(maps, 'unit', values, number)
+        warehouse = cls._import_lookup(maps, 'warehouse', values, number)
+        return {
+            'sequence': values.get('sequence'),
+            'type': values.get('type') or 'line',
+            'product': product.id,
+            'quantity': values.get('quantity') or 0,
+            'unit': (unit or product.default_uom).id,
+            'warehouse': warehouse.id if warehouse else None,
+            'unit_price': Decimal(str(values.get('unit_price') or 0)),
+            'description': values.get('description') or product.rec_name,
+            'note': values.get('note'),
+        }
+
+    @classmethod
+    def _get_import_values(cls, values, maps, number):
+        """
+        Return the values of the draft contract with its lines to create
+        from values
+        """
+        User = Pool().get('res.user')
+
+        company = User(Transaction().user).company
+        party = cls._import_lookup(
+            maps, 'party', values, number, required=True
+        )
+        currency = (
+            cls._import_lookup(maps, 'currency', values, number)
+            or company.currency
+        )
+        warehouse = cls._import_lookup(maps, 'warehouse', values, number)
+        invoice_address = party.address_get(type='invoice')
+        shipment_address = party.address_get(type='delivery')
+        return {
+            'company': company.id,
+            'party': party.id,
+            'invoice_address': (
+                invoice_address.id if invoice_address else None
+            ),
+            'shipment_address': (
+                shipment_address.id if shipment_address else None
+            ),
+            'currency': currency.id,
+            'warehouse': warehouse.id if warehouse else None,
+            'description': values.get('description'),
+            'start_date': parse_datetime(values.get('start_date')),
+            'end_date': parse_datetime(values.get('end_date')),
+            'billing_method': (
+                values.get('billing_method') or cls.default_billing_method()
+            ),
+            'billing_type': (
+                values.get('billing_type') or cls.default_billing_type()
+            ),
+            'billing_frequency': (
+                values.get('billing_frequency')
+                or cls.default_billing_frequency()
+            ),
+            'lines': [('create', [
+                cls._get_import_line_values(l, maps, number)
+                for l in values.get('lines', [])
+            ])],
+        }
+
+    @classmethod
+    def _import_batch(cls, records):
+        """
+        Create the draft contracts with their lines of the batch of (line
+        number, values) with a single create call and return their ids
+        """
+        maps = cls._get_import_maps([r for _, r in records])
+        contracts = cls.create([
+            cls._get_import_values(values, maps, number)
+            for number, values in records
+        ])
+        return [c.id for c in contracts]
+
+    @classmethod
+    def import_jsonl(cls, lines, batch_size=500):
+        """
+        Create draft contracts with their lines from the JSON lines (a
+        string or an iterable of strings like a file) by batches of
+        batch_size and return their ids.
+        The parties, currencies and warehouses are referenced by code, the
+        products by code and the units by symbol or by id when they are
+        missing or ambiguous and they are read once per batch.
+        """
+        if isinstance(lines, basestring):
+            lines = lines.splitlines()
+        ids = []
+        batch = []
+        for number, line in enumerate(lines, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                values = json.loads(line)
+            except ValueError, exception:
+                cls.raise_user_error('import_json', {
+                    'line': number,
+                    'error': exception,
+                })
+            batch.append((number, values))
+            if len(batch) >= batch_size:
+                ids.extend(cls._import_batch(batch))
+                batch = []
+        if batch:
+            ids.extend(cls._import_batch(batch))
+        return ids
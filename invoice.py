@@ -16,5 +16,5 @@ class InvoiceLine:
     @classmethod
     def _get_origin(cls):
         models = super(InvoiceLine, cls)._get_origin()
-        models.append('rental.contract.line')
+        models.extend(['rental.contract', 'rental.contract.line'])
         return models
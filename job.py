@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+"""
+    job.py
+
+    :copyright: (c) 2015 by Fulfil.IO Inc.
+    :license: see LICENSE.
+"""
+import datetime
+import logging
+import traceback
+from functools import wraps
+
+from trytond import backend
+from trytond.model import ModelSQL, ModelView, fields
+from trytond.pool import Pool
+from trytond.transaction import Transaction
+
+__all__ = ['ContractJob', 'ContractJobContract', 'queued']
+
+logger = logging.getLogger(__name__)
+
+STATES = [
+    ('queued', 'Queued'),
+    ('running', 'Running'),
+    ('done', 'Done'),
+    ('failed', 'Failed'),
+]
+
+
+def queued(func):
+    '''
+    Enqueue the call of the workflow button on the contracts as jobs when
+    the workflow is asynchronous instead of running it
+    '''
+    @wraps(func)
+    def wrapper(cls, contracts):
+        Job = Pool().get('rental.contract.job')
+        if contracts and Job.is_asynchronous():
+            Job.enqueue(func.__name__, contracts)
+            return
+        return func(cls, contracts)
+    return wrapper
+
+
+class ContractJob(ModelSQL, ModelView):
+    'Rental Contract Job'
+    __name__ = 'rental.contract.job'
+
+    method = fields.Selection([
+        ('quote', 'Quote'),
+        ('reserve', 'Reserve'),
+        ('active', 'Activate'),
+        ('close', 'Close'),
+    ], 'Method', required=True, readonly=True)
+    contracts = fields.Many2Many(
+        'rental.contract.job-rental.contract', 'job', 'contract',
+        'Contracts', readonly=True
+    )
+    state = fields.Selection(
+        STATES, 'State', required=True, readonly=True, select=True
+    )
+    started = fields.DateTime('Started', readonly=True)
+    finished = fields.DateTime('Finished', readonly=True)
+    error = fields.Text('Error', readonly=True)
+
+    # Time after which a running job is considered lost with its worker
+    _running_timeout = datetime.timedelta(hours=1)
+
+    @classmethod
+    def __setup__(cls):
+        super(ContractJob, cls).__setup__()
+        cls._order.insert(0, ('id', 'DESC'))
+
+    @classmethod
+    def __register__(cls, module_name):
+        TableHandler = backend.get('TableHandler')
+        cursor = Transaction().cursor
+
+        super(ContractJob, cls).__register__(module_name)
+
+        table = TableHandler(cursor, cls, module_name)
+        table.index_action(['state', 'id'], 'add')
+
+    @staticmethod
+    def default_state():
+        return 'queued'
+
+    @staticmethod
+    def is_asynchronous():
+        "Return True if the workflow buttons must be enqueued"
+        Configuration = Pool().get('rental.configuration')
+
+        if Transaction().context.get('rental_job'):
+            return False
+        return bool(Configuration.get_cached().asynchronous_workflow)
+
+    @classmethod
+    def enqueue(cls, method, contracts):
+        """
+        Create the jobs running method on the contracts by batches of the
+        configured size and return them.
+        The contracts already queued or running for method are skipped,
+        unless their running job timed out.
+        """
+        Configuration = Pool().get('rental.configuration')
+
+        cls.fail_timed_out()
+        pending = set(
+            c.id for j in cls.search([
+                ('method', '=', method),
+                ('state', 'in', ['queued', 'running']),
+                ('contracts', 'in', [c.id for c in contracts]),
+            ]) for c in j.contracts
+        )
+        ids = [c.id for c in contracts if c.id not in pending]
+        size = Configuration.get_cached().job_batch_size
+        return cls.create([{
+            'method': method,
+            'contracts': [('add', ids[i:i + size])],
+        } for i in range(0, len(ids), size)])
+
+    @classmethod
+    def fail_timed_out(cls, now=None):
+        """
+        Mark as failed and return the jobs running for longer than the
+        timeout, their worker is assumed to have died
+        """
+        if now is None:
+            now = datetime.datetime.now()
+        jobs = cls.search([
+            ('state', '=', 'running'),
+            ('started', '<', now - cls._running_timeout),
+        ])
+        if jobs:
+            logger.warning(
+                'Rental contract jobs %s timed out',
+                ', '.join(str(j.id) for j in jobs)
+            )
+            cls.write(jobs, {
+                'state': 'failed',
+                'finished': now,
+                'error': 'The job did not finish within %s.'
+                % cls._running_timeout,
+            })
+        return jobs
+
+    @classmethod
+    def claim(cls, limit, commit=False):
+        """
+        Mark up to limit queued jobs as running and return their ids.
+        When commit is set the claim is committed so the concurrent workers
+        skip the jobs.
+        On PostgreSQL the jobs are claimed by a single update locking the
+        queued rows and skipping those locked by concurrent workers. A
+        worker losing the race on a row claims nothing and retries later.
+        """
+        DatabaseOperationalError = backend.get('DatabaseOperationalError')
+        cursor = Transaction().cursor
+        table = cls.__table__()
+        # The DateTime fields store no microseconds
+        now = datetime.datetime.now().replace(microsecond=0)
+
+        skip_locked = (
+            backend.name() == 'postgresql' and cursor.has_returning()
+        )
+        if skip_locked:  # pragma: no cover
+            try:
+                cursor.execute(
+                    'UPDATE "%(table)s" SET state = %%s, started = %%s '
+                    'WHERE id IN ('
+                    'SELECT id FROM "%(table)s" WHERE state = %%s '
+                    'ORDER BY id LIMIT %%s FOR UPDATE SKIP LOCKED) '
+                    'RETURNING id' % {'table': cls._table},
+                    ('running', now, 'queued', limit)
+                )
+                claimed = [job_id for job_id, in cursor.fetchall()]
+            except DatabaseOperationalError:
+                cursor.rollback()
+                return []
+        else:
+            # The other databases serialize the writing transactions
+            cursor.execute(*table.select(
+                table.id, where=table.state == 'queued',
+                order_by=table.id.asc, limit=limit
+            ))
+            claimed = [job_id for job_id, in cursor.fetchall()]
+            if claimed:
+                cursor.execute(*table.update(
+                    [table.state, table.started], ['running', now],
+                    where=table.id.in_(claimed)
+                ))
+        if commit:
+            cursor.commit()
+        return claimed
+
+    @classmethod
+    def run(cls, job_id, commit=False):
+        """
+        Run the claimed job as the user who queued it and store its result.
+        When commit is set the result is committed and the changes of a
+        failed job are rolled back before its error is stored.
+        The warnings can not be confirmed in a job so the methods check the
+        rental_job context key to skip them.
+        """
+        pool = Pool()
+        User = pool.get('res.user')
+        Contract = pool.get('rental.contract')
+        transaction = Transaction()
+        cursor = transaction.cursor
+
+        job = cls(job_id)
+        try:
+            with transaction.set_user(job.create_uid.id), \
+                    transaction.set_context(rental_job=True):
+                with transaction.set_context(
+                        User.get_preferences(context_only=True)):
+                    contracts = Contract.browse([c.id for c in job.contracts])
+                    getattr(Contract, job.method)(contracts)
+        except Exception:
+            error = traceback.format_exc()
+            if commit:
+                cursor.rollback()
+            logger.error('Rental contract job %s failed:\n%s', job_id, error)
+            values = {'state': 'failed', 'error': error}
+        else:
+            values = {'state': 'done', 'error': None}
+        values['finished'] = datetime.datetime.now()
+        cls.write([cls(job_id)], values)
+        if commit:
+            cursor.commit()
+
+    @classmethod
+    def process(cls, limit=None, commit=False):
+        """
+        Fail the timed out jobs, then claim and run the queued jobs one by
+        one until the queue is empty or limit jobs are run and return the
+        number of jobs run.
+        Each claim and each job is committed when commit is set.
+        """
+        cls.fail_timed_out()
+        count = 0
+        while limit is None or count < limit:
+            job_ids = cls.claim(1, commit=commit)
+            if not job_ids:
+                break
+            cls.run(job_ids[0], commit=commit)
+            count += 1
+        return count
+
+    @classmethod
+    def cron_process(cls):
+        "Run the queued jobs from the scheduler"
+        cls.process(commit=True)
+
+
+class ContractJobContract(ModelSQL):
+    'Rental Contract Job - Contract'
+    __name__ = 'rental.contract.job-rental.contract'
+    _table = 'rental_contract_job_contract_rel'
+
+    job = fields.Many2One(
+        'rental.contract.job', 'Job', ondelete='CASCADE', required=True,
+        select=True
+    )
+    contract = fields.Many2One(
+        'rental.contract', 'Contract', ondelete='CASCADE', required=True,
+        select=True
+    )
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+    price_list.py
+
+    :copyright: (c) 2015 by Fulfil.IO Inc.
+    :license: see LICENSE.
+"""
+from trytond.model import ModelSQL, ModelView, fields
+from trytond.pyson import Eval, If
+from trytond.transaction import Transaction
+from trytond.pool import Pool
+from trytond.cache import Cache
+
+__all__ = ['PriceList', 'PriceListLine']
+
+BILLING_METHODS = [
+    (None, ''),
+    ('hourly', 'Hourly'),
+    ('daily', 'Daily'),
+    ('weekly', 'Weekly'),
+    ('monthly', 'Monthly'),
+    ('yearly', 'Yearly'),
+]
+
+
+class CompiledPriceList(object):
+    """
+    Lookup structure of the rules of a price list.
+
+    The rules are bucketed by (product, billing method) where None matches
+    any value and each bucket is sorted by sequence, so a lookup only scans
+    the four buckets which can match and keeps the first rule by sequence.
+    A rule is a tuple (sequence, id, party, quantity, duration, rent).
+    """
+
+    def __init__(self, rules):
+        self.buckets = {}
+        for product, billing_method, rule in rules:
+            self.buckets.setdefault((product, billing_method), []).append(
+                rule
+            )
+        for rules in self.buckets.itervalues():
+            rules.sort()
+
+    def lookup(self, product, billing_method, party, quantity, duration):
+        "Return the rent of the first matching rule or None"
+        found = None
+        for key in (
+                (product, billing_method), (product, None),
+                (None, billing_method), (None, None)):
+            for rule in self.buckets.get(key, []):
+                if found and rule[:2] > found[:2]:
+                    break
+                _, _, rule_party, rule_quantity, rule_duration, _ = rule
+                if ((rule_party is None or rule_party == party)
+                        and quantity >= rule_quantity
+                        and duration >= rule_duration):
+                    found = rule
+                    break
+        if found:
+            return found[-1]
+
+
+class PriceList(ModelSQL, ModelView):
+    'Rental Price List'
+    __name__ = 'rental.price_list'
+
+    name = fields.Char('Name', required=True, translate=True)
+    company = fields.Many2One(
+        'company.company', 'Company', required=True, select=True,
+        domain=[
+            ('id', If(Eval('context', {}).contains('company'), '=', '!='),
+                Eval('context', {}).get('company', -1)),
+        ]
+    )
+    lines = fields.One2Many('rental.price_list.line', 'price_list', 'Lines')
+
+    _compiled_cache = Cache('rental.price_list.compiled', context=False)
+
+    @staticmethod
+    def default_company():
+        return Transaction().context.get('company')
+
+    @classmethod
+    def create(cls, vlist):
+        price_lists = super(PriceList, cls).create(vlist)
+        cls._compiled_cache.clear()
+        return price_lists
+
+    @classmethod
+    def write(cls, *args):
+        super(PriceList, cls).write(*args)
+        cls._compiled_cache.clear()
+
+    @classmethod
+    def delete(cls, price_lists):
+        super(PriceList, cls).delete(price_lists)
+        cls._compiled_cache.clear()
+
+    def compile(self):
+        "Return the CompiledPriceList of the price list"
+        compiled = self._compiled_cache.get(self.id)
+        if compiled is None:
+            compiled = CompiledPriceList([
+                (
+                    l.product.id if l.product else None,
+                    l.billing_method,
+                    (
+                        l.sequence or 0, l.id,
+                        l.party.id if l.party else None,
+                        l.quantity or 0, l.duration or 0, l.rent,
+                    ),
+                ) for l in self.lines
+            ])
+            self._compiled_cache.set(self.id, compiled)
+        return compiled
+
+    def compute_rents(
+            self, products, quantity, party, billing_method, duration):
+        """
+        Return a dictionary with the product ids as keys and the rent of the
+        first matching rule or None as values
+        """
+        compiled = self.compile()
+        party_id = party.id if party else None
+        return dict(
+            (p.id, compiled.lookup(
+                p.id, billing_method, party_id, quantity, duration
+            ))
+            for p in products
+        )
+
+
+class PriceListLine(ModelSQL, ModelView):
+    'Rental Price List Line'
+    __name__ = 'rental.price_list.line'
+
+    price_list = fields.Many2One(
+        'rental.price_list', 'Price List', required=True, select=True,
+        ondelete='CASCADE'
+    )
+    sequence = fields.Integer('Sequence')
+    party = fields.Many2One(
+        'party.party', 'Party', help='Leave empty for all parties'
+    )
+    product = fields.Many2One(
+        'product.product', 'Product', domain=[('rentable', '=', True)],
+        help='Leave empty for all products'
+    )
+    billing_method = fields.Selection(
+        BILLING_METHODS, 'Billing Method', sort=False,
+        help='Leave empty for all billing methods'
+    )
+    quantity = fields.Float(
+        'Minimal Quantity', required=True,
+        help='The rule applies from this quantity'
+    )
+    duration = fields.Integer(
+        'Minimal Duration', required=True,
+        help='The rule applies from this number of billing method units'
+    )
+    rent = fields.Numeric('Rent', digits=(16, 4), required=True)
+
+    @classmethod
+    def __setup__(cls):
+        super(PriceListLine, cls).__setup__()
+        cls._order.insert(0, ('sequence', 'ASC'))
+
+    @staticmethod
+    def default_quantity():
+        return 0
+
+    @staticmethod
+    def default_duration():
+        return 0
+
+    @classmethod
+    def create(cls, vlist):
+        lines = super(PriceListLine, cls).create(vlist)
+        Pool().get('rental.price_list')._compiled_cache.clear()
+        return lines
+
+    @classmethod
+    def write(cls, *args):
+        super(PriceListLine, cls).write(*args)
+        Pool().get('rental.price_list')._compiled_cache.clear()
+
+    @classmethod
+    def delete(cls, lines):
+        super(PriceListLine, cls).delete(lines)
+        Pool().get('rental.price_list')._compiled_cache.clear()
@@ -6,15 +6,25 @@
     :license: see LICENSE.
 """
 from decimal import Decimal
+from weakref import WeakKeyDictionary
+
+from sql import Null
 
 from trytond.pool import PoolMeta, Pool
 from trytond.model import fields
 from trytond.pyson import Eval, Bool, Not
 from trytond.transaction import Transaction
+from trytond.cache import Cache, LRUDict
+
+from availability import IntervalIndex
 
 __metaclass__ = PoolMeta
 __all__ = ['Template', 'Product']
 
+# Exchange rates used by Product.get_rent kept per transaction cursor
+RENT_RATES_CACHE_SIZE = 128
+_rent_rates = WeakKeyDictionary()
+
 STATES = {
     'required': Bool(Eval('rentable')),
     'invisible': Not(Bool(Eval('rentable'))),
@@ -29,6 +39,12 @@ class Template:
             'readonly': ~Eval('active', True),
         }, depends=['active']
     )
+    rental_serialized = fields.Boolean(
+        'Serialized Rental', states={
+            'invisible': Not(Bool(Eval('rentable'))),
+        }, depends=['rentable'],
+        help='Track the rented units with rental assets'
+    )
     rent_hourly = fields.Numeric(
         'Rent Hourly', digits=(16, 4), states=STATES,
         depends=['rentable'],
@@ -74,37 +90,230 @@ class Template:
 class Product:
     __name__ = 'product.product'
 
+    _rental_index_cache = Cache(
+        'product.product.rental_index', context=False
+    )
+
+    @classmethod
+    def clear_rental_index(cls):
+        "Invalidate the rental interval indexes of all the processes"
+        cls._rental_index_cache.clear()
+
+    @classmethod
+    def _get_rental_intervals(cls, product_ids, states=None, exclude=None):
+        """
+        Return a dictionary with the product ids as keys and the list of
+        (start, end, quantity) committed by the rental contract lines in
+        the default unit of the product as values.
+        states are the states of the contracts which commit the products,
+        by default the committed states of the contracts. The quotations
+        with committed chunks of reservation commit them too. The contracts
+        of the ids in exclude are skipped.
+        """
+        pool = Pool()
+        Contract = pool.get('rental.contract')
+        ContractLine = pool.get('rental.contract.line')
+        Uom = pool.get('product.uom')
+        cursor = Transaction().cursor
+
+        contract = Contract.__table__()
+        line = ContractLine.__table__()
+        if states is None:
+            states = Contract._rental_committed_states
+
+        where = (
+            (contract.start_date != Null) & (contract.end_date != Null)
+            & (line.quantity > 0)
+            & (contract.state.in_(list(states))
+                | ((contract.state == 'quotation')
+                    & (contract.reserved_line != Null)))
+        )
+        if exclude:
+            where &= ~contract.id.in_(list(exclude))
+
+        result = dict((i, []) for i in product_ids)
+        products = dict((p.id, p) for p in cls.browse(product_ids))
+        for i in range(0, len(product_ids), cursor.IN_MAX):
+            sub_ids = product_ids[i:i + cursor.IN_MAX]
+            cursor.execute(*line.join(
+                contract, condition=line.rental_contract == contract.id
+            ).select(
+                line.product, contract.start_date, contract.end_date,
+                line.quantity, line.unit,
+                where=line.product.in_(sub_ids) & where
+            ))
+            for product_id, start, end, quantity, unit_id in cursor.fetchall():
+                product = products[product_id]
+                if unit_id and unit_id != product.default_uom.id:
+                    quantity = Uom.compute_qty(
+                        Uom(unit_id), quantity, product.default_uom
+                    )
+                result[product_id].append((start, end, quantity))
+        return result
+
+    @classmethod
+    def get_rental_index(cls, products):
+        """
+        Return a dictionary with the product ids as keys and the IntervalIndex
+        of the quantities committed on rental contracts as values.
+
+        The indexes are cached and built at once for the missing products.
+        """
+        indexes = {}
+        missing = []
+        for product in products:
+            index = cls._rental_index_cache.get(product.id)
+            if index is None:
+                missing.append(product.id)
+            else:
+                indexes[product.id] = index
+        if missing:
+            for product_id, intervals in \
+                    cls._get_rental_intervals(missing).iteritems():
+                index = IntervalIndex(intervals)
+                cls._rental_index_cache.set(product_id, index)
+                indexes[product_id] = index
+        return indexes
+
+    @classmethod
+    def get_rental_capacity(cls, products):
+        """
+        Return the number of units of each product owned for rental: the
+        units in stock in the warehouses (or the locations of the context)
+        and the units out on rent
+        """
+        pool = Pool()
+        Location = pool.get('stock.location')
+        Configuration = pool.get('rental.configuration')
+
+        location_ids = Transaction().context.get('locations')
+        if not location_ids:
+            location_ids = [
+                w.storage_location.id
+                for w in Location.search([('type', '=', 'warehouse')])
+            ]
+        location_ids = list(location_ids) + [
+            Configuration.get_rent_location().id
+        ]
+        product_ids = [p.id for p in products]
+        capacities = dict((i, 0) for i in product_ids)
+        with Transaction().set_context(stock_date_end=None):
+            quantities = cls.products_by_location(
+                location_ids, product_ids, with_childs=True
+            )
+        for (_, product_id), quantity in quantities.iteritems():
+            capacities[product_id] += quantity
+        return capacities
+
+    @classmethod
+    def get_rental_availability(cls, products, start, end):
+        """
+        Return a dictionary with the product ids as keys and the quantity
+        which is free to rent over the whole period [start, end) as values
+        """
+        indexes = cls.get_rental_index(products)
+        capacities = cls.get_rental_capacity(products)
+        return dict(
+            (p.id, indexes[p.id].free(capacities[p.id], start, end))
+            for p in products
+        )
+
+    @classmethod
+    def get_rental_slot(cls, products, quantity, duration, after):
+        """
+        Return a dictionary with the product ids as keys and the first start
+        not before after at which quantity is free to rent for duration (a
+        timedelta) as values or None if there is not enough units
+        """
+        indexes = cls.get_rental_index(products)
+        capacities = cls.get_rental_capacity(products)
+        return dict(
+            (p.id, indexes[p.id].first_free(
+                capacities[p.id], quantity, duration, after
+            ))
+            for p in products
+        )
+
     @staticmethod
-    def get_rent(products, quantity=0):
+    def _get_rent_rates():
+        "Return the exchange rate cache of the current transaction"
+        cursor = Transaction().cursor
+        rates = _rent_rates.get(cursor)
+        if rates is None:
+            rates = _rent_rates[cursor] = LRUDict(RENT_RATES_CACHE_SIZE)
+        return rates
+
+    @classmethod
+    def _get_rent_rate(cls, from_currency, to_currency, date):
+        "Return the rate to convert rents from_currency to_currency at date"
+        Currency = Pool().get('currency.currency')
+
+        rates = cls._get_rent_rates()
+        key = (from_currency.id, to_currency.id, date)
+        if key not in rates:
+            with Transaction().set_context(date=date):
+                rates[key] = Currency.compute(
+                    from_currency, Decimal(1), to_currency, round=False
+                )
+        return rates[key]
+
+    @classmethod
+    def _get_price_list_rents(cls, products, quantity):
+        """
+        Return a dictionary with the product ids as keys and the rent of the
+        price list of the context as values for the products which have one
+        """
+        pool = Pool()
+        PriceList = pool.get('rental.price_list')
+        Party = pool.get('party.party')
+
+        context = Transaction().context
+        if not context.get('price_list'):
+            return {}
+        party = None
+        if context.get('customer'):
+            party = Party(context['customer'])
+        rents = PriceList(context['price_list']).compute_rents(
+            products, quantity, party, context.get('billing_method'),
+            context.get('rental_duration') or 0
+        )
+        return dict((k, v) for k, v in rents.iteritems() if v is not None)
+
+    @classmethod
+    def get_rent(cls, products, quantity=0):
         '''
         Return the rent price for products and quantity.
         It uses if exists from the context:
             currency: the currency id for the returned price
             billing_method: hourly, daily, weekly, monthly, yearly
+            price_list: the rental price list which overrides the rents
+            customer: the party for the price list
+            rental_duration: the duration for the price list
+
+        The exchange rate is resolved once for all the products.
         '''
         User = Pool().get('res.user')
         Currency = Pool().get('currency.currency')
         Date = Pool().get('ir.date')
 
-        today = Date.today()
-        prices = {}
+        context = Transaction().context
+        field_name = 'rent_%s' % context.get('billing_method')
+        prices = dict(
+            (product.id, getattr(product, field_name))
+            for product in products
+        )
+        prices.update(cls._get_price_list_rents(products, quantity))
 
-        currency = None
-        if Transaction().context.get('currency'):
-            currency = Currency(Transaction().context.get('currency'))
+        if not context.get('currency') or not prices:
+            return prices
+        currency = Currency(context['currency'])
+        company = User(Transaction().user).company
+        if not company or company.currency == currency:
+            return prices
 
-        user = User(Transaction().user)
-
-        for product in products:
-            prices[product.id] = getattr(
-                product, 'rent_%s' % Transaction().context.get('billing_method')
-            )
-            if currency and user.company:
-                if user.company.currency != currency:
-                    date = Transaction().context.get('contract_start_date') or \
-                        today
-                    with Transaction().set_context(date=date):
-                        prices[product.id] = Currency.compute(
-                            user.company.currency, prices[product.id],
-                            currency, round=False)
+        date = context.get('contract_start_date') or Date.today()
+        rate = cls._get_rent_rate(company.currency, currency, date)
+        for product_id, price in prices.items():
+            if price is not None:
+                prices[product_id] = price * rate
         return prices
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+    profiling.py
+
+    Optional instrumentation of the rental contract workflow.
+
+    It is enabled with the ``profile`` option of the ``rental`` section of
+    the trytond configuration file or with ``enable()``. When disabled the
+    decorated methods only pay for one global lookup. When enabled, each
+    process logs and drops its statistics every ``profile_log_interval``
+    seconds, 3600 by default and 0 to never log them.
+
+    :copyright: (c) 2015 by Fulfil.IO Inc.
+    :license: see LICENSE.
+"""
+import logging
+import time
+from bisect import bisect_left
+from functools import wraps
+from threading import Lock
+
+from trytond.config import config
+from trytond.transaction import Transaction
+
+__all__ = [
+    'profile', 'enable', 'snapshot', 'reset', 'log_summary', 'log_periodically',
+]
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in milliseconds of the buckets of the time histograms, the
+# last bucket counts the slower calls
+BUCKETS = [2 ** i for i in range(17)]
+
+ENABLED = config.getboolean('rental', 'profile', default=False)
+LOG_INTERVAL = config.getint('rental', 'profile_log_interval', default=3600)
+
+
+class Statistics(object):
+    '''
+    Aggregated measures of one instrumented method
+    '''
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.
+        self.queries = 0
+        self.records = 0
+        self.histogram = [0] * (len(BUCKETS) + 1)
+
+    def add(self, seconds, queries, records):
+        self.calls += 1
+        self.seconds += seconds
+        self.queries += queries
+        self.records += records
+        self.histogram[bisect_left(BUCKETS, seconds * 1000)] += 1
+
+    def as_dict(self):
+        return {
+            'calls': self.calls,
+            'seconds': self.seconds,
+            'queries': self.queries,
+            'records': self.records,
+            'histogram': dict(
+                (str(bound), count) for bound, count in zip(
+                    BUCKETS + ['inf'], self.histogram
+                ) if count
+            ),
+        }
+
+
+_statistics = {}
+_lock = Lock()
+_last_log = time.time()
+
+
+def enable(value=True):
+    "Turn the instrumentation on or off"
+    global ENABLED
+    ENABLED = value
+
+
+def record(name, seconds, queries, records):
+    "Add a measure to the statistics of name"
+    with _lock:
+        statistics = _statistics.get(name)
+        if statistics is None:
+            statistics = _statistics[name] = Statistics()
+        statistics.add(seconds, queries, records)
+
+
+def snapshot(clear=False):
+    "Return the statistics as a dictionary by method name and drop if clear"
+    with _lock:
+        result = dict((n, s.as_dict()) for n, s in _statistics.iteritems())
+        if clear:
+            _statistics.clear()
+        return result
+
+
+def reset():
+    "Drop the statistics"
+    with _lock:
+        _statistics.clear()
+
+
+def log_summary(level=logging.INFO, clear=False):
+    "Log one line of statistics by method and drop them if clear"
+    for name, values in sorted(snapshot(clear=clear).iteritems()):
+        logger.log(
+            level, '%s: %s calls, %.3fs, %s queries, %s records, '
+            'histogram (ms) %s', name, values['calls'], values['seconds'],
+            values['queries'], values['records'], values['histogram']
+        )
+
+
+def log_periodically(now):
+    """
+    Log and drop the statistics if LOG_INTERVAL seconds passed since the
+    last time at now
+    """
+    global _last_log
+    if not LOG_INTERVAL or now - _last_log < LOG_INTERVAL:
+        return
+    with _lock:
+        if now - _last_log < LOG_INTERVAL:
+            return
+        _last_log = now
+    log_summary(clear=True)
+
+
+def query_count(cursor):
+    '''
+    Return the number of queries executed by the cursor since it has been
+    instrumented
+    '''
+    counting = getattr(cursor, '_rental_counting', None)
+    if counting is None or cursor.execute is not counting:
+        execute = cursor.execute
+
+        def counting(*args, **kwargs):
+            cursor._rental_queries += 1
+            return execute(*args, **kwargs)
+        cursor._rental_counting = counting
+        cursor._rental_queries = getattr(cursor, '_rental_queries', 0)
+        cursor.execute = counting
+    return cursor._rental_queries
+
+
+def count_records(args):
+    "Return the length of the first list of the arguments or 1"
+    for arg in args:
+        if isinstance(arg, (list, tuple)):
+            return len(arg)
+    return 1
+
+
+def profile(func):
+    '''
+    Measure the wall time, the number of SQL queries and the number of
+    records of every call of the method when the instrumentation is enabled
+    '''
+    name = func.__name__
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if not ENABLED:
+            return func(*args, **kwargs)
+        cursor = Transaction().cursor
+        queries = query_count(cursor)
+        start = time.time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            seconds = time.time() - start
+            queries = query_count(cursor) - queries
+            records = count_records(args[1:])
+            record(name, seconds, queries, records)
+            logger.debug(
+                '%s: %.3fs, %s queries, %s records',
+                name, seconds, queries, records
+            )
+            log_periodically(start + seconds)
+    return wrapper
@@ -5,20 +5,170 @@
     :copyright: (c) 2015 by Fulfil.IO Inc.
     :license: see LICENSE.
 """
+import datetime
 from decimal import Decimal
-from itertools import groupby, chain
-from functools import partial
+import logging
+from collections import OrderedDict, defaultdict
+from hashlib import md5
+from itertools import chain
 
+from dateutil.relativedelta import relativedelta
+
+from sql import Null, Cast
+from sql.aggregate import Sum
+from sql.conditionals import Case, Coalesce, Greatest
+from sql.functions import Function, Extract, Floor, Round
+from sql.operators import Concat, BinaryOperator, Exists
+
+from trytond import backend
 from trytond.model import Workflow, ModelSQL, ModelView, fields
+from trytond.wizard import Wizard, StateView, StateTransition, Button
 from trytond.pyson import Eval, If, Bool
+from trytond.tools import reduce_ids
 from trytond.transaction import Transaction
 from trytond.pool import Pool
 
+from availability import IntervalIndex
+from profiling import profile
+from job import queued
+from exchange import ContractExchangeMixin
+
+
+__all__ = [
+    'RentalContract', 'RentalContractLine',
+    'BillContractStart', 'BillContract',
+    'RenewContractStart', 'RenewContract',
+]
+
+logger = logging.getLogger(__name__)
+
+BILLING_DELTAS = {
+    'hourly': 'hours',
+    'daily': 'days',
+    'weekly': 'weeks',
+    'monthly': 'months',
+    'yearly': 'years',
+}
+
+
+# Number of seconds of a unit of each billing method, ordered so the SQL
+# expression of the duration is the same as the one of its index
+BILLING_SECONDS = OrderedDict((
+    ('hourly', 3600),
+    ('daily', 24 * 3600),
+    ('weekly', 7 * 24 * 3600),
+    ('monthly', 30 * 24 * 3600),
+    ('yearly', 365 * 24 * 3600),
+))
+
+
+class JulianDay(Function):
+    __slots__ = ()
+    _function = 'JULIANDAY'
+
+
+def compute_duration(billing_method, start_date, end_date):
+    "Return the number of whole billing_method units between the dates"
+    if not (end_date and start_date) or billing_method not in BILLING_SECONDS:
+        return 0
+
+    timedelta = end_date - start_date
+    seconds = timedelta.days * 24 * 3600 + timedelta.seconds
+    return int(seconds // BILLING_SECONDS[billing_method])
+
+
+def period_duration(billing_method, start_date, end_date):
+    """
+    Return the number of whole billing_method units between the dates
+    counted in calendar units like the boundaries of the billing periods
+    """
+    if not (end_date and start_date) or billing_method not in BILLING_DELTAS:
+        return 0
+
+    delta = BILLING_DELTAS[billing_method]
+    units = 0
+    while start_date + relativedelta(**{delta: units + 1}) <= end_date:
+        units += 1
+    return units
+
+
+def reference(Model, table):
+    """
+    Return the SQL expression of the reference value pointing to the
+    records of table, as stored in Reference columns like origin
+    """
+    return Concat(Model.__name__ + ',', Cast(table.id, 'VARCHAR'))
+
+
+def duration_column(table):
+    """
+    Return the SQL expression of the duration of the contracts of table,
+    it matches compute_duration which rounds down also the negative ones
+    """
+    if backend.name() == 'sqlite':
+        seconds = Round(
+            (JulianDay(table.end_date) - JulianDay(table.start_date))
+            * (24 * 3600)
+        )
+
+        # SQLite has no FLOOR and the cast truncates toward zero
+        def whole(value):
+            truncated = Cast(value, 'INTEGER')
+            return truncated - Case((value < truncated, 1), else_=0)
+    else:
+        seconds = Extract('EPOCH', table.end_date - table.start_date)
+
+        def whole(value):
+            return Cast(Floor(value), 'INTEGER')
+
+    return Coalesce(Case(*[
+        (table.billing_method == method, whole(seconds / unit))
+        for method, unit in BILLING_SECONDS.iteritems()
+    ], else_=0), 0)
+
+
+class TsRange(Function):
+    __slots__ = ()
+    _function = 'TSRANGE'
+
+
+class Overlap(BinaryOperator):
+    __slots__ = ()
+    _operator = '&&'
+
 
-__all__ = ['RentalContract', 'RentalContractLine']
+def period_column(table):
+    """
+    Return the SQL range of the period of the contracts of table as indexed
+    on PostgreSQL
+    """
+    return TsRange(
+        table.start_date, Greatest(table.start_date, table.end_date)
+    )
+
+
+def overlap_where(table, start, end):
+    """
+    Return the SQL condition of the contracts of table with a period
+    overlapping [start, end). On PostgreSQL it uses the range index of the
+    period and on other backends the index on the dates.
+    """
+    where = (table.start_date != Null) & (table.end_date != Null)
+    if backend.name() == 'postgresql':  # pragma: no cover
+        return where & Overlap(period_column(table), TsRange(start, end))
+    return where & (table.start_date < end) & (table.end_date > start)
 
 
-class RentalContract(Workflow, ModelSQL, ModelView):
+def field_values(record, names):
+    "Return the values of the fields of record with the ids of the records"
+    result = {}
+    for name in names:
+        value = getattr(record, name)
+        result[name] = getattr(value, 'id', value)
+    return result
+
+
+class RentalContract(ContractExchangeMixin, Workflow, ModelSQL, ModelView):
     'Rental Contract'
     __name__ = 'rental.contract'
     _rec_name = 'reference'
@@ -82,6 +232,11 @@ class RentalContract(Workflow, ModelSQL, ModelView):
         domain=[('type', '=', 'warehouse')], states={
             'readonly': Eval('state') != 'draft',
         }, depends=['state'])
+    price_list = fields.Many2One(
+        'rental.price_list', 'Price List',
+        domain=[('company', '=', Eval('company'))], states={
+            'readonly': Eval('state') != 'draft',
+        }, depends=['state', 'company'])
 
     start_date = fields.DateTime(
         'Start Date', depends=['state'], states={
@@ -96,7 +251,15 @@ class RentalContract(Workflow, ModelSQL, ModelView):
         }
     )
     duration = fields.Function(
-        fields.Integer('Duration'), 'on_change_with_duration'
+        fields.Integer('Duration'), 'get_duration',
+        searcher='search_duration'
+    )
+    period = fields.Function(
+        fields.Char(
+            'Period',
+            help='Search with "=" and a (start, end) value for the periods '
+            'overlapping it'
+        ), 'get_period', searcher='search_period'
     )
 
     billing_method = fields.Selection([
@@ -108,6 +271,49 @@ class RentalContract(Workflow, ModelSQL, ModelView):
     ], 'Billing Method', required=True, select=True, states={
         'readonly': ~Eval('state').in_(['draft', 'quotation']),
     })
+    billing_type = fields.Selection([
+        ('one_time', 'One Time'),
+        ('recurring', 'Recurring'),
+    ], 'Billing Type', required=True, states={
+        'readonly': ~Eval('state').in_(['draft', 'quotation']),
+    }, depends=['state'])
+    billing_frequency = fields.Integer(
+        'Billing Frequency', states={
+            'readonly': ~Eval('state').in_(['draft', 'quotation']),
+            'required': Eval('billing_type') == 'recurring',
+            'invisible': Eval('billing_type') != 'recurring',
+        }, depends=['state', 'billing_type'],
+        help='The number of billing method units invoiced per period'
+    )
+    next_billing_date = fields.Date(
+        'Next Billing Date', readonly=True, select=True, states={
+            'invisible': Eval('billing_type') != 'recurring',
+        }, depends=['billing_type']
+    )
+    overdue = fields.Boolean(
+        'Overdue', readonly=True, select=True,
+        help='The contract is active after its end date and the products '
+        'are not returned yet'
+    )
+    late_fee_until = fields.DateTime('Late Fees Until', readonly=True)
+    late_fee_lines = fields.One2Many(
+        'account.invoice.line', 'origin', 'Late Fee Lines', readonly=True
+    )
+    reserved_line = fields.Integer(
+        'Reserved Until Line', readonly=True,
+        help='The id of the last line reserved by chunks'
+    )
+    reservation_invoice = fields.Many2One(
+        'account.invoice', 'Reservation Invoice', readonly=True,
+        help='The invoice of the lines reserved by chunks'
+    )
+    jobs = fields.Many2Many(
+        'rental.contract.job-rental.contract', 'contract', 'job', 'Jobs',
+        readonly=True
+    )
+    renewed_from = fields.Many2One(
+        'rental.contract', 'Renewed From', readonly=True, select=True
+    )
 
     lines = fields.One2Many(
         'rental.contract.line', 'rental_contract', 'Lines', states={
@@ -130,9 +336,61 @@ class RentalContract(Workflow, ModelSQL, ModelView):
         fields.One2Many('stock.move', None, 'Moves'),
         'get_moves'
     )
+    currency_digits = fields.Function(
+        fields.Integer('Currency Digits'), 'on_change_with_currency_digits'
+    )
+    untaxed_amount = fields.Numeric(
+        'Untaxed', digits=(16, Eval('currency_digits', 2)), readonly=True,
+        select=True, depends=['currency_digits']
+    )
+    tax_amount = fields.Numeric(
+        'Tax', digits=(16, Eval('currency_digits', 2)), readonly=True,
+        select=True, depends=['currency_digits']
+    )
+    total_amount = fields.Numeric(
+        'Total', digits=(16, Eval('currency_digits', 2)), readonly=True,
+        select=True, depends=['currency_digits']
+    )
 
-    def get_moves(self, name):
-        return [m.id for l in self.lines for m in l.moves]
+    @classmethod
+    def _get_related_ids(cls, contracts, from_, key, column, where=None):
+        """
+        Return a dictionary with the contract ids as keys and the list of
+        distinct values of column as values using a single query per chunk
+        of contracts.
+
+        from_ must be a join including the column key of the contract ids.
+        """
+        cursor = Transaction().cursor
+
+        result = dict((c.id, []) for c in contracts)
+        ids = result.keys()
+        for i in range(0, len(ids), cursor.IN_MAX):
+            sub_ids = ids[i:i + cursor.IN_MAX]
+            red_sql = reduce_ids(key, sub_ids)
+            if where is not None:
+                red_sql &= where
+            cursor.execute(*from_.select(
+                key, column, where=red_sql, group_by=[key, column]
+            ))
+            for contract_id, related_id in cursor.fetchall():
+                result[contract_id].append(related_id)
+        return result
+
+    @classmethod
+    def get_moves(cls, contracts, name):
+        pool = Pool()
+        ContractLine = pool.get('rental.contract.line')
+        Move = pool.get('stock.move')
+
+        line = ContractLine.__table__()
+        move = Move.__table__()
+        from_ = line.join(
+            move, condition=move.origin == reference(ContractLine, line)
+        )
+        return cls._get_related_ids(
+            contracts, from_, line.rental_contract, move.id
+        )
 
     def search_shipments_returns(model_name):
         def method(self, name, clause):
@@ -149,19 +407,240 @@ class RentalContract(Workflow, ModelSQL, ModelView):
 
     def get_shipments_returns(model_name):
         "Computes the returns or shipments"
-        def method(self, name):
-            Model = Pool().get(model_name)
-            shipments = set()
-            for line in self.lines:
-                for move in line.moves:
-                    if isinstance(move.shipment, Model):
-                        shipments.add(move.shipment.id)
-            return list(shipments)
-        return method
+        def method(cls, contracts, name):
+            pool = Pool()
+            ContractLine = pool.get('rental.contract.line')
+            Move = pool.get('stock.move')
+            Shipment = pool.get(model_name)
+
+            line = ContractLine.__table__()
+            move = Move.__table__()
+            shipment = Shipment.__table__()
+            from_ = line.join(
+                move, condition=move.origin == reference(ContractLine, line)
+            ).join(
+                shipment, condition=move.shipment == reference(
+                    Shipment, shipment
+                )
+            )
+            return cls._get_related_ids(
+                contracts, from_, line.rental_contract, shipment.id
+            )
+        return classmethod(method)
 
     get_shipments = get_shipments_returns('stock.shipment.out')
     get_shipment_returns = get_shipments_returns('stock.shipment.out.return')
 
+    # States in which the lines commit products for the period of the
+    # contract
+    _rental_committed_states = ('quotation', 'reservation', 'active')
+
+    # Fields copied to the successor of a renewed contract
+    _renewal_fields = [
+        'company', 'currency', 'description', 'party', 'invoice_address',
+        'shipment_address', 'warehouse', 'price_list', 'billing_method',
+        'billing_type', 'billing_frequency',
+    ]
+
+    # States of the contracts which can be renewed and extended
+    _renewal_states = ('reservation', 'active', 'close')
+    _extension_states = ('draft', 'quotation', 'reservation', 'active')
+
+    # States in which the lines hold products against other reservations
+    _rental_reserved_states = ('reservation', 'active')
+
+    # Number of days of the time buckets locked per product by reservations
+    _reservation_lock_days = 7
+
+    # Fields which change the quantities committed on the products
+    _rental_index_fields = set(['state', 'start_date', 'end_date'])
+
+    # Fields which change the stored amounts
+    _amount_fields = set([
+        'start_date', 'end_date', 'billing_method', 'currency',
+    ])
+
+    # Fields which change the utilization buckets, the state changes them
+    # only when the contract enters or leaves the reported states
+    _utilization_fields = set([
+        'start_date', 'end_date', 'billing_method', 'currency', 'warehouse',
+    ])
+
+    @classmethod
+    def __register__(cls, module_name):
+        TableHandler = backend.get('TableHandler')
+        cursor = Transaction().cursor
+
+        super(RentalContract, cls).__register__(module_name)
+
+        table = TableHandler(cursor, cls, module_name)
+        # The duration can not use an index on the columns, it is indexed
+        # by its expression on PostgreSQL
+        table.index_action(
+            ['billing_method', 'start_date', 'end_date'], 'remove'
+        )
+        table.index_action(['start_date', 'end_date'], 'add')
+        table.index_action(['state', 'end_date'], 'add')
+
+        if backend.name() == 'postgresql':  # pragma: no cover
+            # Migration from 3.4.0.1: the duration index was built from the
+            # billing methods in no stable order
+            cursor.execute(
+                'DROP INDEX IF EXISTS "%s"' % (cls._table + '_duration_index')
+            )
+            # The expressions must match the ones of the queries
+            duration = duration_column(cls.__table__())
+            for suffix, definition, params in [
+                    ('_period_index', 'USING GIST '
+                        '(TSRANGE(start_date, GREATEST(start_date, end_date)))',
+                        ()),
+                    ('_billing_duration_index', '((%s))' % duration,
+                        duration.params),
+                    ]:
+                index_name = cls._table + suffix
+                cursor.execute(
+                    'SELECT 1 FROM pg_indexes WHERE indexname = %s',
+                    (index_name,)
+                )
+                if not cursor.fetchone():
+                    cursor.execute(
+                        'CREATE INDEX "%s" ON "%s" %s'
+                        % (index_name, cls._table, definition), params
+                    )
+
+    @classmethod
+    def create(cls, vlist):
+        contracts = super(RentalContract, cls).create(vlist)
+        Pool().get('product.product').clear_rental_index()
+        return contracts
+
+    @classmethod
+    def write(cls, *args):
+        pool = Pool()
+        Bucket = pool.get('rental.utilization.bucket')
+        ContractLine = pool.get('rental.contract.line')
+
+        actions = iter(args)
+        to_store = []
+        lines_to_store = []
+        to_refresh = []
+        for contracts, values in zip(actions, actions):
+            if set(values) & cls._amount_fields:
+                to_store.extend(contracts)
+            if set(values) & ContractLine._amount_fields:
+                lines_to_store.extend(
+                    chain.from_iterable(c.lines for c in contracts)
+                )
+            if set(values) & cls._utilization_fields:
+                to_refresh.extend(contracts)
+            elif 'state' in values:
+                reported = values['state'] in Bucket._reported_states
+                to_refresh.extend(
+                    c for c in contracts
+                    if (c.state in Bucket._reported_states) != reported
+                )
+        super(RentalContract, cls).write(*args)
+        if any(set(v) & cls._rental_index_fields for v in args[1::2]):
+            pool.get('product.product').clear_rental_index()
+        if lines_to_store:
+            ContractLine.store_amounts(lines_to_store)
+        if to_store:
+            cls.store_amounts(to_store)
+        if to_refresh:
+            Bucket.refresh(to_refresh)
+
+    @classmethod
+    def delete(cls, contracts):
+        super(RentalContract, cls).delete(contracts)
+        Pool().get('product.product').clear_rental_index()
+
+    @classmethod
+    def copy(cls, contracts, default=None):
+        if default is None:
+            default = {}
+        default = default.copy()
+        default.setdefault('next_billing_date', None)
+        default.setdefault('overdue', False)
+        default.setdefault('late_fee_until', None)
+        default.setdefault('late_fee_lines', None)
+        default.setdefault('reserved_line', None)
+        default.setdefault('reservation_invoice', None)
+        default.setdefault('jobs', None)
+        default.setdefault('renewed_from', None)
+        return super(RentalContract, cls).copy(contracts, default=default)
+
+    @staticmethod
+    def default_overdue():
+        return False
+
+    @staticmethod
+    def default_untaxed_amount():
+        return Decimal('0')
+
+    @staticmethod
+    def default_tax_amount():
+        return Decimal('0')
+
+    @staticmethod
+    def default_total_amount():
+        return Decimal('0')
+
+    @fields.depends('currency')
+    def on_change_with_currency_digits(self, name=None):
+        if self.currency:
+            return self.currency.digits
+        return 2
+
+    def _get_tax_amount(self, untaxed_amount):
+        "Return the tax amount of the contract, rental lines have no taxes"
+        return Decimal('0')
+
+    def _get_amounts(self, lines_amount):
+        """
+        Return the values of the stored amounts of the contract from the sum
+        of the amounts of its lines
+        """
+        untaxed_amount = self.currency.round(
+            Decimal(str(lines_amount or 0)) * Decimal(str(self.duration or 0))
+        )
+        tax_amount = self.currency.round(self._get_tax_amount(untaxed_amount))
+        return {
+            'untaxed_amount': untaxed_amount,
+            'tax_amount': tax_amount,
+            'total_amount': untaxed_amount + tax_amount,
+        }
+
+    @classmethod
+    def store_amounts(cls, contracts):
+        """
+        Compute the amounts of the contracts from the stored amounts of their
+        lines with one aggregate query and write the ones which changed
+        """
+        ContractLine = Pool().get('rental.contract.line')
+        cursor = Transaction().cursor
+
+        line = ContractLine.__table__()
+        contracts = cls.browse(list(set(c.id for c in contracts)))
+        ids = [c.id for c in contracts]
+        lines_amounts = {}
+        for i in range(0, len(ids), cursor.IN_MAX):
+            sub_ids = ids[i:i + cursor.IN_MAX]
+            cursor.execute(*line.select(
+                line.rental_contract, Sum(line.amount),
+                where=reduce_ids(line.rental_contract, sub_ids)
+                & (line.type == 'line'),
+                group_by=line.rental_contract
+            ))
+            lines_amounts.update(cursor.fetchall())
+
+        to_write = []
+        for contract in contracts:
+            amounts = contract._get_amounts(lines_amounts.get(contract.id))
+            if any(getattr(contract, k) != v for k, v in amounts.iteritems()):
+                to_write.extend(([contract], amounts))
+        if to_write:
+            cls.write(*to_write)
+
     @classmethod
     def default_warehouse(cls):
         Location = Pool().get('stock.location')
@@ -183,21 +662,62 @@ class RentalContract(Workflow, ModelSQL, ModelView):
 
     @fields.depends('billing_method', 'start_date', 'end_date')
     def on_change_with_duration(self, name=None):
-        if not (self.end_date and self.start_date):
-            return 0
+        return compute_duration(
+            self.billing_method, self.start_date, self.end_date
+        )
+
+    @classmethod
+    def get_duration(cls, contracts, name):
+        cursor = Transaction().cursor
+
+        table = cls.__table__()
+        durations = {}
+        ids = [c.id for c in contracts]
+        for i in range(0, len(ids), cursor.IN_MAX):
+            sub_ids = ids[i:i + cursor.IN_MAX]
+            cursor.execute(*table.select(
+                table.id, duration_column(table),
+                where=reduce_ids(table.id, sub_ids)
+            ))
+            durations.update(cursor.fetchall())
+        return durations
+
+    @classmethod
+    def search_duration(cls, name, clause):
+        table = cls.__table__()
+        _, operator, value = clause
+        Operator = fields.SQL_OPERATORS[operator]
+        return [('id', 'in', table.select(
+            table.id, where=Operator(duration_column(table), value)
+        ))]
+
+    @staticmethod
+    def order_duration(tables):
+        table, _ = tables[None]
+        return [duration_column(table)]
+
+    def get_period(self, name):
+        if self.start_date and self.end_date:
+            return '%s - %s' % (self.start_date, self.end_date)
 
-        timedelta = self.end_date - self.start_date
+    @classmethod
+    def search_period(cls, name, clause):
+        _, operator, value = clause
+        if operator != '=':
+            cls.raise_user_error('period_operator', (operator,))
+        start, end = value
+        return cls.overlap_domain(start, end)
 
-        if self.billing_method == 'hourly':
-            return timedelta.seconds / 3600
-        elif self.billing_method == 'daily':
-            return timedelta.days
-        elif self.billing_method == 'weekly':
-            return timedelta.days / 7
-        elif self.billing_method == 'monthly':
-            return timedelta.days / 30
-        elif self.billing_method == 'yearly':
-            return timedelta.days / 365
+    @classmethod
+    def overlap_domain(cls, start, end):
+        """
+        Return the domain of the contracts with a period overlapping
+        [start, end)
+        """
+        table = cls.__table__()
+        return [('id', 'in', table.select(
+            table.id, where=overlap_where(table, start, end)
+        ))]
 
     @classmethod
     def __setup__(cls):
@@ -212,6 +732,20 @@ class RentalContract(Workflow, ModelSQL, ModelView):
             ('quotation', 'draft'),
             ('cancel', 'draft'),
         ))
+        cls._error_messages.update({
+            'period_operator': (
+                'The period can only be searched with the "=" operator and '
+                'a (start, end) value, not "%s".'
+            ),
+            'product_unavailable': (
+                'Only %(available)s of the product "%(product)s" are '
+                'available for the contract "%(contract)s".'
+            ),
+            'contracts_not_assigned': (
+                'The shipments or the assets of the following contracts '
+                'could not be assigned, they will stay reserved: %s'
+            ),
+        })
         cls._buttons.update({
             'cancel': {
                 'invisible': ~Eval('state').in_(
@@ -238,17 +772,47 @@ class RentalContract(Workflow, ModelSQL, ModelView):
                 },
         })
 
-    def get_invoices(self, name):
-        invoices = set()
-        for line in self.lines:
-            for invoice_line in line.invoice_lines:
-                if invoice_line.invoice:
-                    invoices.add(invoice_line.invoice.id)
-        return list(invoices)
+    @classmethod
+    def get_invoices(cls, contracts, name):
+        pool = Pool()
+        ContractLine = pool.get('rental.contract.line')
+        InvoiceLine = pool.get('account.invoice.line')
+
+        line = ContractLine.__table__()
+        invoice_line = InvoiceLine.__table__()
+        from_ = line.join(
+            invoice_line,
+            condition=invoice_line.origin == reference(ContractLine, line)
+        )
+        result = cls._get_related_ids(
+            contracts, from_, line.rental_contract, invoice_line.invoice,
+            where=invoice_line.invoice != Null
+        )
+
+        # The late fees are invoiced with the contract as origin
+        contract = cls.__table__()
+        invoice_line = InvoiceLine.__table__()
+        from_ = contract.join(
+            invoice_line,
+            condition=invoice_line.origin == reference(cls, contract)
+        )
+        late_fees = cls._get_related_ids(
+            contracts, from_, contract.id, invoice_line.invoice,
+            where=invoice_line.invoice != Null
+        )
+        for contract_id, invoice_ids in late_fees.iteritems():
+            result[contract_id].extend(
+                i for i in invoice_ids if i not in result[contract_id]
+            )
+        return result
 
     @classmethod
     def search_invoices(cls, name, clause):
-        return [('lines.invoice_lines.invoice.id',) + tuple(clause[1:])]
+        return [
+            'OR',
+            ('lines.invoice_lines.invoice.id',) + tuple(clause[1:]),
+            ('late_fee_lines.invoice.id',) + tuple(clause[1:]),
+        ]
 
     @staticmethod
     def default_state():
@@ -293,124 +857,1015 @@ class RentalContract(Workflow, ModelSQL, ModelView):
     @classmethod
     @ModelView.button
     @Workflow.transition('cancel')
+    @profile
     def cancel(cls, contracts):
         ShipmentOut = Pool().get('stock.shipment.out')
         ShipmentOutReturn = Pool().get('stock.shipment.out.return')
 
-        for contract in contracts:
-            ShipmentOut.cancel(contract.shipments)
-            ShipmentOutReturn.cancel(contract.shipment_returns)
+        ShipmentOut.cancel([s for c in contracts for s in c.shipments])
+        ShipmentOutReturn.cancel(
+            [s for c in contracts for s in c.shipment_returns]
+        )
+        cls.write(contracts, {
+            'reserved_line': None,
+            'reservation_invoice': None,
+        })
 
     @classmethod
     @ModelView.button
     @Workflow.transition('draft')
+    @profile
     def draft(cls, contracts):
-        pass
+        """
+        Cancel the shipments and the invoice left by a failed reservation by
+        chunks so the edited quotations are reserved from the start again
+        """
+        pool = Pool()
+        ShipmentOut = pool.get('stock.shipment.out')
+        ShipmentOutReturn = pool.get('stock.shipment.out.return')
+        Invoice = pool.get('account.invoice')
+
+        partial = [c for c in contracts if c.reserved_line]
+        if not partial:
+            return
+        ShipmentOut.cancel([s for c in partial for s in c.shipments])
+        ShipmentOutReturn.cancel(
+            [s for c in partial for s in c.shipment_returns]
+        )
+        Invoice.cancel([
+            c.reservation_invoice for c in partial
+            if c.reservation_invoice
+            and c.reservation_invoice.state == 'draft'
+        ])
+        cls.write(partial, {
+            'reserved_line': None,
+            'reservation_invoice': None,
+        })
 
     @classmethod
     @ModelView.button
+    @queued
     @Workflow.transition('quotation')
+    @profile
     def quote(cls, contracts):
-        for contract in contracts:
-            contract.set_reference()
+        cls.set_references(contracts)
 
-    def set_reference(self):
+    @classmethod
+    def _get_sequence_numbers(cls, sequence, count):
+        """
+        Reserve count numbers of the incremental sequence at once: with a
+        single nextval query when the sequence is backed by a SQL sequence
+        (PostgreSQL), otherwise with a single write of its next number.
+        """
+        TableHandler = backend.get('TableHandler')
         Sequence = Pool().get('ir.sequence')
-        Configuration = Pool().get('rental.configuration')
+        cursor = Transaction().cursor
 
-        if not self.reference:
-            self.write([self], {
-                'reference': Sequence.get_id(
-                    Configuration(1).contract_sequence.id
-                ),
-            })
+        sql_sequence = sequence._sql_sequence_name
+        use_sql_sequence = (
+            backend.name() == 'postgresql' and not Sequence._strict
+            and TableHandler.sequence_exist(cursor, sql_sequence)
+        )
+        if use_sql_sequence:  # pragma: no cover
+            cursor.execute(
+                'SELECT nextval(%s) FROM generate_series(1, %s)',
+                ('"%s"' % sql_sequence, count)
+            )
+            return sorted(n for n, in cursor.fetchall())
+
+        # Written through the ORM to clear the cached sequence records
+        increment = sequence.number_increment
+        start = sequence.number_next_internal
+        end = start + increment * count
+        Sequence.write([sequence], {'number_next_internal': end})
+        return range(start, end, increment)
+
+    @classmethod
+    def _get_references(cls, count):
+        "Return count new references from the contract sequence"
+        pool = Pool()
+        Sequence = pool.get('ir.sequence')
+        Configuration = pool.get('rental.configuration')
+
+        with Transaction().set_user(0):
+            sequence = Sequence(Configuration.get_cached().contract_sequence.id)
+            if sequence.type != 'incremental':
+                return [Sequence.get_id(sequence.id) for _ in range(count)]
+            prefix = Sequence._process(sequence.prefix)
+            suffix = Sequence._process(sequence.suffix)
+            numbers = cls._get_sequence_numbers(sequence, count)
+        number_format = '%%0%sd' % sequence.padding
+        return [
+            '%s%s%s' % (prefix, number_format % n, suffix) for n in numbers
+        ]
+
+    @classmethod
+    def set_references(cls, contracts):
+        """
+        Set the reference of the contracts without one using a block of
+        numbers reserved at once and a single write
+        """
+        contracts = [c for c in contracts if not c.reference]
+        if not contracts:
+            return
+        references = cls._get_references(len(contracts))
+        cls.write(*list(chain.from_iterable(
+            ([c], {'reference': r}) for c, r in zip(contracts, references)
+        )))
+
+    def _get_reserved_quantities(self):
+        """
+        Return a dictionary with the product ids as keys and the quantity of
+        the lines in the default unit of the product as values
+        """
+        Uom = Pool().get('product.uom')
+
+        result = {}
+        for line in self.lines:
+            if line.type != 'line' or not line.product or line.quantity <= 0:
+                continue
+            result.setdefault(line.product.id, 0)
+            result[line.product.id] += Uom.compute_qty(
+                line.unit, line.quantity, line.product.default_uom
+            )
+        return result
+
+    @classmethod
+    def _lock_reservations(cls, periods, quantities):
+        """
+        Lock the time buckets of the products overlapped by the periods.
+        periods and quantities are dictionaries of the (start, end) and of
+        the reserved quantities per product by contract id.
+        On PostgreSQL the locks are advisory locks on (product, bucket) held
+        until the end of the transaction and taken in order so concurrent
+        reservations can not deadlock. The other backends allow only one
+        writer at a time so there is nothing to lock.
+        """
+        cursor = Transaction().cursor
+        if backend.name() == 'postgresql':  # pragma: no cover
+            days = cls._reservation_lock_days
+            epoch = datetime.date(1970, 1, 1)
+            keys = set()
+            for contract_id, (start, end) in periods.iteritems():
+                first = (start.date() - epoch).days // days
+                last = (end.date() - epoch).days // days
+                keys.update(
+                    (product_id, bucket)
+                    for product_id in quantities[contract_id]
+                    for bucket in range(first, last + 1)
+                )
+            for key in sorted(keys):
+                cursor.execute('SELECT pg_advisory_xact_lock(%s, %s)', key)
+
+    @classmethod
+    def _get_reserved_intervals(cls, product_ids, exclude=None):
+        """
+        Return the intervals of the products held by the reserved and active
+        contracts, and the quotations being reserved by chunks, except the
+        contracts of the ids in exclude and the capacities of the products
+        """
+        Product = Pool().get('product.product')
+
+        return (
+            Product._get_rental_intervals(
+                product_ids, states=cls._rental_reserved_states,
+                exclude=exclude
+            ),
+            Product.get_rental_capacity(Product.browse(product_ids)),
+        )
+
+    @classmethod
+    def check_availability(cls, contracts, periods=None):
+        """
+        Check that the products of the contracts are free over their periods
+        against the reserved and active contracts.
+        periods is an optional dictionary of the (start, end) to check by
+        contract id instead of the periods of the contracts.
+
+        The time buckets of the products are locked first. On PostgreSQL the
+        reserved contracts are then read with a new cursor whose snapshot
+        includes the reservations committed by the previous holders of the
+        locks. So only the reservations of the same products at the same
+        time wait for each other and the others run in parallel.
+        """
+        Product = Pool().get('product.product')
+
+        contracts = [c for c in contracts if c.start_date and c.end_date]
+        if periods is None:
+            periods = dict(
+                (c.id, (c.start_date, c.end_date)) for c in contracts
+            )
+        quantities = dict(
+            (c.id, c._get_reserved_quantities()) for c in contracts
+        )
+        product_ids = sorted(set(chain.from_iterable(
+            q.iterkeys() for q in quantities.itervalues()
+        )))
+        if not product_ids:
+            return
+
+        # The contracts resuming their reservation by chunks are checked
+        # again without their committed chunks
+        exclude = [c.id for c in contracts]
+        cls._lock_reservations(periods, quantities)
+        if backend.name() == 'postgresql':  # pragma: no cover
+            with Transaction().new_cursor():
+                intervals, capacities = cls._get_reserved_intervals(
+                    product_ids, exclude=exclude
+                )
+        else:
+            intervals, capacities = cls._get_reserved_intervals(
+                product_ids, exclude=exclude
+            )
+
+        # The index of each product is built once with the periods of all
+        # the checked contracts so adding them does not rebuild it
+        bounds = defaultdict(set)
+        for contract in contracts:
+            for product_id in quantities[contract.id]:
+                bounds[product_id].update(periods[contract.id])
+        indexes = dict(
+            (i, IntervalIndex(intervals[i], bounds[i])) for i in product_ids
+        )
+        for contract in contracts:
+            start, end = periods[contract.id]
+            for product_id, quantity in quantities[contract.id].iteritems():
+                index = indexes[product_id]
+                available = index.free(capacities[product_id], start, end)
+                if quantity > available:
+                    cls.raise_user_error('product_unavailable', {
+                        'available': max(available, 0),
+                        'product': Product(product_id).rec_name,
+                        'contract': contract.rec_name,
+                    })
+                index.add(start, end, quantity)
 
     @classmethod
     @ModelView.button
+    @queued
     @Workflow.transition('reservation')
+    @profile
     def reserve(cls, contracts):
-        for contract in contracts:
-            contract.create_invoice('out_invoice')
-            contract.create_shipment('out')
-            contract.create_shipment('return')
+        pool = Pool()
+        ContractLine = pool.get('rental.contract.line')
+        Configuration = pool.get('rental.configuration')
+
+        cls.check_availability(contracts)
+
+        recurring = [c for c in contracts if c.billing_type == 'recurring']
+        if recurring:
+            cls.write(*list(chain.from_iterable(
+                ([c], {'next_billing_date': c.start_date.date()})
+                for c in recurring
+            )))
+
+        # The large contracts are committed chunk by chunk in the jobs so
+        # they must be processed before the others are created in the
+        # transaction. The buttons do not commit so a failure leaves nothing.
+        # A contract with a reserved line resumes its reservation.
+        # A commit releases the locks of the availability check, so the
+        # contracts not committed yet are checked again under new locks.
+        # The committed chunks hold the products of their contract.
+        commit = bool(Transaction().context.get('rental_job'))
+        chunk_size = Configuration.get_cached().reservation_chunk_size
+        chunked = [
+            c for c in contracts
+            if c.reserved_line or (chunk_size and len(c.lines) > chunk_size)
+        ]
+        for i, contract in enumerate(chunked):
+            if i:
+                cls.check_availability([contract])
+            cls.reserve_by_chunks(
+                contract, chunk_size or len(contract.lines), commit=commit
+            )
+        contracts = [c for c in contracts if c not in chunked]
+        if chunked and contracts:
+            cls.check_availability(contracts)
+
+        cls.create_invoices(
+            [c for c in contracts if c.billing_type == 'one_time'],
+            'out_invoice'
+        )
+        moves = ContractLine.create_moves(
+            list(chain.from_iterable(c.lines for c in contracts)),
+            ['out', 'return']
+        )
+        cls.create_shipments(contracts, 'out', moves['out'])
+        cls.create_shipments(contracts, 'return', moves['return'])
+
+    def _get_reserved_shipments(self):
+        """
+        Return a dictionary with the shipment types and keys as keys and the
+        shipments already created for the contract as values
+        """
+        result = {}
+        for shipment_type, shipments in (
+                ('out', self.shipments), ('return', self.shipment_returns)):
+            for shipment in shipments:
+                if shipment.state == 'cancel':
+                    continue
+                # The inventory moves of the outgoing shipments have no origin
+                moves = [
+                    m for m in shipment.moves
+                    if m.origin and m.origin.__name__ == 'rental.contract.line'
+                ]
+                if not moves:
+                    continue
+                move = moves[0]
+                key = self._get_shipment_key(move.origin, move)
+                result[(shipment_type, key)] = shipment
+        return result
+
+    def _reserve_invoice_lines(self, lines, configuration):
+        """
+        Create the invoice lines of the chunk of lines on the reservation
+        invoice which is created with the first chunk and return the values
+        to write on the contract
+        """
+        pool = Pool()
+        ContractLine = pool.get('rental.contract.line')
+        Invoice = pool.get('account.invoice')
+        InvoiceLine = pool.get('account.invoice.line')
+
+        values = {}
+        invoice = self.reservation_invoice
+        if not invoice:
+            invoice, = Invoice.create([self._get_invoice_values(
+                'out_invoice', configuration.subscription_journal,
+                configuration.subscription_invoice_payment_term
+            )])
+            values['reservation_invoice'] = invoice.id
+        vlist = ContractLine.get_invoice_lines_values(
+            lines, 'out_invoice'
+        ).values()
+        for line_values in vlist:
+            line_values['invoice'] = invoice.id
+        InvoiceLine.create(vlist)
+        return values
+
+    def _reserve_shipments(self, lines, moves, shipments):
+        """
+        Add the moves of the chunk of lines to the shipments of the contract
+        and create the missing shipments.
+        shipments is the dictionary of the shipments by type and key which is
+        updated.
+        """
+        Move = Pool().get('stock.move')
+
+        grouped_moves = OrderedDict()
+        for shipment_type, line_moves in moves.iteritems():
+            Shipment = self._get_shipment_model(shipment_type)
+            for line in lines:
+                move = line_moves.get(line.id)
+                if not move:
+                    continue
+                key = (shipment_type, self._get_shipment_key(line, move))
+                if key not in shipments:
+                    shipments[key] = self._get_shipment_rent(
+                        Shipment, key[1]
+                    )
+                    shipments[key].save()
+                grouped_moves.setdefault(key, []).append(move)
+        if grouped_moves:
+            Move.write(*list(chain.from_iterable(
+                (key_moves, {'shipment': str(shipments[key])})
+                for key, key_moves in grouped_moves.iteritems()
+            )))
+
+    @classmethod
+    @profile
+    def reserve_by_chunks(cls, contract, chunk_size, commit=False):
+        """
+        Create the invoice lines and the moves of the lines of the contract
+        by chunks of chunk_size lines in the order of their ids.
+
+        The last line processed and the invoice are stored on the contract
+        with each chunk so if commit is set a failed reservation resumes
+        after the last committed chunk. The outgoing shipments are waited
+        once all the moves are created.
+        """
+        pool = Pool()
+        ContractLine = pool.get('rental.contract.line')
+        Invoice = pool.get('account.invoice')
+        Configuration = pool.get('rental.configuration')
+        cursor = Transaction().cursor
+
+        configuration = Configuration.get_cached()
+        shipments = contract._get_reserved_shipments()
+        while True:
+            contract = cls(contract.id)
+            domain = [('rental_contract', '=', contract.id)]
+            if contract.reserved_line:
+                domain.append(('id', '>', contract.reserved_line))
+            lines = ContractLine.search(
+                domain, order=[('id', 'ASC')], limit=chunk_size
+            )
+            if not lines:
+                break
+            values = {'reserved_line': lines[-1].id}
+            if contract.billing_type == 'one_time':
+                values.update(
+                    contract._reserve_invoice_lines(lines, configuration)
+                )
+            moves = ContractLine.create_moves(lines, ['out', 'return'])
+            contract._reserve_shipments(lines, moves, shipments)
+            cls.write([contract], values)
+            if commit:
+                cursor.commit()
+
+        if contract.reservation_invoice:
+            Invoice.update_taxes([contract.reservation_invoice])
+        ShipmentOut = cls._get_shipment_model('out')
+        ShipmentOut.wait([
+            s for (t, _), s in shipments.iteritems()
+            if t == 'out' and s.state == 'draft'
+        ])
 
     @classmethod
     @ModelView.button
-    @Workflow.transition('active')
+    @queued
+    @profile
     def active(cls, contracts):
-        ShipmentOut = Pool().get('stock.shipment.out')
+        """
+        Ship the contracts whose shipments and rental assets can all be
+        assigned and activate them. The other contracts stay reserved and
+        are reported with a warning, only logged in the jobs.
+        """
+        Asset = Pool().get('rental.asset')
+
+        contracts = [c for c in contracts if c.state == 'reservation']
+        picked, missing = Asset.pick(
+            list(chain.from_iterable(c.lines for c in contracts))
+        )
+        missing = set(missing)
+        no_assets = [
+            c for c in contracts if any(l.id in missing for l in c.lines)
+        ]
+        activated, failed = cls.ship(
+            [c for c in contracts if c not in no_assets]
+        )
+        failed += no_assets
+        if failed and not Transaction().context.get('rental_job'):
+            cls.raise_user_warning(
+                'rental_contract_active_%s' % md5(
+                    ','.join(str(c.id) for c in failed)
+                ).hexdigest(),
+                'contracts_not_assigned',
+                (', '.join(c.rec_name for c in failed),)
+            )
+            logger.warning(
+                'Rental contracts not assigned: %s',
+                ', '.join(c.rec_name for c in failed)
+            )
+        Asset.assign(dict(
+            (l.id, picked[l.id])
+            for c in activated for l in c.lines if l.id in picked
+        ))
+        cls.activate(activated)
+
+    @classmethod
+    @Workflow.transition('active')
+    @profile
+    def activate(cls, contracts):
+        pass
 
+    @classmethod
+    @profile
+    def ship(cls, contracts):
+        """
+        Move the shipments of all the contracts through each state at once.
+        Return the contracts shipped and the contracts for which some
+        shipments could not be assigned. The moves assigned for the latter
+        are released so they do not hold the stock.
+        """
+        pool = Pool()
+        ShipmentOut = pool.get('stock.shipment.out')
+        Move = pool.get('stock.move')
+
+        waiting = [
+            s for c in contracts for s in c.shipments if s.state == 'waiting'
+        ]
+        if waiting:
+            Move.assign_try([m for s in waiting for m in s.inventory_moves])
+        waiting = ShipmentOut.browse([s.id for s in waiting])
+        not_assigned = set(
+            s.id for s in waiting
+            if any(
+                m.state not in ('assigned', 'done') for m in s.inventory_moves
+            )
+        )
+
+        shipped, failed = [], []
         for contract in contracts:
-            ShipmentOut.assign(contract.shipments)
-            ShipmentOut.pack(contract.shipments)
-            ShipmentOut.done(contract.shipments)
+            if any(s.id in not_assigned for s in contract.shipments):
+                failed.append(contract)
+            else:
+                shipped.append(contract)
+
+        failed_ids = set(s.id for c in failed for s in c.shipments)
+        Move.draft([
+            m for s in waiting if s.id in failed_ids
+            for m in s.inventory_moves if m.state == 'assigned'
+        ])
+
+        shipments = ShipmentOut.browse([
+            s.id for c in shipped for s in c.shipments if s.state != 'done'
+        ])
+        ShipmentOut.assign([s for s in shipments if s.state == 'waiting'])
+        ShipmentOut.pack(shipments)
+        ShipmentOut.done(shipments)
+        return shipped, failed
 
     @classmethod
     @ModelView.button
+    @queued
     @Workflow.transition('close')
+    @profile
     def close(cls, contracts):
         ShipmentOutReturn = Pool().get('stock.shipment.out.return')
+        Asset = Pool().get('rental.asset')
+
+        shipment_returns = [
+            s for c in contracts for s in c.shipment_returns
+        ]
+        ShipmentOutReturn.receive(shipment_returns)
+        ShipmentOutReturn.done(shipment_returns)
+        Asset.release(list(chain.from_iterable(c.lines for c in contracts)))
+        overdue = [c for c in contracts if c.overdue]
+        if overdue:
+            cls.write(overdue, {'overdue': False})
+
+    @classmethod
+    def _get_billing_domain(cls, date):
+        "Return the domain of the recurring contracts to bill at date"
+        return [
+            ('state', 'in', ['reservation', 'active']),
+            ('billing_type', '=', 'recurring'),
+            ('next_billing_date', '<=', date),
+        ]
+
+    @classmethod
+    def bill_contracts(cls, date=None, commit=False):
+        """
+        Invoice the next period of all the recurring contracts due at date.
+
+        The contracts are processed by chunks of the configured size which
+        are committed one by one if commit is set. As the billed periods are
+        stored on the lines, a failed run can just be restarted.
+        """
+        pool = Pool()
+        Date = pool.get('ir.date')
+        Configuration = pool.get('rental.configuration')
+
+        if date is None:
+            date = Date.today()
+        chunk_size = Configuration.get_cached().billing_chunk_size or 500
+        domain = cls._get_billing_domain(date)
+
+        last_id = 0
+        while True:
+            contracts = cls.search(
+                domain + [('id', '>', last_id)],
+                order=[('id', 'ASC')], limit=chunk_size
+            )
+            if not contracts:
+                break
+            cls.bill(contracts)
+            last_id = contracts[-1].id
+            if commit:
+                Transaction().cursor.commit()
+
+    @classmethod
+    def cron_bill(cls):
+        "Bill the recurring contracts from the scheduler"
+        cls.bill_contracts(commit=True)
+
+    @classmethod
+    def _get_overdue_query(cls, now, last_id, limit):
+        """
+        Return the query of the next limit ids after last_id of the active
+        contracts ended before now with return shipments not done, it uses
+        the index on (state, end_date) and looks up the shipments of each
+        candidate contract only
+        """
+        pool = Pool()
+        ContractLine = pool.get('rental.contract.line')
+        Move = pool.get('stock.move')
+        ShipmentReturn = pool.get('stock.shipment.out.return')
+
+        contract = cls.__table__()
+        line = ContractLine.__table__()
+        move = Move.__table__()
+        shipment = ShipmentReturn.__table__()
+
+        pending = line.join(
+            move, condition=move.origin == reference(ContractLine, line)
+        ).join(
+            shipment,
+            condition=move.shipment == reference(ShipmentReturn, shipment)
+        ).select(
+            line.id,
+            where=(line.rental_contract == contract.id)
+            & ~shipment.state.in_(['done', 'cancel'])
+        )
+        return contract.select(
+            contract.id,
+            where=(contract.state == 'active')
+            & (contract.end_date < now)
+            & (contract.id > last_id)
+            & Exists(pending),
+            order_by=contract.id.asc, limit=limit
+        )
+
+    @classmethod
+    def check_overdue(cls, now=None, commit=False):
+        """
+        Mark the overdue contracts and invoice their late fees.
+
+        The contracts are read by batches of the configured size with keyset
+        pagination on the id so the memory does not depend on the number of
+        active contracts. Unlike a server-side cursor it survives the commit
+        of each batch when commit is set.
+        """
+        Configuration = Pool().get('rental.configuration')
+        cursor = Transaction().cursor
+
+        if now is None:
+            now = datetime.datetime.now()
+        batch_size = Configuration.get_cached().overdue_batch_size or 1000
+
+        last_id = 0
+        while True:
+            cursor.execute(*cls._get_overdue_query(now, last_id, batch_size))
+            ids = [i for i, in cursor.fetchall()]
+            if not ids:
+                break
+            cls.process_overdue(cls.browse(ids), now)
+            last_id = ids[-1]
+            if commit:
+                cursor.commit()
+
+    @classmethod
+    def cron_check_overdue(cls):
+        "Check the overdue contracts from the scheduler"
+        cls.check_overdue(commit=True)
+
+    def _get_late_fee_line(self, product, account, now):
+        """
+        Return the values of the invoice line of the late fees up to now at
+        the rent of the contract lines per billing method unit and the end
+        of the invoiced period
+        """
+        start_date = self.late_fee_until or self.end_date
+        units = compute_duration(self.billing_method, start_date, now)
+        lines = [l for l in self.lines if l.type == 'line']
+        rent = sum((l.amount or Decimal('0')) for l in lines)
+        if units <= 0 or not rent:
+            return None, start_date
+        end_date = start_date + datetime.timedelta(
+            seconds=units * BILLING_SECONDS[self.billing_method]
+        )
+        return {
+            'type': 'line',
+            'description': 'Late return of contract #%s' % self.reference,
+            'origin': str(self),
+            'quantity': units,
+            'unit': product.default_uom.id,
+            'product': product.id,
+            'unit_price': rent,
+            'invoice_type': 'out_invoice',
+            'account': account.id,
+        }, end_date
 
+    @classmethod
+    def process_overdue(cls, contracts, now):
+        """
+        Mark the contracts as overdue and, if a late fee product is
+        configured, invoice the late fees since the last run in bulk
+        """
+        pool = Pool()
+        Configuration = pool.get('rental.configuration')
+        Invoice = pool.get('account.invoice')
+
+        to_mark = [c for c in contracts if not c.overdue]
+        if to_mark:
+            cls.write(to_mark, {'overdue': True})
+
+        configuration = Configuration.get_cached()
+        product = configuration.late_fee_product
+        if not product:
+            return
+        account = product.account_revenue_used
+        invoices = []
+        to_write = []
         for contract in contracts:
-            ShipmentOutReturn.receive(contract.shipment_returns)
-            ShipmentOutReturn.done(contract.shipment_returns)
+            line, end_date = contract._get_late_fee_line(
+                product, account, now
+            )
+            if not line:
+                continue
+            values = contract._get_invoice_values(
+                'out_invoice', configuration.subscription_journal,
+                configuration.subscription_invoice_payment_term
+            )
+            values['lines'] = [('create', [line])]
+            invoices.append(values)
+            to_write.extend(([contract], {'late_fee_until': end_date}))
+        if invoices:
+            Invoice.create(invoices)
+            cls.write(*to_write)
+
+    def _get_billing_period(self):
+        "Return the start and the end of the next period to bill"
+        start_date = min(
+            l.billed_until or self.start_date for l in self.lines
+            if l.type == 'line'
+        )
+        end_date = start_date + relativedelta(**{
+            BILLING_DELTAS[self.billing_method]: self.billing_frequency or 1,
+        })
+        return start_date, min(end_date, self.end_date)
+
+    def _get_period_invoice(self, start_date, end_date):
+        """
+        Return the values of the invoice of the lines not billed after
+        start_date for the period and the billed lines
+        """
+        pool = Pool()
+        ContractLine = pool.get('rental.contract.line')
+        Configuration = pool.get('rental.configuration')
+
+        lines = [
+            l for l in self.lines if l.type == 'line'
+            and (l.billed_until or self.start_date) <= start_date
+        ]
+        duration = period_duration(self.billing_method, start_date, end_date)
+        if not duration:
+            return None, lines
+        lines_values = ContractLine.get_invoice_lines_values(
+            lines, 'out_invoice', duration=duration
+        )
+        if not lines_values:
+            return None, lines
+        configuration = Configuration.get_cached()
+        values = self._get_invoice_values(
+            'out_invoice', configuration.subscription_journal,
+            configuration.subscription_invoice_payment_term
+        )
+        values['lines'] = [('create', [
+            lines_values[l.id] for l in lines if l.id in lines_values
+        ])]
+        return values, lines
 
-    def _get_invoice_line_rent_line(self, invoice_type):
-        '''
-        Return invoice line for each rent lines according to invoice_type
-        '''
-        res = {}
-        for line in self.lines:
-            val = line.get_invoice_line(invoice_type)
-            if val:
-                res[line.id] = val
-        return res
+    @classmethod
+    @profile
+    def bill(cls, contracts):
+        """
+        Invoice the next period of each contract and move their billing
+        forward with bulk creates and writes
+        """
+        pool = Pool()
+        Invoice = pool.get('account.invoice')
+        ContractLine = pool.get('rental.contract.line')
+
+        invoices = []
+        line_args = []
+        contract_args = []
+        for contract in contracts:
+            next_billing_date = None
+            if any(l.type == 'line' for l in contract.lines):
+                start_date, end_date = contract._get_billing_period()
+                invoice, lines = contract._get_period_invoice(
+                    start_date, end_date
+                )
+                if invoice:
+                    invoices.append(invoice)
+                if lines:
+                    line_args.extend((lines, {'billed_until': end_date}))
+                if end_date < contract.end_date:
+                    next_billing_date = end_date.date()
+            contract_args.extend(
+                ([contract], {'next_billing_date': next_billing_date})
+            )
+        if invoices:
+            Invoice.create(invoices)
+        if line_args:
+            ContractLine.write(*line_args)
+        if contract_args:
+            cls.write(*contract_args)
+
+    def _get_extended_end_date(self, periods):
+        "Return the end date moved by periods units of the billing method"
+        return self.end_date + relativedelta(
+            **{BILLING_DELTAS[self.billing_method]: periods}
+        )
+
+    def _get_renewal_values(self, periods):
+        """
+        Return the values of the successor contract with its lines which
+        starts at the end of the contract for periods units of the billing
+        method
+        """
+        ContractLine = Pool().get('rental.contract.line')
+
+        values = field_values(self, self._renewal_fields)
+        values.update({
+            'renewed_from': self.id,
+            'start_date': self.end_date,
+            'end_date': self._get_extended_end_date(periods),
+            'lines': [('create', [
+                field_values(l, ContractLine._renewal_fields)
+                for l in self.lines
+            ])],
+        })
+        return values
+
+    @classmethod
+    def renew(cls, contracts, periods):
+        """
+        Create the successor contracts with their lines with a single create
+        call, quote and return them.
+        The successors are quoted at once even if the workflow is
+        asynchronous so they are returned quoted.
+        """
+        contracts = [
+            c for c in contracts
+            if c.state in cls._renewal_states and c.end_date
+        ]
+        if not contracts:
+            return []
+        successors = cls.create([
+            c._get_renewal_values(periods) for c in contracts
+        ])
+        with Transaction().set_context(rental_job=True):
+            cls.quote(successors)
+        return successors
+
+    @classmethod
+    def _extend_shipment_returns(cls, end_dates):
+        """
+        Move the planned date of the pending return shipments of the
+        contracts and of their moves to the new end dates in place.
+        end_dates is a dictionary of the new end date by contract.
+        """
+        pool = Pool()
+        ShipmentReturn = pool.get('stock.shipment.out.return')
+        Move = pool.get('stock.move')
+
+        shipment_ids = cls.get_shipment_returns(end_dates.keys(), None)
+        dates = {}
+        for contract, end_date in end_dates.iteritems():
+            for shipment_id in shipment_ids[contract.id]:
+                dates[shipment_id] = end_date.date()
+        shipments = {}
+        for shipment in ShipmentReturn.browse(dates.keys()):
+            if shipment.state == 'draft':
+                shipments.setdefault(dates[shipment.id], []).append(shipment)
+        if not shipments:
+            return
+        ShipmentReturn.write(*list(chain.from_iterable(
+            (s, {'planned_date': d}) for d, s in shipments.iteritems()
+        )))
+        Move.write(*list(chain.from_iterable(
+            ([m for s in s_list for m in s.moves], {'planned_date': d})
+            for d, s_list in shipments.iteritems()
+        )))
 
-    def _get_invoice_rent(self, invoice_type):
+    @classmethod
+    def extend(cls, contracts, periods):
+        """
+        Move the end of the contracts by periods units of the billing method.
+
+        The products of the reserved and active contracts are checked free
+        over the added periods first, under the locks of the reservations.
+        The contracts are written grouped by end date, the pending return
+        shipments are moved in place and the one time contracts which are
+        already invoiced are invoiced for the added periods. The billing of
+        the recurring contracts which are billed to their end is resumed at
+        the former end for the next billing run.
+        """
         Invoice = Pool().get('account.invoice')
-        Configuration = Pool().get('rental.configuration')
 
-        return Invoice(
-            company=self.company,
-            type=invoice_type,
-            journal=Configuration(1).subscription_journal,
-            party=self.party,
-            invoice_address=self.invoice_address,
-            currency=self.currency,
-            account=self.party.account_receivable,
-            description='Contract  #%s' % self.reference,
-            payment_term=self.party.customer_payment_term or
-                Configuration(1).subscription_invoice_payment_term,  # noqa
-        )
-
-    def create_invoice(self, invoice_type):
-        invoice_lines = self._get_invoice_line_rent_line(invoice_type)
-        if not invoice_lines:
+        contracts = [
+            c for c in contracts
+            if c.state in cls._extension_states and c.end_date
+        ]
+        if not contracts:
             return
+        now = datetime.datetime.now()
+        end_dates = dict(
+            (c, c._get_extended_end_date(periods)) for c in contracts
+        )
+        reserved = [
+            c for c in contracts if c.state in cls._rental_reserved_states
+        ]
+        cls.check_availability(reserved, dict(
+            (c.id, (c.end_date, end_dates[c])) for c in reserved
+        ))
+        grouped = {}
+        for contract, end_date in end_dates.iteritems():
+            grouped.setdefault(end_date, []).append(contract)
+        args = []
+        for end_date, group in grouped.iteritems():
+            values = {'end_date': end_date}
+            if end_date > now:
+                values['overdue'] = False
+            args.extend((group, values))
+        for contract in contracts:
+            if (contract.billing_type == 'recurring'
+                    and contract.state in ('reservation', 'active')
+                    and not contract.next_billing_date):
+                args.extend(([contract], {
+                    'next_billing_date': contract.end_date.date(),
+                }))
+        cls.write(*args)
+        cls._extend_shipment_returns(end_dates)
+
+        vlist = cls.get_invoices_values([
+            c for c in contracts
+            if c.billing_type == 'one_time'
+            and c.state in ('reservation', 'active')
+        ], 'out_invoice', duration=periods)
+        if vlist:
+            Invoice.create(vlist)
+
+    def _get_invoice_values(self, invoice_type, journal, payment_term):
+        """
+        Return the values of the invoice of the contract using the default
+        journal and payment_term
+        """
+        payment_term = self.party.customer_payment_term or payment_term
+        return {
+            'company': self.company.id,
+            'type': invoice_type,
+            'journal': journal.id,
+            'party': self.party.id,
+            'invoice_address': self.invoice_address.id,
+            'currency': self.currency.id,
+            'account': self.party.account_receivable.id,
+            'description': 'Contract  #%s' % self.reference,
+            'payment_term': payment_term.id,
+        }
 
-        invoice = self._get_invoice_rent(invoice_type)
-        invoice.lines = (
-            (list(invoice.lines) if hasattr(invoice, 'lines') else [])
-            + list(chain.from_iterable(invoice_lines.itervalues()))
+    @classmethod
+    def get_invoices_values(cls, contracts, invoice_type, duration=None):
+        """
+        Return the list of the values of the invoices with their lines for
+        the contracts for duration or the duration of each contract.
+        The configuration is read once and the contracts and their lines
+        are browsed together so the parties, payment terms, products and
+        revenue accounts are prefetched.
+        """
+        pool = Pool()
+        ContractLine = pool.get('rental.contract.line')
+        Configuration = pool.get('rental.configuration')
+
+        configuration = Configuration.get_cached()
+        journal = configuration.subscription_journal
+        payment_term = configuration.subscription_invoice_payment_term
+
+        contracts = cls.browse([c.id for c in contracts])
+        lines_values = ContractLine.get_invoice_lines_values(
+            list(chain.from_iterable(c.lines for c in contracts)),
+            invoice_type, duration=duration
         )
-        invoice.save()
+        vlist = []
+        for contract in contracts:
+            lines = [
+                lines_values[l.id] for l in contract.lines
+                if l.id in lines_values
+            ]
+            if not lines:
+                continue
+            values = contract._get_invoice_values(
+                invoice_type, journal, payment_term
+            )
+            values['lines'] = [('create', lines)]
+            vlist.append(values)
+        return vlist
 
-        return invoice
+    @classmethod
+    @profile
+    def create_invoices(cls, contracts, invoice_type):
+        """
+        Create the invoices of all the contracts and their lines with a single
+        create call
+        """
+        Invoice = Pool().get('account.invoice')
 
-    def _group_shipment_key(self, moves, move):
+        vlist = cls.get_invoices_values(contracts, invoice_type)
+        if not vlist:
+            return []
+        return Invoice.create(vlist)
+
+    def _get_shipment_key(self, line, move):
         '''
-        The key to group moves by shipments
-        move is a tuple of line id and a move
+        The key to group the move of the line by shipments: the moves of the
+        same planned date and warehouse share a shipment.
         '''
-        ContractLine = Pool().get('rental.contract.line')
-
-        line_id, move = move
-        line = ContractLine(line_id)
-
-        planned_date = max(m.planned_date for m in moves)
         return (
-            ('planned_date', planned_date),
-            ('warehouse', line.rental_contract.warehouse.id),
+            ('planned_date', move.planned_date),
+            ('warehouse', line._get_warehouse().id),
         )
 
     def _get_shipment_rent(self, Shipment, key):
@@ -422,42 +1877,58 @@ class RentalContract(Workflow, ModelSQL, ModelView):
         values.update(dict(key))
         return Shipment(**values)
 
-    def create_shipment(self, shipment_type):
-        moves = self._get_move_rent_line(shipment_type)
-
-        if not moves:
-            return
+    @staticmethod
+    def _get_shipment_model(shipment_type):
+        pool = Pool()
         if shipment_type == 'out':
-            keyfunc = partial(self._group_shipment_key, moves.values())
-            Shipment = Pool().get('stock.shipment.out')
+            return pool.get('stock.shipment.out')
         elif shipment_type == 'return':
-            keyfunc = partial(self._group_shipment_key, moves.values())
-            Shipment = Pool().get('stock.shipment.out.return')
+            return pool.get('stock.shipment.out.return')
+
+    def _get_shipments(self, shipment_type, moves):
+        """
+        Return the unsaved shipments with their moves for the contract.
+        moves is a dictionary of the moves per line id.
+        """
+        if not moves:
+            return []
+        Shipment = self._get_shipment_model(shipment_type)
 
-        moves = moves.items()
-        moves = sorted(moves, key=keyfunc)
+        # Compute the key of each move once and group them in a single pass
+        grouped_moves = OrderedDict()
+        for line in self.lines:
+            move = moves.get(line.id)
+            if move:
+                key = self._get_shipment_key(line, move)
+                grouped_moves.setdefault(key, []).append(move)
 
         shipments = []
-        for key, grouped_moves in groupby(moves, key=keyfunc):
+        for key, key_moves in grouped_moves.iteritems():
             shipment = self._get_shipment_rent(Shipment, key)
-            shipment.moves = (
-                list(getattr(shipment, 'moves', []))
-                + [x[1] for x in grouped_moves]
-            )
-            shipment.save()
+            shipment.moves = list(getattr(shipment, 'moves', [])) + key_moves
             shipments.append(shipment)
+        return shipments
+
+    @classmethod
+    @profile
+    def create_shipments(cls, contracts, shipment_type, moves):
+        """
+        Create the shipments of all the contracts with a single create call
+        moves is a dictionary of the moves per line id.
+        """
+        Shipment = cls._get_shipment_model(shipment_type)
+
+        shipments = list(chain.from_iterable(
+            contract._get_shipments(shipment_type, moves)
+            for contract in contracts
+        ))
+        if not shipments:
+            return []
+        shipments = Shipment.create([s._save_values for s in shipments])
         if shipment_type == 'out':
             Shipment.wait(shipments)
         return shipments
 
-    def _get_move_rent_line(self, shipment_type):
-        res = {}
-        for line in self.lines:
-            val = line.get_move(shipment_type)
-            if val:
-                res[line.id] = val
-        return res
-
 
 class RentalContractLine(ModelSQL, ModelView):
     "Rental Contract Line"
@@ -509,6 +1980,15 @@ class RentalContractLine(ModelSQL, ModelView):
         fields.Many2One('product.uom.category', 'Product Uom Category'),
         'on_change_with_product_uom_category'
     )
+    warehouse = fields.Many2One(
+        'stock.location', 'Warehouse', domain=[('type', '=', 'warehouse')],
+        states={
+            'invisible': Eval('type') != 'line',
+            'readonly': ~Eval('_parent_rental_contract', {}),
+        }, depends=['type'],
+        help='The warehouse the product is shipped from and returned to, '
+        'the warehouse of the contract if empty'
+    )
     unit_price = fields.Numeric(
         'Rent', digits=(16, 4),
         states={
@@ -516,7 +1996,7 @@ class RentalContractLine(ModelSQL, ModelView):
             'required': Eval('type') == 'line',
         }, depends=['type']
     )
-    amount = fields.Function(fields.Numeric("Amount"), 'get_amount')
+    amount = fields.Numeric("Amount", readonly=True, select=True)
     description = fields.Text('Description', size=None, required=True)
     note = fields.Text('Note')
     invoice_lines = fields.One2Many(
@@ -526,6 +2006,171 @@ class RentalContractLine(ModelSQL, ModelView):
     moves = fields.One2Many(
         'stock.move', 'origin', 'Moves', readonly=True
     )
+    billed_until = fields.DateTime('Billed Until', readonly=True)
+    assets = fields.One2Many(
+        'rental.asset', 'contract_line', 'Assets', readonly=True
+    )
+    period = fields.Function(
+        fields.Char(
+            'Period',
+            help='Search with "=" and a (start, end) value for the periods '
+            'of the contracts overlapping it'
+        ), 'get_period', searcher='search_period'
+    )
+
+    # Fields which change the quantities committed on the products
+    _rental_index_fields = set([
+        'rental_contract', 'product', 'quantity', 'unit',
+    ])
+
+    # Fields of the line or of its contract which change the stored amounts
+    _amount_fields = set([
+        'rental_contract', 'type', 'quantity', 'unit_price', 'currency',
+    ])
+
+    # Fields which change the utilization buckets
+    _utilization_fields = set([
+        'rental_contract', 'type', 'product', 'quantity', 'unit',
+        'unit_price', 'warehouse',
+    ])
+
+    # Fields copied to the lines of the successor of a renewed contract
+    _renewal_fields = [
+        'sequence', 'type', 'product', 'quantity', 'unit', 'warehouse',
+        'unit_price', 'description', 'note',
+    ]
+
+    @classmethod
+    def __setup__(cls):
+        super(RentalContractLine, cls).__setup__()
+        cls._error_messages.update({
+            'invoice_negative_quantity': (
+                'The line "%(line)s" of the contract "%(contract)s" can not '
+                'be invoiced with a negative quantity.'
+            ),
+        })
+
+    @classmethod
+    def __register__(cls, module_name):
+        TableHandler = backend.get('TableHandler')
+        Contract = Pool().get('rental.contract')
+        cursor = Transaction().cursor
+
+        table = TableHandler(cursor, cls, module_name)
+        amount_exist = table.column_exist('amount')
+
+        super(RentalContractLine, cls).__register__(module_name)
+
+        table = TableHandler(cursor, cls, module_name)
+        table.index_action(['product', 'rental_contract'], 'add')
+
+        # Migration from 3.4.0.1: amounts are stored
+        if not amount_exist:
+            cls.store_amounts(cls.search([]))
+            Contract.store_amounts(Contract.search([]))
+
+    @staticmethod
+    def _refresh_utilization(contracts):
+        "Refresh the utilization buckets of the reported contracts"
+        Bucket = Pool().get('rental.utilization.bucket')
+
+        contracts = [
+            c for c in contracts if c.state in Bucket._reported_states
+        ]
+        if contracts:
+            Bucket.refresh(contracts)
+
+    @classmethod
+    def create(cls, vlist):
+        lines = super(RentalContractLine, cls).create(vlist)
+        Pool().get('product.product').clear_rental_index()
+        cls.store_amounts(lines)
+        cls._refresh_utilization(
+            [l.rental_contract for l in lines if l.rental_contract]
+        )
+        return lines
+
+    @classmethod
+    def write(cls, *args):
+        Contract = Pool().get('rental.contract')
+
+        actions = iter(args)
+        to_store = []
+        contracts = []
+        to_refresh = []
+        for lines, values in zip(actions, actions):
+            if set(values) & cls._amount_fields:
+                to_store.extend(lines)
+            if 'rental_contract' in values:
+                # The previous contracts lose the amounts of the lines
+                contracts.extend(
+                    l.rental_contract for l in lines if l.rental_contract
+                )
+            if set(values) & cls._utilization_fields:
+                to_refresh.extend(lines)
+        # The previous contracts lose the buckets of the lines
+        refresh_contracts = [
+            l.rental_contract for l in to_refresh if l.rental_contract
+        ]
+        super(RentalContractLine, cls).write(*args)
+        if any(set(v) & cls._rental_index_fields for v in args[1::2]):
+            Pool().get('product.product').clear_rental_index()
+        if to_store:
+            cls.store_amounts(to_store)
+        if contracts:
+            Contract.store_amounts(contracts)
+        if to_refresh:
+            refresh_contracts.extend(
+                l.rental_contract for l in cls.browse(to_refresh)
+                if l.rental_contract
+            )
+            cls._refresh_utilization(Contract.browse(refresh_contracts))
+
+    @classmethod
+    def delete(cls, lines):
+        Contract = Pool().get('rental.contract')
+
+        contract_ids = list(set(
+            l.rental_contract.id for l in lines if l.rental_contract
+        ))
+        super(RentalContractLine, cls).delete(lines)
+        Pool().get('product.product').clear_rental_index()
+        # Skip the contracts deleted with their lines
+        contracts = Contract.search([('id', 'in', contract_ids)])
+        if contracts:
+            Contract.store_amounts(contracts)
+            cls._refresh_utilization(contracts)
+
+    @classmethod
+    def store_amounts(cls, lines):
+        """
+        Store the amount of the lines with a write per distinct amount and
+        update the amounts of their contracts
+        """
+        Contract = Pool().get('rental.contract')
+
+        lines = cls.browse([l.id for l in lines])
+        to_write = {}
+        for line in lines:
+            amount = line.on_change_with_amount()
+            if line.amount != amount:
+                to_write.setdefault(amount, []).append(line)
+        if to_write:
+            cls.write(*list(chain.from_iterable(
+                (l, {'amount': a}) for a, l in to_write.iteritems()
+            )))
+        contracts = [l.rental_contract for l in lines if l.rental_contract]
+        if contracts:
+            Contract.store_amounts(contracts)
+
+    @classmethod
+    def copy(cls, lines, default=None):
+        if default is None:
+            default = {}
+        default = default.copy()
+        default.setdefault('billed_until', None)
+        default.setdefault('assets', None)
+        return super(RentalContractLine, cls).copy(lines, default=default)
 
     @staticmethod
     def default_type():
@@ -535,9 +2180,17 @@ class RentalContractLine(ModelSQL, ModelView):
     def default_sequence():
         return 10
 
-    def get_amount(self, name):
-        if self.type == 'line':
-            return self.on_change_with_amount()
+    @staticmethod
+    def default_amount():
+        return Decimal('0')
+
+    def get_period(self, name):
+        if self.rental_contract:
+            return self.rental_contract.period
+
+    @classmethod
+    def search_period(cls, name, clause):
+        return [('rental_contract.period',) + tuple(clause[1:])]
 
     @staticmethod
     def default_unit_digits():
@@ -566,16 +2219,31 @@ class RentalContractLine(ModelSQL, ModelView):
             if getattr(self.rental_contract, 'start_date', None):
                 context['contract_start_date'] = \
                     self.rental_contract.start_date.date()
+            if getattr(self.rental_contract, 'price_list', None):
+                context['price_list'] = self.rental_contract.price_list.id
+            context['rental_duration'] = compute_duration(
+                getattr(self.rental_contract, 'billing_method', None),
+                getattr(self.rental_contract, 'start_date', None),
+                getattr(self.rental_contract, 'end_date', None),
+            )
         if self.unit:
             context['uom'] = self.unit.id
         else:
             context['uom'] = self.product.default_uom.id
         return context
 
+    def _get_warehouse(self):
+        "Return the warehouse of the line or of its contract"
+        return self.warehouse or self.rental_contract.warehouse
+
     @fields.depends(
-        'product', 'unit', 'quantity', 'description',
+        'product', 'unit', 'quantity', 'description', 'warehouse',
         '_parent_rental_contract.party', '_parent_rental_contract.currency',
-        '_parent_rental_contract.billing_method'
+        '_parent_rental_contract.billing_method',
+        '_parent_rental_contract.start_date',
+        '_parent_rental_contract.end_date',
+        '_parent_rental_contract.price_list',
+        '_parent_rental_contract.warehouse'
     )
     def on_change_product(self):
         Product = Pool().get('product.product')
@@ -591,6 +2259,11 @@ class RentalContractLine(ModelSQL, ModelView):
             if party.lang:
                 party_context['language'] = party.lang.code
 
+        if (not self.warehouse and self.rental_contract
+                and self.rental_contract.warehouse):
+            res['warehouse'] = self.rental_contract.warehouse.id
+            res['warehouse.rec_name'] = self.rental_contract.warehouse.rec_name
+
         category = self.product.default_uom.category
         if not self.unit or self.unit not in category.uoms:
             res['unit'] = self.product.default_uom.id
@@ -631,62 +2304,194 @@ class RentalContractLine(ModelSQL, ModelView):
             return amount
         return Decimal('0.0')
 
-    def get_invoice_line(self, invoice_type):
+    @classmethod
+    def get_invoice_lines_values(cls, lines, invoice_type, duration=None):
         '''
-        Return a list of invoice lines for rent line according to invoice_type
+        Return a dictionary with the line ids as keys and the values of the
+        invoice line to create according to invoice_type for duration or the
+        contract duration.
+        The revenue account is computed once per product.
+        Only the lines of type line are invoiced and a negative quantity is
+        refused.
         '''
-        InvoiceLine = Pool().get('account.invoice.line')
+        accounts = {}
+        result = {}
+        for line in cls.browse([l.id for l in lines]):
+            if line.type != 'line':
+                continue
+            if line.quantity < 0:
+                cls.raise_user_error('invoice_negative_quantity', {
+                    'line': line.rec_name,
+                    'contract': line.rental_contract.rec_name,
+                })
+            product = line.product
+            if product.id not in accounts:
+                accounts[product.id] = product.account_revenue_used
+            line_duration = duration
+            if line_duration is None:
+                line_duration = line.rental_contract.duration
+            result[line.id] = {
+                'type': line.type,
+                'description': line.description,
+                'note': line.note,
+                'origin': str(line),
+                'quantity': line.quantity,
+                'unit': line.unit.id,
+                'product': product.id,
+                'unit_price': Decimal(line.unit_price * line_duration),
+                'invoice_type': invoice_type,
+                'account': accounts[product.id].id,
+            }
+        return result
 
-        if self.type != 'line' or self.quantity < 0:
-            # TODO: Handle other cases
-            return []
+    def _is_moved(self):
+        "Return True if the line needs stock moves"
+        return bool(
+            self.type == 'line' and self.product and self.quantity
+            and self.product.type != 'service'
+        )
 
-        invoice_line = InvoiceLine()
-        invoice_line.type = self.type
-        invoice_line.description = self.description
-        invoice_line.note = self.note
-        invoice_line.origin = self
-        invoice_line.quantity = self.quantity
-        invoice_line.unit = self.unit
-        invoice_line.product = self.product
-        invoice_line.unit_price = Decimal(
-            self.unit_price * self.rental_contract.duration
-        )
-        invoice_line.invoice_type = invoice_type
-        invoice_line.account = self.product.account_revenue_used
-        return [invoice_line]
-
-    def get_move(self, shipment_type):
+    @classmethod
+    def get_moves_values(cls, lines, shipment_type):
         '''
-        Return moves for the rent line according to shipment_type
+        Return a dictionary with the line ids as keys and the values of the
+        move to create for shipment_type as values.
+        The lines are browsed together so the contracts, warehouses, units
+        and products are read once for all of them.
         '''
-        Move = Pool().get('stock.move')
         Configuration = Pool().get('rental.configuration')
 
-        if self.type != 'line':
-            return
-        if not self.product or not self.quantity:
-            return
+        rent_location = Configuration.get_rent_location()
+        result = {}
+        for line in cls.browse([l.id for l in lines]):
+            if not line._is_moved():
+                continue
+            contract = line.rental_contract
+            warehouse = line._get_warehouse()
+            if shipment_type == 'out':
+                from_location = warehouse.output_location
+                to_location = rent_location
+                planned_date = contract.start_date.date()
+            elif shipment_type == 'return':
+                from_location = rent_location
+                to_location = warehouse.input_location
+                planned_date = contract.end_date.date()
+            result[line.id] = {
+                'quantity': line.quantity,
+                'uom': line.unit.id,
+                'product': line.product.id,
+                'from_location': from_location.id,
+                'to_location': to_location.id,
+                'state': 'draft',
+                'company': contract.company.id,
+                'unit_price': line.unit_price,
+                'currency': contract.currency.id,
+                'planned_date': planned_date,
+                'invoice_lines': [
+                    ('add', [il.id for il in line.invoice_lines]),
+                ],
+                'origin': str(line),
+            }
+        return result
 
-        if self.product.type == 'service':
-            return
+    @classmethod
+    @profile
+    def create_moves(cls, lines, shipment_types):
+        '''
+        Create the moves of the lines for all the shipment_types with a single
+        create call and return a dictionary with the shipment types as keys
+        and a dictionary of the moves per line id as values
+        '''
+        Move = Pool().get('stock.move')
 
-        if shipment_type == 'out':
-            planned_date = self.rental_contract.start_date.date()
-        elif shipment_type == 'return':
-            planned_date = self.rental_contract.end_date.date()
-
-        move = Move()
-        move.quantity = self.quantity
-        move.uom = self.unit
-        move.product = self.product
-        move.from_location = self.rental_contract.warehouse.output_location.id
-        move.to_location = Configuration(1).rent_location.id
-        move.state = 'draft'
-        move.company = self.rental_contract.company.id
-        move.unit_price = self.unit_price
-        move.currency = self.rental_contract.currency
-        move.planned_date = planned_date
-        move.invoice_lines = self.invoice_lines
-        move.origin = self
-        return move
+        keys = []
+        vlist = []
+        for shipment_type in shipment_types:
+            for line_id, values in cls.get_moves_values(
+                    lines, shipment_type).iteritems():
+                keys.append((shipment_type, line_id))
+                vlist.append(values)
+        result = dict((t, {}) for t in shipment_types)
+        for (shipment_type, line_id), move in zip(keys, Move.create(vlist)):
+            result[shipment_type][line_id] = move
+        return result
+
+
+class BillContractStart(ModelView):
+    'Bill Rental Contracts'
+    __name__ = 'rental.contract.bill.start'
+
+    date = fields.Date('Date', required=True)
+
+    @staticmethod
+    def default_date():
+        return Pool().get('ir.date').today()
+
+
+class BillContract(Wizard):
+    'Bill Rental Contracts'
+    __name__ = 'rental.contract.bill'
+
+    start = StateView(
+        'rental.contract.bill.start',
+        'rental.rental_contract_bill_start_view_form', [
+            Button('Cancel', 'end', 'tryton-cancel'),
+            Button('Bill', 'bill', 'tryton-ok', default=True),
+        ]
+    )
+    bill = StateTransition()
+
+    def transition_bill(self):
+        RentalContract = Pool().get('rental.contract')
+
+        RentalContract.bill_contracts(self.start.date, commit=True)
+        return 'end'
+
+
+class RenewContractStart(ModelView):
+    'Renew Rental Contracts'
+    __name__ = 'rental.contract.renew.start'
+
+    method = fields.Selection([
+        ('renew', 'Renew'),
+        ('extend', 'Extend'),
+    ], 'Method', required=True,
+        help='Renew creates and quotes successor contracts, extend moves '
+        'the end of the contracts')
+    periods = fields.Integer(
+        'Periods', required=True,
+        help='Number of billing method units of the renewal or extension'
+    )
+
+    @staticmethod
+    def default_method():
+        return 'renew'
+
+    @staticmethod
+    def default_periods():
+        return 1
+
+
+class RenewContract(Wizard):
+    'Renew Rental Contracts'
+    __name__ = 'rental.contract.renew'
+
+    start = StateView(
+        'rental.contract.renew.start',
+        'rental.rental_contract_renew_start_view_form', [
+            Button('Cancel', 'end', 'tryton-cancel'),
+            Button('OK', 'apply', 'tryton-ok', default=True),
+        ]
+    )
+    apply = StateTransition()
+
+    def transition_apply(self):
+        RentalContract = Pool().get('rental.contract')
+
+        contracts = RentalContract.browse(
+            Transaction().context.get('active_ids', [])
+        )
+        getattr(RentalContract, self.start.method)(
+            contracts, self.start.periods
+        )
+        return 'end'
@@ -10,6 +10,12 @@ import unittest
 import trytond.tests.test_tryton
 
 from tests.test_views_depends import TestViewsDepends
+from tests.test_availability import TestAvailability
+from tests.test_price_list import TestPriceList
+from tests.test_profiling import TestProfiling
+from tests.test_utilization import TestUtilization
+from tests.test_exchange import TestExchange
+from tests.test_contract import TestContract
 
 
 def suite():
@@ -19,6 +25,12 @@ def suite():
     test_suite = trytond.tests.test_tryton.suite()
     test_suite.addTests([
         unittest.TestLoader().loadTestsFromTestCase(TestViewsDepends),
+        unittest.TestLoader().loadTestsFromTestCase(TestAvailability),
+        unittest.TestLoader().loadTestsFromTestCase(TestPriceList),
+        unittest.TestLoader().loadTestsFromTestCase(TestProfiling),
+        unittest.TestLoader().loadTestsFromTestCase(TestUtilization),
+        unittest.TestLoader().loadTestsFromTestCase(TestExchange),
+        unittest.TestLoader().loadTestsFromTestCase(TestContract),
     ])
     return test_suite
 
@@ -0,0 +1,349 @@
+# -*- coding: utf-8 -*-
+"""
+    tests/benchmark_rental.py
+
+    Benchmark of the rental contract workflow.
+
+    It builds synthetic contracts on the test database (selected like for
+    the tests with TRYTOND_DATABASE_URI and DB_NAME), times every workflow
+    transition, counts the SQL queries and prints the results with the
+    statistics of the instrumented methods as JSON:
+
+        python tests/benchmark_rental.py --contracts 200 --lines 5
+
+    :copyright: (C) 2015 by Fulfil.IO Inc.
+    :license: see LICENSE.
+"""
+import sys
+import os
+DIR = os.path.abspath(os.path.normpath(os.path.join(
+    __file__, '..', '..', '..', '..', '..', 'trytond'
+)))
+if os.path.isdir(DIR):
+    sys.path.insert(0, os.path.dirname(DIR))
+import argparse
+import datetime
+import json
+import time
+from decimal import Decimal
+
+from dateutil.relativedelta import relativedelta
+
+import trytond.tests.test_tryton
+from trytond.tests.test_tryton import POOL, DB_NAME, USER, CONTEXT
+from trytond.transaction import Transaction
+from trytond.modules.rental import profiling
+
+
+class QueryCounter(object):
+    '''
+    Count the queries executed by the cursor of the transaction
+    '''
+
+    def __init__(self):
+        self.count = 0
+
+    def __enter__(self):
+        self.cursor = Transaction().cursor
+        execute = self.cursor.execute
+
+        def counting_execute(*args, **kwargs):
+            self.count += 1
+            return execute(*args, **kwargs)
+        self.cursor.execute = counting_execute
+        return self
+
+    def __exit__(self, type, value, traceback):
+        del self.cursor.execute
+
+
+class RentalBenchmark(object):
+    '''
+    Build the data and run the rental contract transitions
+    '''
+
+    def __init__(self, contracts, lines, products, warehouses):
+        self.contracts = contracts
+        self.lines = lines
+        self.products = products
+        self.warehouses = warehouses
+        self.results = []
+
+        trytond.tests.test_tryton.install_module('rental')
+
+    def setup_company(self):
+        pool = POOL
+        Currency = pool.get('currency.currency')
+        Company = pool.get('company.company')
+        Party = pool.get('party.party')
+        User = pool.get('res.user')
+
+        self.currency, = Currency.create([{
+            'name': 'US Dollar',
+            'code': 'USD',
+            'symbol': '$',
+        }])
+        party, = Party.create([{'name': 'Rental Company'}])
+        self.company, = Company.create([{
+            'party': party.id,
+            'currency': self.currency.id,
+        }])
+        User.write([User(USER)], {
+            'main_company': self.company.id,
+            'company': self.company.id,
+        })
+
+    def setup_accounting(self):
+        pool = POOL
+        AccountTemplate = pool.get('account.account.template')
+        Account = pool.get('account.account')
+        CreateChart = pool.get('account.create_chart', type='wizard')
+        FiscalYear = pool.get('account.fiscalyear')
+        Sequence = pool.get('ir.sequence')
+        SequenceStrict = pool.get('ir.sequence.strict')
+        PaymentTerm = pool.get('account.invoice.payment_term')
+
+        template, = AccountTemplate.search([('parent', '=', None)])
+        session_id, _, _ = CreateChart.create()
+        create_chart = CreateChart(session_id)
+        create_chart.account.account_template = template
+        create_chart.account.company = self.company
+        create_chart.transition_create_account()
+        receivable, = Account.search([
+            ('kind', '=', 'receivable'),
+            ('company', '=', self.company.id),
+        ])
+        payable, = Account.search([
+            ('kind', '=', 'payable'),
+            ('company', '=', self.company.id),
+        ])
+        self.revenue, = Account.search([
+            ('kind', '=', 'revenue'),
+            ('company', '=', self.company.id),
+        ])
+        create_chart.properties.company = self.company
+        create_chart.properties.account_receivable = receivable
+        create_chart.properties.account_payable = payable
+        create_chart.transition_create_properties()
+
+        today = datetime.date.today()
+        post_move_sequence, = Sequence.create([{
+            'name': '%s' % today.year,
+            'code': 'account.move',
+            'company': self.company.id,
+        }])
+        invoice_sequence, = SequenceStrict.create([{
+            'name': '%s' % today.year,
+            'code': 'account.invoice',
+            'company': self.company.id,
+        }])
+        fiscal_year, = FiscalYear.create([{
+            'name': '%s' % today.year,
+            'start_date': today + relativedelta(month=1, day=1),
+            'end_date': today + relativedelta(years=1, month=12, day=31),
+            'company': self.company.id,
+            'post_move_sequence': post_move_sequence.id,
+            'out_invoice_sequence': invoice_sequence.id,
+            'in_invoice_sequence': invoice_sequence.id,
+            'out_credit_note_sequence': invoice_sequence.id,
+            'in_credit_note_sequence': invoice_sequence.id,
+        }])
+        FiscalYear.create_period([fiscal_year])
+
+        self.payment_term, = PaymentTerm.create([{
+            'name': 'Direct',
+            'lines': [('create', [{'type': 'remainder'}])],
+        }])
+
+    def setup_stock(self):
+        pool = POOL
+        Location = pool.get('stock.location')
+
+        self.warehouse_list = Location.search([('type', '=', 'warehouse')])
+        for index in range(len(self.warehouse_list), self.warehouses):
+            input_, output, storage = Location.create([{
+                'name': 'Input %s' % index,
+                'type': 'storage',
+            }, {
+                'name': 'Output %s' % index,
+                'type': 'storage',
+            }, {
+                'name': 'Storage %s' % index,
+                'type': 'storage',
+            }])
+            self.warehouse_list.extend(Location.create([{
+                'name': 'Warehouse %s' % index,
+                'type': 'warehouse',
+                'input_location': input_.id,
+                'output_location': output.id,
+                'storage_location': storage.id,
+            }]))
+        self.supplier, = Location.search([('code', '=', 'SUP')])
+        self.customer, = Location.search([('code', '=', 'CUS')])
+
+    def setup_configuration(self):
+        pool = POOL
+        Configuration = pool.get('rental.configuration')
+        Journal = pool.get('account.journal')
+        Sequence = pool.get('ir.sequence')
+
+        journal, = Journal.search([('code', '=', 'REV')])
+        sequence, = Sequence.search([('code', '=', 'rental.contract')])
+        configuration = Configuration(1)
+        configuration.contract_sequence = sequence
+        configuration.subscription_journal = journal
+        configuration.subscription_invoice_payment_term = self.payment_term
+        configuration.rent_location = self.customer
+        configuration.save()
+
+    def setup_products(self):
+        pool = POOL
+        Template = pool.get('product.template')
+        Uom = pool.get('product.uom')
+        Move = pool.get('stock.move')
+
+        unit, = Uom.search([('name', '=', 'Unit')])
+        templates = Template.create([{
+            'name': 'Rental Product %s' % index,
+            'type': 'goods',
+            'rentable': True,
+            'default_uom': unit.id,
+            'list_price': Decimal('100'),
+            'cost_price': Decimal('50'),
+            'rent_hourly': Decimal('1'),
+            'rent_daily': Decimal('10'),
+            'rent_weekly': Decimal('50'),
+            'rent_monthly': Decimal('150'),
+            'rent_yearly': Decimal('1000'),
+            'account_revenue': self.revenue.id,
+            'products': [('create', [{}])],
+        } for index in range(self.products)])
+        self.product_list = [t.products[0] for t in templates]
+
+        # Enough units for every contract to be activated at once
+        quantity = self.contracts * self.lines
+        moves = Move.create([{
+            'product': product.id,
+            'uom': unit.id,
+            'quantity': quantity,
+            'from_location': self.supplier.id,
+            'to_location': warehouse.storage_location.id,
+            'unit_price': Decimal('50'),
+            'currency': self.currency.id,
+            'company': self.company.id,
+        } for product in self.product_list
+            for warehouse in self.warehouse_list])
+        Move.do(moves)
+
+    def create_contracts(self):
+        pool = POOL
+        Party = pool.get('party.party')
+        Contract = pool.get('rental.contract')
+
+        party, = Party.create([{
+            'name': 'Rental Customer',
+            'addresses': [('create', [{'name': 'Rental Customer'}])],
+        }])
+        address, = party.addresses
+        now = datetime.datetime.now().replace(microsecond=0)
+        vlist = []
+        for index in range(self.contracts):
+            start_date = now + datetime.timedelta(days=index % 30)
+            vlist.append({
+                'company': self.company.id,
+                'currency': self.currency.id,
+                'party': party.id,
+                'invoice_address': address.id,
+                'shipment_address': address.id,
+                'warehouse': self.warehouse_list[
+                    index % len(self.warehouse_list)
+                ].id,
+                'start_date': start_date,
+                'end_date': start_date + datetime.timedelta(days=7),
+                'billing_method': 'daily',
+                'lines': [('create', [{
+                    'product': product.id,
+                    'quantity': 1,
+                    'unit': product.default_uom.id,
+                    'unit_price': Decimal('10'),
+                    'description': product.rec_name,
+                } for product in (
+                    self.product_list[(index + i) % len(self.product_list)]
+                    for i in range(self.lines)
+                )])],
+            })
+        return Contract.create(vlist)
+
+    def measure(self, transition, contracts):
+        Contract = POOL.get('rental.contract')
+
+        contracts = Contract.browse([c.id for c in contracts])
+        with QueryCounter() as counter:
+            start = time.time()
+            getattr(Contract, transition)(contracts)
+            seconds = time.time() - start
+        self.results.append({
+            'transition': transition,
+            'contracts': len(contracts),
+            'lines': len(contracts) * self.lines,
+            'seconds': seconds,
+            'seconds_per_contract': seconds / (len(contracts) or 1),
+            'queries': counter.count,
+            'queries_per_contract': (
+                float(counter.count) / (len(contracts) or 1)
+            ),
+        })
+
+    def run(self):
+        profiling.enable()
+        profiling.reset()
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_company()
+            with Transaction().set_context(company=self.company.id):
+                self.setup_accounting()
+                self.setup_stock()
+                self.setup_configuration()
+                self.setup_products()
+
+                contracts = self.create_contracts()
+                canceled = self.create_contracts()
+                for transition in ('quote', 'reserve', 'active', 'close'):
+                    self.measure(transition, contracts)
+                self.measure('quote', canceled)
+                self.measure('cancel', canceled)
+            Transaction().cursor.rollback()
+        return {
+            'database': os.environ.get('TRYTOND_DATABASE_URI', ''),
+            'parameters': {
+                'contracts': self.contracts,
+                'lines': self.lines,
+                'products': self.products,
+                'warehouses': self.warehouses,
+            },
+            'results': self.results,
+            'profile': profiling.snapshot(),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the rental contract workflow')
+    parser.add_argument('--contracts', type=int, default=100)
+    parser.add_argument('--lines', type=int, default=5)
+    parser.add_argument('--products', type=int, default=10)
+    parser.add_argument('--warehouses', type=int, default=1)
+    parser.add_argument('--output', help='file to write the JSON into')
+    args = parser.parse_args()
+
+    result = RentalBenchmark(
+        args.contracts, args.lines, args.products, args.warehouses
+    ).run()
+    output = json.dumps(result, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+    tests/test_availability.py
+
+    :copyright: (C) 2015 by Fulfil.IO Inc.
+    :license: see LICENSE.
+"""
+import sys
+import os
+DIR = os.path.abspath(os.path.normpath(os.path.join(
+    __file__, '..', '..', '..', '..', '..', 'trytond'
+)))
+if os.path.isdir(DIR):
+    sys.path.insert(0, os.path.dirname(DIR))
+import unittest
+from datetime import datetime, timedelta
+from random import Random
+
+import trytond.tests.test_tryton
+from trytond.modules.rental.availability import IntervalIndex
+
+
+def day(number):
+    return datetime(2015, 1, 1) + timedelta(days=number)
+
+
+class TestAvailability(unittest.TestCase):
+    '''
+    Test the interval index of the rental availability
+    '''
+
+    def setUp(self):
+        self.index = IntervalIndex([
+            (day(0), day(10), 2),
+            (day(5), day(15), 3),
+            (day(20), day(25), 1),
+        ])
+
+    def test0010peak(self):
+        '''
+        Test the peak quantity committed over windows
+        '''
+        self.assertEqual(self.index.peak(day(0), day(5)), 2)
+        self.assertEqual(self.index.peak(day(0), day(6)), 5)
+        self.assertEqual(self.index.peak(day(10), day(20)), 3)
+        self.assertEqual(self.index.peak(day(15), day(20)), 0)
+        self.assertEqual(self.index.peak(day(-10), day(0)), 0)
+        self.assertEqual(self.index.peak(day(30), day(40)), 0)
+        self.assertEqual(self.index.free(5, day(7), day(8)), 0)
+
+    def test0020add_remove(self):
+        '''
+        Test adding and removing intervals keeps the index consistent
+        '''
+        self.index.add(day(12), day(22), 4)
+        self.assertEqual(self.index.peak(day(12), day(15)), 7)
+        self.assertEqual(self.index.peak(day(20), day(21)), 5)
+        self.index.remove(day(5), day(15), 3)
+        self.assertEqual(self.index.peak(day(0), day(15)), 4)
+        self.assertEqual(len(self.index), 3)
+
+    def test0025add_within_bounds(self):
+        '''
+        Test adding intervals within the initial bounds keeps the segments
+        '''
+        index = IntervalIndex(
+            [(day(0), day(10), 2)], [day(3), day(12), day(20)]
+        )
+        tree = index.tree
+        index.add(day(3), day(12), 1)
+        index.add(day(12), day(20), 4)
+        self.assertIs(index.tree, tree)
+        self.assertEqual(index.peak(day(0), day(3)), 2)
+        self.assertEqual(index.peak(day(3), day(10)), 3)
+        self.assertEqual(index.peak(day(10), day(12)), 1)
+        self.assertEqual(index.peak(day(12), day(20)), 4)
+        self.assertEqual(index.peak(day(20), day(30)), 0)
+
+        index.add(day(15), day(25), 1)
+        self.assertIsNot(index.tree, tree)
+        self.assertIn(day(3), index.bounds)
+        self.assertEqual(index.peak(day(15), day(20)), 5)
+        self.assertEqual(index.peak(day(20), day(25)), 1)
+
+    def test0030first_free(self):
+        '''
+        Test the first free slot
+        '''
+        duration = timedelta(days=3)
+        self.assertEqual(
+            self.index.first_free(5, 1, duration, day(0)), day(0)
+        )
+        self.assertEqual(
+            self.index.first_free(5, 2, duration, day(3)), day(10)
+        )
+        self.assertEqual(
+            self.index.first_free(5, 5, duration, day(0)), day(15)
+        )
+        self.assertEqual(
+            self.index.first_free(5, 5, timedelta(days=6), day(0)), day(25)
+        )
+        self.assertIsNone(self.index.first_free(5, 6, duration, day(0)))
+
+    def test0040first_free_scan(self):
+        '''
+        Test the first free slot matches a scan of the bounds
+        '''
+        random = Random(42)
+        intervals = []
+        for _ in range(200):
+            start = random.randint(0, 365)
+            intervals.append(
+                (day(start), day(start + random.randint(1, 30)),
+                    random.randint(1, 4))
+            )
+        index = IntervalIndex(intervals)
+        index.remove(*intervals[0])
+        index.add(day(100), day(130), 3)
+
+        def scan(capacity, quantity, duration, after):
+            for start in [after] + [b for b in index.bounds if b > after]:
+                if index.peak(start, start + duration) + quantity <= capacity:
+                    return start
+
+        for _ in range(200):
+            capacity = random.randint(5, 30)
+            quantity = random.randint(1, capacity)
+            duration = timedelta(days=random.randint(1, 20))
+            after = day(random.randint(-10, 400))
+            self.assertEqual(
+                index.first_free(capacity, quantity, duration, after),
+                scan(capacity, quantity, duration, after)
+            )
+
+
+def suite():
+    """
+    Define suite
+    """
+    test_suite = trytond.tests.test_tryton.suite()
+    test_suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestAvailability)
+    )
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
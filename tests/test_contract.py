@@ -0,0 +1,1966 @@
+# -*- coding: utf-8 -*-
+"""
+    tests/test_contract.py
+
+    :copyright: (C) 2015 by Fulfil.IO Inc.
+    :license: see LICENSE.
+"""
+import sys
+import os
+DIR = os.path.abspath(os.path.normpath(os.path.join(
+    __file__, '..', '..', '..', '..', '..', 'trytond'
+)))
+if os.path.isdir(DIR):
+    sys.path.insert(0, os.path.dirname(DIR))
+import unittest
+import datetime
+import json
+from contextlib import contextmanager
+from decimal import Decimal
+from hashlib import md5
+
+from dateutil.relativedelta import relativedelta
+
+import trytond.tests.test_tryton
+from trytond.tests.test_tryton import POOL, DB_NAME, USER, CONTEXT
+from trytond.transaction import Transaction
+from trytond.exceptions import UserError, UserWarning
+
+from trytond.modules.rental.worker import get_parser, run_jobs
+
+
+class TestContract(unittest.TestCase):
+    '''
+    Test the rental contracts on the database
+    '''
+
+    def setUp(self):
+        """
+        Set up data used in the tests.
+        this method is called before each test function execution.
+        """
+        trytond.tests.test_tryton.install_module('rental')
+
+        self.Contract = POOL.get('rental.contract')
+        self.ContractLine = POOL.get('rental.contract.line')
+
+    def setup_defaults(self):
+        """
+        Create the company, its accounting, the configuration, a customer
+        and a rentable product with stock
+        """
+        self.setup_company()
+        with Transaction().set_context(company=self.company.id):
+            self.setup_accounting()
+            self.setup_configuration()
+            self.setup_party()
+            self.setup_product()
+
+    def setup_company(self):
+        Currency = POOL.get('currency.currency')
+        Company = POOL.get('company.company')
+        Party = POOL.get('party.party')
+        User = POOL.get('res.user')
+
+        self.currency, = Currency.create([{
+            'name': 'US Dollar',
+            'code': 'USD',
+            'symbol': '$',
+        }])
+        party, = Party.create([{'name': 'Rental Company'}])
+        self.company, = Company.create([{
+            'party': party.id,
+            'currency': self.currency.id,
+        }])
+        User.write([User(USER)], {
+            'main_company': self.company.id,
+            'company': self.company.id,
+        })
+
+    def setup_accounting(self):
+        AccountTemplate = POOL.get('account.account.template')
+        Account = POOL.get('account.account')
+        CreateChart = POOL.get('account.create_chart', type='wizard')
+        FiscalYear = POOL.get('account.fiscalyear')
+        Sequence = POOL.get('ir.sequence')
+        SequenceStrict = POOL.get('ir.sequence.strict')
+        PaymentTerm = POOL.get('account.invoice.payment_term')
+
+        template, = AccountTemplate.search([('parent', '=', None)])
+        session_id, _, _ = CreateChart.create()
+        create_chart = CreateChart(session_id)
+        create_chart.account.account_template = template
+        create_chart.account.company = self.company
+        create_chart.transition_create_account()
+        receivable, = Account.search([
+            ('kind', '=', 'receivable'),
+            ('company', '=', self.company.id),
+        ])
+        payable, = Account.search([
+            ('kind', '=', 'payable'),
+            ('company', '=', self.company.id),
+        ])
+        self.revenue, = Account.search([
+            ('kind', '=', 'revenue'),
+            ('company', '=', self.company.id),
+        ])
+        create_chart.properties.company = self.company
+        create_chart.properties.account_receivable = receivable
+        create_chart.properties.account_payable = payable
+        create_chart.transition_create_properties()
+
+        today = datetime.date.today()
+        post_move_sequence, = Sequence.create([{
+            'name': '%s' % today.year,
+            'code': 'account.move',
+            'company': self.company.id,
+        }])
+        invoice_sequence, = SequenceStrict.create([{
+            'name': '%s' % today.year,
+            'code': 'account.invoice',
+            'company': self.company.id,
+        }])
+        fiscal_year, = FiscalYear.create([{
+            'name': '%s' % today.year,
+            'start_date': today + relativedelta(years=-1, month=1, day=1),
+            'end_date': today + relativedelta(years=1, month=12, day=31),
+            'company': self.company.id,
+            'post_move_sequence': post_move_sequence.id,
+            'out_invoice_sequence': invoice_sequence.id,
+            'in_invoice_sequence': invoice_sequence.id,
+            'out_credit_note_sequence': invoice_sequence.id,
+            'in_credit_note_sequence': invoice_sequence.id,
+        }])
+        FiscalYear.create_period([fiscal_year])
+
+        self.payment_term, = PaymentTerm.create([{
+            'name': 'Direct',
+            'lines': [('create', [{'type': 'remainder'}])],
+        }])
+
+    def setup_configuration(self):
+        Configuration = POOL.get('rental.configuration')
+        Journal = POOL.get('account.journal')
+        Location = POOL.get('stock.location')
+        Sequence = POOL.get('ir.sequence')
+
+        journal, = Journal.search([('code', '=', 'REV')])
+        self.customer_location, = Location.search([('code', '=', 'CUS')])
+        self.sequence, = Sequence.search([('code', '=', 'rental.contract')])
+        self.warehouse, = Location.search([('type', '=', 'warehouse')])
+        configuration = Configuration(1)
+        configuration.contract_sequence = self.sequence
+        configuration.subscription_journal = journal
+        configuration.subscription_invoice_payment_term = self.payment_term
+        configuration.rent_location = self.customer_location
+        configuration.save()
+
+    def setup_party(self):
+        Party = POOL.get('party.party')
+
+        self.party, = Party.create([{
+            'name': 'Rental Customer',
+            'addresses': [('create', [{'name': 'Rental Customer'}])],
+        }])
+        self.address, = self.party.addresses
+
+    def setup_product(self, quantity=10):
+        Template = POOL.get('product.template')
+        Uom = POOL.get('product.uom')
+        Location = POOL.get('stock.location')
+        Move = POOL.get('stock.move')
+
+        self.unit, = Uom.search([('name', '=', 'Unit')])
+        template, = Template.create([{
+            'name': 'Rental Product',
+            'type': 'goods',
+            'rentable': True,
+            'default_uom': self.unit.id,
+            'list_price': Decimal('100'),
+            'cost_price': Decimal('50'),
+            'rent_hourly': Decimal('1'),
+            'rent_daily': Decimal('10'),
+            'rent_weekly': Decimal('50'),
+            'rent_monthly': Decimal('150'),
+            'rent_yearly': Decimal('1000'),
+            'account_revenue': self.revenue.id,
+            'products': [('create', [{}])],
+        }])
+        self.product, = template.products
+
+        supplier, = Location.search([('code', '=', 'SUP')])
+        moves = Move.create([{
+            'product': self.product.id,
+            'uom': self.unit.id,
+            'quantity': quantity,
+            'from_location': supplier.id,
+            'to_location': self.warehouse.storage_location.id,
+            'unit_price': Decimal('50'),
+            'currency': self.currency.id,
+            'company': self.company.id,
+        }])
+        Move.do(moves)
+
+    def create_contract(self, start_date, end_date, quantity=1, **values):
+        "Create a contract of quantity units of the product"
+        values.setdefault('billing_method', 'daily')
+        values.setdefault('lines', [('create', [{
+            'product': self.product.id,
+            'quantity': quantity,
+            'unit': self.unit.id,
+            'unit_price': Decimal('10'),
+            'description': self.product.rec_name,
+        }])])
+        values.update({
+            'company': self.company.id,
+            'currency': self.currency.id,
+            'party': self.party.id,
+            'invoice_address': self.address.id,
+            'shipment_address': self.address.id,
+            'warehouse': self.warehouse.id,
+            'start_date': start_date,
+            'end_date': end_date,
+        })
+        contract, = self.Contract.create([values])
+        return contract
+
+    @contextmanager
+    def record_commits(self):
+        """
+        Record the commits and the rollbacks of the cursor instead of running
+        them so the test database is not committed
+        """
+        cursor = Transaction().cursor
+        calls = []
+        cursor.commit = lambda: calls.append('commit')
+        cursor.rollback = lambda: calls.append('rollback')
+        try:
+            yield calls
+        finally:
+            del cursor.commit
+            del cursor.rollback
+
+    def test0010search_period(self):
+        '''
+        Test the search of the contracts and lines overlapping a period
+        '''
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+            with Transaction().set_context(company=self.company.id):
+                start = datetime.datetime(2015, 6, 1)
+                january = self.create_contract(
+                    datetime.datetime(2015, 1, 1),
+                    datetime.datetime(2015, 2, 1)
+                )
+                june = self.create_contract(
+                    datetime.datetime(2015, 6, 10),
+                    datetime.datetime(2015, 6, 20)
+                )
+                across = self.create_contract(
+                    datetime.datetime(2015, 5, 25),
+                    datetime.datetime(2015, 6, 5)
+                )
+                self.create_contract(None, None)
+
+                self.assertEqual(
+                    set(self.Contract.search([
+                        ('period', '=', (start, start + relativedelta(
+                            months=1))),
+                    ])), set([june, across])
+                )
+                # The end of the period is excluded
+                self.assertEqual(
+                    self.Contract.search([
+                        ('period', '=', (
+                            datetime.datetime(2015, 2, 1),
+                            datetime.datetime(2015, 3, 1)
+                        )),
+                    ]), []
+                )
+                self.assertEqual(
+                    self.Contract.search([
+                        ('period', '=', (
+                            datetime.datetime(2014, 12, 1),
+                            datetime.datetime(2015, 1, 2)
+                        )),
+                    ]), [january]
+                )
+                self.assertEqual(
+                    self.ContractLine.search([
+                        ('period', '=', (start, start + relativedelta(
+                            days=1))),
+                        ('product', '=', self.product.id),
+                    ]), list(across.lines)
+                )
+                self.assertRaises(
+                    UserError, self.Contract.search, [
+                        ('period', '!=', (start, start)),
+                    ]
+                )
+
+    def test0020quote_references(self):
+        '''
+        Test quoting numbers the contracts from the contract sequence
+        '''
+        Sequence = POOL.get('ir.sequence')
+
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+            with Transaction().set_context(company=self.company.id):
+                start = datetime.datetime(2015, 6, 1)
+                contracts = [
+                    self.create_contract(start, start + relativedelta(days=2))
+                    for _ in range(2)
+                ]
+                number_next = self.sequence.number_next
+
+                self.Contract.quote(contracts)
+
+                self.assertEqual(
+                    [c.reference for c in self.Contract.browse(contracts)],
+                    [str(number_next), str(number_next + 1)]
+                )
+                self.assertTrue(
+                    all(c.state == 'quotation' for c in contracts)
+                )
+                self.assertEqual(
+                    Sequence(self.sequence.id).number_next, number_next + 2
+                )
+                self.assertEqual(
+                    Sequence.get_id(self.sequence.id), str(number_next + 2)
+                )
+
+                # The contracts keep their reference when quoted again
+                self.Contract.draft(contracts)
+                self.Contract.quote(contracts)
+                self.assertEqual(
+                    [c.reference for c in self.Contract.browse(contracts)],
+                    [str(number_next), str(number_next + 1)]
+                )
+
+    def test0030relations(self):
+        '''
+        Test the getters and searchers of the invoices, shipments and moves
+        '''
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+            with Transaction().set_context(company=self.company.id):
+                start = datetime.datetime(2015, 6, 1)
+                contract1, contract2 = [
+                    self.create_contract(
+                        start, start + relativedelta(days=2), quantity=2
+                    ) for _ in range(2)
+                ]
+                draft = self.create_contract(
+                    start, start + relativedelta(days=2)
+                )
+                contracts = [contract1, contract2]
+                self.Contract.quote(contracts)
+                self.Contract.reserve(contracts)
+
+                for contract in self.Contract.browse(contracts):
+                    line, = contract.lines
+                    invoice, = contract.invoices
+                    shipment, = contract.shipments
+                    shipment_return, = contract.shipment_returns
+                    self.assertEqual(
+                        [l.origin for l in invoice.lines], [line]
+                    )
+                    self.assertEqual(shipment.state, 'waiting')
+                    self.assertEqual(
+                        set(contract.moves),
+                        set(shipment.outgoing_moves)
+                        | set(shipment_return.moves)
+                    )
+                    self.assertEqual(self.Contract.search([
+                        ('invoices', '=', invoice.id),
+                    ]), [contract])
+                    self.assertEqual(self.Contract.search([
+                        ('shipments', '=', shipment.id),
+                    ]), [contract])
+                    self.assertEqual(self.Contract.search([
+                        ('shipment_returns', '=', shipment_return.id),
+                    ]), [contract])
+
+                draft = self.Contract(draft.id)
+                self.assertEqual(draft.invoices, ())
+                self.assertEqual(draft.shipments, ())
+                self.assertEqual(draft.moves, ())
+
+    def test0040bill_february(self):
+        '''
+        Test the recurring billing of a monthly period in February
+        '''
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+            with Transaction().set_context(company=self.company.id):
+                contract = self.create_contract(
+                    datetime.datetime(2015, 2, 1),
+                    datetime.datetime(2015, 4, 15),
+                    billing_method='monthly', billing_type='recurring',
+                    billing_frequency=1,
+                )
+                self.Contract.quote([contract])
+                self.Contract.reserve([contract])
+                contract = self.Contract(contract.id)
+                self.assertEqual(contract.invoices, ())
+                self.assertEqual(
+                    contract.next_billing_date, datetime.date(2015, 2, 1)
+                )
+
+                # Not due yet
+                self.Contract.bill_contracts(datetime.date(2015, 1, 31))
+                self.assertEqual(self.Contract(contract.id).invoices, ())
+
+                self.Contract.bill_contracts(datetime.date(2015, 2, 1))
+                contract = self.Contract(contract.id)
+                invoice, = contract.invoices
+                invoice_line, = invoice.lines
+                self.assertEqual(invoice_line.quantity, 1)
+                self.assertEqual(invoice_line.unit_price, Decimal('10'))
+                self.assertEqual(invoice.untaxed_amount, Decimal('10'))
+                line, = contract.lines
+                self.assertEqual(
+                    line.billed_until, datetime.datetime(2015, 3, 1)
+                )
+                self.assertEqual(
+                    contract.next_billing_date, datetime.date(2015, 3, 1)
+                )
+
+                # A rerun for the same date bills nothing more
+                self.Contract.bill_contracts(datetime.date(2015, 2, 1))
+                self.assertEqual(len(self.Contract(contract.id).invoices), 1)
+
+                self.Contract.bill_contracts(datetime.date(2015, 4, 1))
+                contract = self.Contract(contract.id)
+                self.assertEqual(len(contract.invoices), 2)
+                self.assertEqual(
+                    contract.next_billing_date, datetime.date(2015, 4, 1)
+                )
+                # The last period is shorter than a month like the whole
+                # units of the contract duration
+                self.Contract.bill_contracts(datetime.date(2015, 4, 1))
+                contract = self.Contract(contract.id)
+                self.assertEqual(len(contract.invoices), 2)
+                self.assertEqual(contract.next_billing_date, None)
+
+    def test0050ship_not_assigned(self):
+        '''
+        Test the contracts which can not be assigned stay reserved without
+        holding stock
+        '''
+        Warning_ = POOL.get('res.user.warning')
+
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+            with Transaction().set_context(company=self.company.id):
+                start = datetime.datetime(2015, 6, 1)
+                shipped = self.create_contract(
+                    start, start + relativedelta(days=2), quantity=6
+                )
+                start = datetime.datetime(2015, 6, 10)
+                failed = self.create_contract(
+                    start, start + relativedelta(days=2), quantity=6
+                )
+                contracts = [shipped, failed]
+                self.Contract.quote(contracts)
+                self.Contract.reserve(contracts)
+
+                Warning_.create([{
+                    'user': USER,
+                    'name': 'rental_contract_active_%s' % md5(
+                        str(failed.id)
+                    ).hexdigest(),
+                    'always': False,
+                }])
+                self.Contract.active(contracts)
+
+                shipped, failed = self.Contract.browse(contracts)
+                self.assertEqual(shipped.state, 'active')
+                shipment, = shipped.shipments
+                self.assertEqual(shipment.state, 'done')
+                self.assertEqual(failed.state, 'reservation')
+                shipment, = failed.shipments
+                self.assertEqual(shipment.state, 'waiting')
+                self.assertTrue(shipment.inventory_moves)
+                self.assertTrue(all(
+                    m.state == 'draft' for m in shipment.inventory_moves
+                ))
+
+                # Without the confirmation the user is warned
+                self.assertRaises(
+                    UserWarning, self.Contract.active, [failed]
+                )
+
+    def test0060check_overdue(self):
+        '''
+        Test the overdue contracts are marked and invoiced late fees
+        '''
+        Configuration = POOL.get('rental.configuration')
+        Template = POOL.get('product.template')
+
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+            with Transaction().set_context(company=self.company.id):
+                template, = Template.create([{
+                    'name': 'Late Fee',
+                    'type': 'service',
+                    'default_uom': self.unit.id,
+                    'list_price': Decimal('0'),
+                    'cost_price': Decimal('0'),
+                    'account_revenue': self.revenue.id,
+                    'products': [('create', [{}])],
+                }])
+                late_fee, = template.products
+                configuration = Configuration(1)
+                configuration.late_fee_product = late_fee
+                configuration.save()
+
+                start = datetime.datetime(2015, 6, 1)
+                contract = self.create_contract(
+                    start, start + relativedelta(days=2)
+                )
+                returned = self.create_contract(
+                    start, start + relativedelta(days=2)
+                )
+                contracts = [contract, returned]
+                self.Contract.quote(contracts)
+                self.Contract.reserve(contracts)
+                self.Contract.active(contracts)
+                self.Contract.close([returned])
+
+                now = datetime.datetime(2015, 6, 5, 12)
+                self.Contract.check_overdue(now)
+
+                contract, returned = self.Contract.browse(contracts)
+                self.assertTrue(contract.overdue)
+                self.assertFalse(returned.overdue)
+                self.assertEqual(
+                    contract.late_fee_until, datetime.datetime(2015, 6, 5)
+                )
+                fee_line, = contract.late_fee_lines
+                self.assertEqual(fee_line.origin, contract)
+                self.assertEqual(fee_line.product, late_fee)
+                self.assertEqual(fee_line.quantity, 2)
+                self.assertEqual(fee_line.unit_price, Decimal('10'))
+                self.assertIn(fee_line.invoice, contract.invoices)
+                self.assertEqual(len(contract.invoices), 2)
+                self.assertEqual(self.Contract.search([
+                    ('invoices', '=', fee_line.invoice.id),
+                ]), [contract])
+
+                # The late fees are invoiced once per period
+                self.Contract.check_overdue(now)
+                self.assertEqual(
+                    len(self.Contract(contract.id).late_fee_lines), 1
+                )
+                self.assertEqual(returned.late_fee_lines, ())
+
+    def test0070line_warehouse(self):
+        '''
+        Test the lines are shipped from their own warehouse or from the
+        warehouse of the contract
+        '''
+        Location = POOL.get('stock.location')
+
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+            with Transaction().set_context(company=self.company.id):
+                input_, output, storage = Location.create([{
+                    'name': 'Input 2',
+                    'type': 'storage',
+                }, {
+                    'name': 'Output 2',
+                    'type': 'storage',
+                }, {
+                    'name': 'Storage 2',
+                    'type': 'storage',
+                }])
+                warehouse, = Location.create([{
+                    'name': 'Warehouse 2',
+                    'code': 'WH2',
+                    'type': 'warehouse',
+                    'input_location': input_.id,
+                    'output_location': output.id,
+                    'storage_location': storage.id,
+                }])
+
+                start = datetime.datetime(2015, 6, 1)
+                line = {
+                    'product': self.product.id,
+                    'quantity': 1,
+                    'unit': self.unit.id,
+                    'unit_price': Decimal('10'),
+                    'description': self.product.rec_name,
+                }
+                contract = self.create_contract(
+                    start, start + relativedelta(days=2), lines=[('create', [
+                        line, dict(line, warehouse=warehouse.id),
+                    ])]
+                )
+                self.Contract.quote([contract])
+                self.Contract.reserve([contract])
+
+                contract = self.Contract(contract.id)
+                self.assertEqual(len(contract.shipments), 2)
+                for shipment in contract.shipments:
+                    move, = shipment.outgoing_moves
+                    line_warehouse = move.origin.warehouse or self.warehouse
+                    self.assertEqual(shipment.warehouse, line_warehouse)
+                    self.assertEqual(
+                        move.from_location, line_warehouse.output_location
+                    )
+                self.assertEqual(
+                    set(s.warehouse for s in contract.shipments),
+                    set([self.warehouse, warehouse])
+                )
+
+    def test0080job_not_assigned(self):
+        '''
+        Test the jobs activate the contracts which can be assigned without
+        a warning for the others
+        '''
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+            with Transaction().set_context(company=self.company.id):
+                start = datetime.datetime(2015, 6, 1)
+                shipped = self.create_contract(
+                    start, start + relativedelta(days=2), quantity=6
+                )
+                start = datetime.datetime(2015, 6, 10)
+                failed = self.create_contract(
+                    start, start + relativedelta(days=2), quantity=6
+                )
+                contracts = [shipped, failed]
+                self.Contract.quote(contracts)
+                self.Contract.reserve(contracts)
+
+                with Transaction().set_context(rental_job=True):
+                    self.Contract.active(contracts)
+
+                shipped, failed = self.Contract.browse(contracts)
+                self.assertEqual(shipped.state, 'active')
+                self.assertEqual(failed.state, 'reservation')
+
+    def test0090utilization_revenue(self):
+        '''
+        Test the revenue of the utilization buckets is the invoiced rent
+        '''
+        Bucket = POOL.get('rental.utilization.bucket')
+
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+            with Transaction().set_context(company=self.company.id):
+                # 2 units at 10 a day for 3 days from noon
+                start = datetime.datetime(2015, 6, 1, 12)
+                contract = self.create_contract(
+                    start, start + relativedelta(days=3), quantity=2
+                )
+                self.Contract.quote([contract])
+                self.Contract.reserve([contract])
+
+                buckets = Bucket.search([
+                    ('contract', '=', contract.id),
+                ], order=[('date', 'ASC')])
+                self.assertEqual(
+                    [(b.date, b.rented_hours, b.revenue) for b in buckets], [
+                        (datetime.date(2015, 6, 1), 24., Decimal('10')),
+                        (datetime.date(2015, 6, 2), 48., Decimal('20')),
+                        (datetime.date(2015, 6, 3), 48., Decimal('20')),
+                        (datetime.date(2015, 6, 4), 24., Decimal('10')),
+                    ]
+                )
+                self.assertEqual(
+                    sum(b.revenue for b in buckets), Decimal('60')
+                )
+
+    def test0100extend_recurring(self):
+        '''
+        Test the extension of a recurring contract billed to its end is
+        billed
+        '''
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+            with Transaction().set_context(company=self.company.id):
+                start = datetime.datetime(2015, 6, 1)
+                contract = self.create_contract(
+                    start, start + relativedelta(days=2),
+                    billing_type='recurring', billing_frequency=2
+                )
+                self.Contract.quote([contract])
+                self.Contract.reserve([contract])
+                self.Contract.bill_contracts(datetime.date(2015, 6, 1))
+                contract = self.Contract(contract.id)
+                self.assertEqual(len(contract.invoices), 1)
+                self.assertEqual(contract.next_billing_date, None)
+
+                self.Contract.extend([contract], 1)
+                contract = self.Contract(contract.id)
+                self.assertEqual(
+                    contract.end_date, datetime.datetime(2015, 6, 4)
+                )
+                self.assertEqual(
+                    contract.next_billing_date, datetime.date(2015, 6, 3)
+                )
+                self.Contract.bill_contracts(datetime.date(2015, 6, 3))
+                contract = self.Contract(contract.id)
+                self.assertEqual(len(contract.invoices), 2)
+                self.assertEqual(
+                    sum(i.untaxed_amount for i in contract.invoices),
+                    Decimal('30')
+                )
+                self.assertEqual(contract.next_billing_date, None)
+                line, = contract.lines
+                self.assertEqual(
+                    line.billed_until, datetime.datetime(2015, 6, 4)
+                )
+
+    def test0110renew_asynchronous(self):
+        '''
+        Test the successors are quoted when the workflow is asynchronous
+        '''
+        Configuration = POOL.get('rental.configuration')
+        Job = POOL.get('rental.contract.job')
+
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+            with Transaction().set_context(company=self.company.id):
+                start = datetime.datetime(2015, 6, 1)
+                contract = self.create_contract(
+                    start, start + relativedelta(days=2)
+                )
+                self.Contract.quote([contract])
+                self.Contract.reserve([contract])
+
+                configuration = Configuration(1)
+                configuration.asynchronous_workflow = True
+                configuration.save()
+
+                successor, = self.Contract.renew([contract], 3)
+                successor = self.Contract(successor.id)
+                self.assertEqual(successor.state, 'quotation')
+                self.assertEqual(successor.renewed_from, contract)
+                self.assertEqual(
+                    successor.end_date, datetime.datetime(2015, 6, 6)
+                )
+                self.assertEqual(Job.search([]), [])
+
+    def test0120reserve_by_chunks(self):
+        '''
+        Test the reservation by chunks resumes after the last reserved line
+        '''
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+            with Transaction().set_context(company=self.company.id):
+                start = datetime.datetime(2015, 6, 1)
+                line = {
+                    'product': self.product.id,
+                    'quantity': 1,
+                    'unit': self.unit.id,
+                    'unit_price': Decimal('10'),
+                    'description': self.product.rec_name,
+                }
+                contract = self.create_contract(
+                    start, start + relativedelta(days=2),
+                    lines=[('create', [line, line, line])]
+                )
+                self.Contract.quote([contract])
+                self.Contract.reserve_by_chunks(contract, 2)
+
+                contract = self.Contract(contract.id)
+                self.assertEqual(
+                    contract.reserved_line, max(l.id for l in contract.lines)
+                )
+                invoice = contract.reservation_invoice
+                self.assertEqual(len(invoice.lines), 3)
+                self.assertEqual(invoice.untaxed_amount, Decimal('60'))
+                shipment, = contract.shipments
+                self.assertEqual(shipment.state, 'waiting')
+                self.assertEqual(len(shipment.outgoing_moves), 3)
+                shipment_return, = contract.shipment_returns
+                self.assertEqual(len(shipment_return.incoming_moves), 3)
+
+                # The lines added after an interrupted reservation are
+                # reserved on the same invoice and shipments
+                self.ContractLine.create([
+                    dict(line, rental_contract=contract.id),
+                    dict(line, rental_contract=contract.id),
+                ])
+                self.Contract.reserve_by_chunks(contract, 2)
+
+                contract = self.Contract(contract.id)
+                self.assertEqual(contract.reservation_invoice, invoice)
+                self.assertEqual(len(invoice.lines), 5)
+                self.assertEqual(
+                    self.Contract(contract.id).shipments, (shipment,)
+                )
+                self.assertEqual(len(shipment.outgoing_moves), 5)
+                self.assertEqual(
+                    contract.shipment_returns, (shipment_return,)
+                )
+                self.assertEqual(len(shipment_return.incoming_moves), 5)
+
+                # A completed reservation creates nothing more
+                self.Contract.reserve_by_chunks(contract, 2)
+                self.assertEqual(len(invoice.lines), 5)
+                self.assertEqual(len(shipment.outgoing_moves), 5)
+
+    def test0130check_availability(self):
+        '''
+        Test the reservations are checked against the reserved contracts and
+        each other
+        '''
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+            with Transaction().set_context(company=self.company.id):
+                start = datetime.datetime(2015, 6, 1)
+                reserved = self.create_contract(
+                    start, start + relativedelta(days=5), quantity=6
+                )
+                self.Contract.quote([reserved])
+                self.Contract.reserve([reserved])
+
+                overlapping = self.create_contract(
+                    start + relativedelta(days=4),
+                    start + relativedelta(days=6), quantity=5
+                )
+                after = self.create_contract(
+                    start + relativedelta(days=5),
+                    start + relativedelta(days=7), quantity=10
+                )
+                self.Contract.quote([overlapping, after])
+                self.assertRaises(
+                    UserError, self.Contract.check_availability,
+                    [overlapping]
+                )
+                self.Contract.check_availability([after])
+
+                # The contracts checked together hold the products for each
+                # other
+                first = self.create_contract(
+                    start + relativedelta(days=10),
+                    start + relativedelta(days=12), quantity=6
+                )
+                second = self.create_contract(
+                    start + relativedelta(days=11),
+                    start + relativedelta(days=13), quantity=6
+                )
+                self.Contract.quote([first, second])
+                self.Contract.check_availability([first])
+                self.Contract.check_availability([second])
+                self.assertRaises(
+                    UserError, self.Contract.check_availability,
+                    [first, second]
+                )
+
+    def test0140get_rent_rates(self):
+        '''
+        Test the exchange rates of the rents are cached per transaction
+        '''
+        Currency = POOL.get('currency.currency')
+        CurrencyRate = POOL.get('currency.currency.rate')
+        Product = POOL.get('product.product')
+
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+            date = datetime.date(2015, 6, 1)
+            with Transaction().set_context(company=self.company.id):
+                euro, = Currency.create([{
+                    'name': 'Euro',
+                    'code': 'EUR',
+                    'symbol': u'\u20ac',
+                    'rates': [('create', [{
+                        'date': datetime.date(2015, 1, 1),
+                        'rate': Decimal('2'),
+                    }])],
+                }])
+                CurrencyRate.create([{
+                    'currency': self.currency.id,
+                    'date': datetime.date(2015, 1, 1),
+                    'rate': Decimal('1'),
+                }])
+            with Transaction().set_context(
+                    company=self.company.id, currency=euro.id,
+                    billing_method='daily', contract_start_date=date):
+                self.assertEqual(
+                    Product.get_rent([self.product]),
+                    {self.product.id: Decimal('20')}
+                )
+                self.assertEqual(
+                    Product._get_rent_rates().keys(),
+                    [(self.currency.id, euro.id, date)]
+                )
+
+                # The rate of the date is reused by the transaction
+                CurrencyRate.write(list(euro.rates), {'rate': Decimal('4')})
+                self.assertEqual(
+                    Product.get_rent([self.product]),
+                    {self.product.id: Decimal('20')}
+                )
+                with Transaction().set_context(
+                        contract_start_date=datetime.date(2015, 7, 1)):
+                    self.assertEqual(
+                        Product.get_rent([self.product]),
+                        {self.product.id: Decimal('40')}
+                    )
+                self.assertEqual(len(Product._get_rent_rates()), 2)
+
+        # Another transaction starts with an empty cache
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.assertEqual(len(Product._get_rent_rates()), 0)
+
+    def test0150invoice_negative_quantity(self):
+        '''
+        Test a line of negative quantity is not invoiced silently
+        '''
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+            with Transaction().set_context(company=self.company.id):
+                start = datetime.datetime(2015, 6, 1)
+                contract = self.create_contract(
+                    start, start + relativedelta(days=2), quantity=-1
+                )
+                self.assertRaises(
+                    UserError, self.Contract.create_invoices, [contract],
+                    'out_invoice'
+                )
+
+    def test0160store_amounts(self):
+        '''
+        Test the stored amounts follow the changes of the lines and of the
+        contracts
+        '''
+        Currency = POOL.get('currency.currency')
+
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+            with Transaction().set_context(company=self.company.id):
+                start = datetime.datetime(2015, 6, 1)
+                contract = self.create_contract(
+                    start, start + relativedelta(days=2), quantity=2
+                )
+                line, = contract.lines
+
+                def check(line_amount, contract_amount):
+                    self.assertEqual(
+                        self.ContractLine(line.id).amount, line_amount
+                    )
+                    stored = self.Contract(contract.id)
+                    self.assertEqual(stored.untaxed_amount, contract_amount)
+                    self.assertEqual(stored.total_amount, contract_amount)
+
+                check(Decimal('20'), Decimal('40'))
+
+                self.ContractLine.write([line], {'quantity': 3})
+                check(Decimal('30'), Decimal('60'))
+
+                self.ContractLine.write([line], {'unit_price': Decimal('5')})
+                check(Decimal('15'), Decimal('30'))
+
+                other, = self.ContractLine.create([{
+                    'rental_contract': contract.id,
+                    'product': self.product.id,
+                    'quantity': 1,
+                    'unit': self.unit.id,
+                    'unit_price': Decimal('10'),
+                    'description': self.product.rec_name,
+                }])
+                check(Decimal('15'), Decimal('50'))
+
+                self.Contract.write([contract], {
+                    'end_date': start + relativedelta(days=3),
+                })
+                check(Decimal('15'), Decimal('75'))
+
+                self.ContractLine.delete([other])
+                check(Decimal('15'), Decimal('45'))
+
+                # The line amounts are rounded by the contract currency
+                self.ContractLine.write([line], {
+                    'quantity': 1,
+                    'unit_price': Decimal('10.27'),
+                })
+                check(Decimal('10.27'), Decimal('30.81'))
+                currency, = Currency.create([{
+                    'name': 'Swiss Franc',
+                    'code': 'CHF',
+                    'symbol': 'CHF',
+                    'rounding': Decimal('0.05'),
+                    'digits': 2,
+                }])
+                self.Contract.write([contract], {'currency': currency.id})
+                check(Decimal('10.25'), Decimal('30.75'))
+
+    def test0170duration(self):
+        '''
+        Test the duration computed, searched and ordered in SQL matches the
+        duration of the billing method
+        '''
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+            with Transaction().set_context(company=self.company.id):
+                start = datetime.datetime(2015, 6, 1, 8, 0)
+                hourly = self.create_contract(
+                    start, start + relativedelta(days=2, hours=5, minutes=30),
+                    billing_method='hourly'
+                )
+                daily = self.create_contract(
+                    start, start + relativedelta(days=3, hours=12),
+                    billing_method='daily'
+                )
+                weekly = self.create_contract(
+                    start, start + relativedelta(days=20),
+                    billing_method='weekly'
+                )
+                monthly = self.create_contract(
+                    start, start + relativedelta(days=29, hours=23),
+                    billing_method='monthly'
+                )
+                reversed_ = self.create_contract(
+                    start, start - relativedelta(hours=1, minutes=30),
+                    billing_method='hourly'
+                )
+                contracts = [hourly, daily, weekly, monthly, reversed_]
+
+                durations = dict(
+                    (c.id, c.on_change_with_duration()) for c in contracts
+                )
+                self.assertEqual(
+                    [durations[c.id] for c in contracts], [53, 3, 2, 0, -2]
+                )
+                self.assertEqual(
+                    self.Contract.get_duration(contracts, 'duration'),
+                    durations
+                )
+                for contract in contracts:
+                    self.assertEqual(
+                        self.Contract.search([
+                            ('duration', '=', durations[contract.id]),
+                        ]), [contract]
+                    )
+                self.assertEqual(
+                    self.Contract.search([('duration', '>=', 3)]),
+                    [hourly, daily]
+                )
+                self.assertEqual(
+                    self.Contract.search([], order=[('duration', 'ASC')]),
+                    [reversed_, monthly, weekly, daily, hourly]
+                )
+
+    def test0180get_rent_price_list(self):
+        '''
+        Test get_rent uses the rules of the price list of the context and
+        follows their changes
+        '''
+        PriceList = POOL.get('rental.price_list')
+        PriceListLine = POOL.get('rental.price_list.line')
+        Product = POOL.get('product.product')
+
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+            with Transaction().set_context(company=self.company.id):
+                price_list, = PriceList.create([{
+                    'name': 'Rental',
+                    'lines': [('create', [{
+                        'sequence': 20,
+                        'product': self.product.id,
+                        'billing_method': 'daily',
+                        'rent': Decimal('8'),
+                    }, {
+                        'sequence': 10,
+                        'billing_method': 'daily',
+                        'quantity': 5,
+                        'rent': Decimal('6'),
+                    }])],
+                }])
+                quantity_rule, product_rule = price_list.lines
+                with Transaction().set_context(billing_method='daily'):
+                    self.assertEqual(
+                        Product.get_rent([self.product], 1),
+                        {self.product.id: Decimal('10')}
+                    )
+                with Transaction().set_context(
+                        price_list=price_list.id, billing_method='daily'):
+                    self.assertEqual(
+                        Product.get_rent([self.product], 1),
+                        {self.product.id: Decimal('8')}
+                    )
+                    self.assertEqual(
+                        Product.get_rent([self.product], 5),
+                        {self.product.id: Decimal('6')}
+                    )
+                    # Other billing methods keep the rent of the product
+                    with Transaction().set_context(billing_method='weekly'):
+                        self.assertEqual(
+                            Product.get_rent([self.product], 1),
+                            {self.product.id: Decimal('50')}
+                        )
+
+                    compiled = price_list.compile()
+                    self.assertIs(PriceList(price_list.id).compile(), compiled)
+
+                    # The changes of the rules are used at once
+                    PriceListLine.write(
+                        [quantity_rule], {'rent': Decimal('5')}
+                    )
+                    self.assertIsNot(
+                        PriceList(price_list.id).compile(), compiled
+                    )
+                    self.assertEqual(
+                        Product.get_rent([self.product], 5),
+                        {self.product.id: Decimal('5')}
+                    )
+                    PriceListLine.delete([quantity_rule])
+                    self.assertEqual(
+                        Product.get_rent([self.product], 5),
+                        {self.product.id: Decimal('8')}
+                    )
+                    PriceListLine.create([{
+                        'price_list': price_list.id,
+                        'sequence': 1,
+                        'rent': Decimal('7'),
+                    }])
+                    self.assertEqual(
+                        Product.get_rent([self.product], 1),
+                        {self.product.id: Decimal('7')}
+                    )
+
+    def test0190check_availability_by_chunks(self):
+        '''
+        Test the quotations with committed chunks of reservation hold their
+        products
+        '''
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+            with Transaction().set_context(company=self.company.id):
+                start = datetime.datetime(2015, 6, 1)
+                end = start + relativedelta(days=2)
+                line = {
+                    'product': self.product.id,
+                    'quantity': 2,
+                    'unit': self.unit.id,
+                    'unit_price': Decimal('10'),
+                    'description': self.product.rec_name,
+                }
+                chunked = self.create_contract(
+                    start, end, lines=[('create', [line, line, line])]
+                )
+                self.Contract.quote([chunked])
+                self.Contract.reserve_by_chunks(chunked, 2)
+                chunked = self.Contract(chunked.id)
+                self.assertEqual(chunked.state, 'quotation')
+                self.assertTrue(chunked.reserved_line)
+
+                over = self.create_contract(start, end, quantity=5)
+                under = self.create_contract(start, end, quantity=4)
+                self.Contract.quote([over, under])
+                self.assertRaises(
+                    UserError, self.Contract.check_availability, [over]
+                )
+                self.Contract.check_availability([under])
+                # A resumed reservation is not checked against itself
+                self.Contract.check_availability([chunked])
+
+    def test0200jobs(self):
+        '''
+        Test the queued workflow buttons are run by the jobs and the timed
+        out jobs are failed
+        '''
+        Configuration = POOL.get('rental.configuration')
+        Job = POOL.get('rental.contract.job')
+
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+            with Transaction().set_context(company=self.company.id):
+                Configuration.write([Configuration(1)], {
+                    'asynchronous_workflow': True,
+                })
+                start = datetime.datetime(2015, 6, 1)
+                contract = self.create_contract(
+                    start, start + relativedelta(days=2), quantity=6
+                )
+                other = self.create_contract(
+                    start, start + relativedelta(days=2), quantity=6
+                )
+                contracts = [contract, other]
+
+                self.Contract.quote(contracts)
+                job, = Job.search([])
+                self.assertEqual(job.method, 'quote')
+                self.assertEqual(job.state, 'queued')
+                self.assertEqual(set(job.contracts), set(contracts))
+                self.assertEqual(self.Contract(contract.id).state, 'draft')
+
+                # The queued contracts are not queued again
+                self.Contract.quote([contract])
+                self.assertEqual(Job.search([]), [job])
+
+                self.assertEqual(Job.process(), 1)
+                job = Job(job.id)
+                self.assertEqual(job.state, 'done')
+                self.assertTrue(job.started <= job.finished)
+                self.assertEqual(
+                    [c.state for c in self.Contract.browse(contracts)],
+                    ['quotation', 'quotation']
+                )
+                self.assertEqual(Job.process(), 0)
+
+                # Both contracts do not fit in the stock
+                self.Contract.reserve(contracts)
+                self.assertEqual(Job.process(), 1)
+                failed, _ = Job.search([])
+                self.assertEqual(failed.method, 'reserve')
+                self.assertEqual(failed.state, 'failed')
+                self.assertIn('UserError', failed.error)
+                self.assertEqual(
+                    [c.state for c in self.Contract.browse(contracts)],
+                    ['quotation', 'quotation']
+                )
+
+                # A running job blocks its contracts until it times out
+                job, = Job.enqueue('reserve', [contract])
+                now = datetime.datetime.now()
+                Job.write([job], {
+                    'state': 'running',
+                    'started': now - Job._running_timeout
+                    + datetime.timedelta(minutes=1),
+                })
+                self.assertEqual(Job.enqueue('reserve', [contract]), [])
+                self.assertEqual(Job.fail_timed_out(), [])
+
+                Job.write([job], {
+                    'started': now - Job._running_timeout
+                    - datetime.timedelta(minutes=1),
+                })
+                new_job, = Job.enqueue('reserve', [contract])
+                job = Job(job.id)
+                self.assertEqual(job.state, 'failed')
+                self.assertTrue(
+                    job.error.startswith('The job did not finish')
+                )
+                self.assertEqual(Job.process(), 1)
+                self.assertEqual(Job(new_job.id).state, 'done')
+                self.assertEqual(
+                    self.Contract(contract.id).state, 'reservation'
+                )
+
+    def test0210missing_rent_location(self):
+        '''
+        Test the rental capacity requires the rent location
+        '''
+        Configuration = POOL.get('rental.configuration')
+        Location = POOL.get('stock.location')
+        Product = POOL.get('product.product')
+
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_company()
+            with Transaction().set_context(company=self.company.id):
+                self.setup_accounting()
+                self.warehouse, = Location.search([('type', '=', 'warehouse')])
+                self.setup_product()
+                # Drop the configuration cached by the previous tests
+                Configuration._values_cache.clear()
+                self.assertRaises(
+                    UserError, Product.get_rental_capacity, [self.product]
+                )
+
+    def test0220extend_availability(self):
+        '''
+        Test the extended periods of the reserved contracts are checked
+        '''
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+            with Transaction().set_context(company=self.company.id):
+                start = datetime.datetime(2015, 6, 1)
+                end = start + relativedelta(days=5)
+                reserved = self.create_contract(start, end, quantity=6)
+                after = self.create_contract(
+                    end, end + relativedelta(days=2), quantity=5
+                )
+                self.Contract.quote([reserved, after])
+                self.Contract.reserve([reserved, after])
+
+                self.assertRaises(
+                    UserError, self.Contract.extend, [reserved], 1
+                )
+                self.assertEqual(
+                    self.Contract(reserved.id).end_date, end
+                )
+
+                self.Contract.write([after], {'lines': [('write', [
+                    l.id for l in after.lines
+                ], {'quantity': 4})]})
+                self.Contract.extend([reserved], 1)
+                self.assertEqual(
+                    self.Contract(reserved.id).end_date,
+                    end + relativedelta(days=1)
+                )
+
+    def test0230exchange(self):
+        '''
+        Test the contracts exported are imported back
+        '''
+        Product = POOL.get('product.product')
+
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+            with Transaction().set_context(company=self.company.id):
+                start = datetime.datetime(2015, 6, 1)
+                contract = self.create_contract(
+                    start, start + relativedelta(days=2), quantity=3,
+                    description='Exported',
+                )
+                line, = self.Contract.iter_export(
+                    [('id', '=', contract.id)], page_size=1
+                )
+                values = json.loads(line)
+                # The product has no code
+                self.assertIsNone(values['lines'][0]['product'])
+
+                imported, = self.Contract.browse(
+                    self.Contract.import_jsonl([line])
+                )
+                self.assertEqual(imported.state, 'draft')
+                self.assertEqual(imported.description, 'Exported')
+                self.assertEqual(imported.party, contract.party)
+                self.assertEqual(imported.warehouse, contract.warehouse)
+                self.assertEqual(imported.start_date, contract.start_date)
+                self.assertEqual(imported.end_date, contract.end_date)
+                self.assertEqual(imported.billing_method, 'daily')
+                imported_line, = imported.lines
+                self.assertEqual(imported_line.product, self.product)
+                self.assertEqual(imported_line.unit, self.unit)
+                self.assertEqual(imported_line.quantity, 3)
+                self.assertEqual(imported_line.unit_price, Decimal('10'))
+
+                # The pages are exported after the last id
+                domain = [('id', 'in', [contract.id, imported.id])]
+                page = self.Contract.export_page(domain, 0, 1)
+                self.assertEqual(page, {'data': line, 'last_id': contract.id})
+                page = self.Contract.export_page(domain, page['last_id'], 1)
+                self.assertEqual(page['last_id'], imported.id)
+                self.assertEqual(
+                    self.Contract.export_page(domain, page['last_id'], 1),
+                    {'data': '', 'last_id': None}
+                )
+                self.assertEqual(len(self.Contract.import_jsonl(
+                    '\n'.join([line, '', page['data']]), batch_size=1
+                )), 2)
+
+                # The billing method defaults like the contracts
+                del values['billing_method']
+                imported, = self.Contract.browse(
+                    self.Contract.import_jsonl(json.dumps(values))
+                )
+                self.assertEqual(imported.billing_method, 'hourly')
+
+                # The products with the same code are found by id
+                other, = Product.copy([self.product])
+                Product.write([self.product, other], {'code': 'RENT'})
+                values['lines'][0]['product'] = 'RENT'
+                imported, = self.Contract.browse(
+                    self.Contract.import_jsonl(json.dumps(values))
+                )
+                self.assertEqual(imported.lines[0].product, self.product)
+                del values['lines'][0]['product_id']
+                self.assertRaises(
+                    UserError, self.Contract.import_jsonl, json.dumps(values)
+                )
+                values['lines'][0]['product'] = 'UNKNOWN'
+                self.assertRaises(
+                    UserError, self.Contract.import_jsonl, json.dumps(values)
+                )
+                values['lines'][0]['product'] = None
+                self.assertRaises(
+                    UserError, self.Contract.import_jsonl, json.dumps(values)
+                )
+                try:
+                    self.Contract.import_jsonl(line + '\n{')
+                except UserError, exception:
+                    self.assertIn('line 2', exception.message)
+                else:
+                    self.fail('The invalid JSON is imported')
+
+    def test0240assets(self):
+        '''
+        Test the assets are rented with the contracts and released when
+        they are closed
+        '''
+        Asset = POOL.get('rental.asset')
+        Template = POOL.get('product.template')
+
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+            with Transaction().set_context(company=self.company.id):
+                Template.write([self.product.template], {
+                    'rental_serialized': True,
+                })
+                first, second, _ = Asset.create([{
+                    'product': self.product.id,
+                    'serial': 'A1',
+                }, {
+                    'product': self.product.id,
+                    'serial': 'A2',
+                }, {
+                    'product': self.product.id,
+                    'serial': 'A3',
+                    'status': 'unavailable',
+                }])
+                self.assertEqual(first.status, 'available')
+
+                start = datetime.datetime(2015, 6, 1)
+                small = self.create_contract(
+                    start, start + relativedelta(days=2), quantity=2
+                )
+                start = datetime.datetime(2015, 6, 10)
+                large = self.create_contract(
+                    start, start + relativedelta(days=2), quantity=3
+                )
+                contracts = [small, large]
+                self.Contract.quote(contracts)
+                self.Contract.reserve(contracts)
+
+                line, = small.lines
+                large_line, = large.lines
+                self.assertEqual(Asset.pick([]), ({}, []))
+                self.assertEqual(
+                    Asset.pick([line, large_line]),
+                    ({line.id: [first.id, second.id]}, [large_line.id])
+                )
+
+                with Transaction().set_context(rental_job=True):
+                    self.Contract.active(contracts)
+                small, large = self.Contract.browse(contracts)
+                self.assertEqual(small.state, 'active')
+                self.assertEqual(large.state, 'reservation')
+                for asset in Asset.browse([first, second]):
+                    self.assertEqual(asset.status, 'rented')
+                    self.assertEqual(asset.contract_line, line)
+                self.assertEqual(Asset.pick([line]), ({}, [line.id]))
+
+                # The rented assets are not picked for another contract
+                start = datetime.datetime(2015, 6, 20)
+                later = self.create_contract(
+                    start, start + relativedelta(days=2), quantity=1
+                )
+                self.Contract.quote([later])
+                self.Contract.reserve([later])
+                with Transaction().set_context(rental_job=True):
+                    self.Contract.active([later])
+                self.assertEqual(self.Contract(later.id).state, 'reservation')
+
+                self.Contract.close([small])
+                for asset in Asset.browse([first, second]):
+                    self.assertEqual(asset.status, 'available')
+                    self.assertIsNone(asset.contract_line)
+
+                with Transaction().set_context(rental_job=True):
+                    self.Contract.active([later])
+                later = self.Contract(later.id)
+                self.assertEqual(later.state, 'active')
+                line, = later.lines
+                self.assertEqual(
+                    Asset.search([('contract_line', '=', line.id)]),
+                    [first]
+                )
+
+    def test0250worker(self):
+        '''
+        Test the worker runs the jobs of the database and survives errors
+        '''
+        Job = POOL.get('rental.contract.job')
+
+        args = get_parser().parse_args([
+            '-c', 'trytond.conf', '-d', DB_NAME, '--processes', '2',
+        ])
+        self.assertEqual(args.database, DB_NAME)
+        self.assertEqual(args.processes, 2)
+        self.assertEqual(args.interval, 5)
+
+        self.assertEqual(run_jobs(DB_NAME), 0)
+
+        def process(cls, limit=None, commit=False):
+            raise ValueError('Broken queue')
+        original = Job.process.__func__
+        Job.process = classmethod(process)
+        try:
+            self.assertEqual(run_jobs(DB_NAME), 0)
+        finally:
+            Job.process = classmethod(original)
+
+    def test0260jobs_commit(self):
+        '''
+        Test the jobs run by the scheduler commit the claims and the results
+        and roll back the failed jobs
+        '''
+        Job = POOL.get('rental.contract.job')
+
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+            with Transaction().set_context(company=self.company.id):
+                start = datetime.datetime(2015, 6, 1)
+                contracts = [
+                    self.create_contract(
+                        start, start + relativedelta(days=2), quantity=6
+                    ) for _ in range(2)
+                ]
+                quote, = Job.enqueue('quote', contracts)
+
+                # The test database must not be committed
+                cursor = Transaction().cursor
+                calls = []
+                cursor.commit = lambda: calls.append('commit')
+                cursor.rollback = lambda: calls.append('rollback')
+                try:
+                    Job.cron_process()
+                    self.assertEqual(calls, ['commit'] * 3)
+
+                    # Both contracts do not fit in the stock
+                    del calls[:]
+                    reserve, = Job.enqueue('reserve', contracts)
+                    Job.cron_process()
+                    self.assertEqual(
+                        calls, ['commit', 'rollback', 'commit', 'commit']
+                    )
+                finally:
+                    del cursor.commit
+                    del cursor.rollback
+                self.assertEqual(
+                    [j.state for j in Job.browse([quote, reserve])],
+                    ['done', 'failed']
+                )
+
+    def test0270reserve_resume(self):
+        '''
+        Test the reservations by chunks interrupted in a job resume after
+        the committed chunks or start again from draft
+        '''
+        Configuration = POOL.get('rental.configuration')
+
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+            with Transaction().set_context(company=self.company.id):
+                Configuration.write([Configuration(1)], {
+                    'reservation_chunk_size': 2,
+                })
+                start = datetime.datetime(2015, 6, 1)
+                end = start + relativedelta(days=2)
+                line = {
+                    'product': self.product.id,
+                    'quantity': 1,
+                    'unit': self.unit.id,
+                    'unit_price': Decimal('10'),
+                    'description': self.product.rec_name,
+                }
+                contract, other = [
+                    self.create_contract(
+                        start, end, lines=[('create', [line] * 5)]
+                    ) for _ in range(2)
+                ]
+                self.Contract.quote([contract, other])
+
+                # The test database must not be committed
+                cursor = Transaction().cursor
+                calls = []
+                cursor.commit = lambda: calls.append('commit')
+                reserve_invoice_lines = \
+                    self.Contract._reserve_invoice_lines.__func__
+
+                def interrupted(contract, lines, configuration):
+                    if calls:
+                        raise ValueError('Interrupted')
+                    return reserve_invoice_lines(
+                        contract, lines, configuration
+                    )
+
+                def reserve_interrupted(contracts):
+                    del calls[:]
+                    self.Contract._reserve_invoice_lines = interrupted
+                    try:
+                        with Transaction().set_context(rental_job=True):
+                            self.assertRaises(
+                                ValueError, self.Contract.reserve, contracts
+                            )
+                    finally:
+                        self.Contract._reserve_invoice_lines = \
+                            reserve_invoice_lines
+                    self.assertEqual(calls, ['commit'])
+
+                try:
+                    reserve_interrupted([contract])
+                    contract = self.Contract(contract.id)
+                    self.assertEqual(contract.state, 'quotation')
+                    invoice = contract.reservation_invoice
+                    self.assertEqual(len(invoice.lines), 2)
+
+                    # The button resumes without committing
+                    del calls[:]
+                    self.Contract.reserve([contract])
+                    self.assertEqual(calls, [])
+                finally:
+                    del cursor.commit
+                contract = self.Contract(contract.id)
+                self.assertEqual(contract.state, 'reservation')
+                self.assertEqual(contract.reservation_invoice, invoice)
+                self.assertEqual(len(invoice.lines), 5)
+                shipment, = contract.shipments
+                self.assertEqual(len(shipment.outgoing_moves), 5)
+                shipment_return, = contract.shipment_returns
+                self.assertEqual(len(shipment_return.incoming_moves), 5)
+
+                # A quotation sent back to draft is reserved from the start
+                cursor.commit = lambda: calls.append('commit')
+                try:
+                    reserve_interrupted([other])
+                finally:
+                    del cursor.commit
+                other = self.Contract(other.id)
+                invoice = other.reservation_invoice
+                shipment, = other.shipments
+                self.Contract.draft([other])
+                other = self.Contract(other.id)
+                self.assertIsNone(other.reserved_line)
+                self.assertIsNone(other.reservation_invoice)
+                self.assertEqual(invoice.state, 'cancel')
+                self.assertEqual(shipment.state, 'cancel')
+
+                self.Contract.quote([other])
+                self.Contract.reserve([other])
+                other = self.Contract(other.id)
+                self.assertEqual(len(other.reservation_invoice.lines), 5)
+                self.assertNotEqual(other.reservation_invoice, invoice)
+                shipment, = [
+                    s for s in other.shipments if s.state != 'cancel'
+                ]
+                self.assertEqual(len(shipment.outgoing_moves), 5)
+
+                # Drop the configuration cached for this test
+                Configuration._values_cache.clear()
+
+    def test0280utilization(self):
+        '''
+        Test the utilization buckets follow the contracts and their lines
+        and are reported per day
+        '''
+        Bucket = POOL.get('rental.utilization.bucket')
+        Utilization = POOL.get('rental.utilization')
+
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+            with Transaction().set_context(company=self.company.id):
+                start = datetime.datetime(2015, 6, 1)
+                contract = self.create_contract(
+                    start, start + relativedelta(days=2), quantity=2
+                )
+                self.Contract.quote([contract])
+                self.assertEqual(Bucket.search([]), [])
+
+                self.Contract.reserve([contract])
+                buckets = Bucket.search([], order=[('date', 'ASC')])
+                self.assertEqual(
+                    [(b.date, b.rented_hours, b.revenue) for b in buckets],
+                    [
+                        (datetime.date(2015, 6, 1), 48., Decimal('20')),
+                        (datetime.date(2015, 6, 2), 48., Decimal('20')),
+                    ]
+                )
+
+                # The reported states keep the same buckets
+                self.Contract.active([contract])
+                self.assertEqual(
+                    self.Contract(contract.id).state, 'active'
+                )
+                self.assertEqual(
+                    Bucket.search([], order=[('date', 'ASC')]), buckets
+                )
+
+                records = Utilization.search([], order=[('date', 'ASC')])
+                self.assertEqual(
+                    [(r.date, r.rented_hours, r.revenue) for r in records],
+                    [
+                        (datetime.date(2015, 6, 1), 48., Decimal('20')),
+                        (datetime.date(2015, 6, 2), 48., Decimal('20')),
+                    ]
+                )
+                for record in records:
+                    self.assertEqual(record.product, self.product)
+                    self.assertEqual(record.warehouse, self.warehouse)
+                    self.assertEqual(record.available_hours, 240.)
+                    self.assertEqual(record.utilization, 0.2)
+
+                # The lines refresh the buckets
+                line, = contract.lines
+                self.ContractLine.write([line], {'quantity': 3})
+                self.assertEqual(
+                    [b.rented_hours for b in Bucket.search([])], [72., 72.]
+                )
+                extra, = self.ContractLine.create([{
+                    'rental_contract': contract.id,
+                    'product': self.product.id,
+                    'quantity': 1,
+                    'unit': self.unit.id,
+                    'unit_price': Decimal('10'),
+                    'description': self.product.rec_name,
+                }])
+                self.assertEqual(len(Bucket.search([])), 4)
+                self.ContractLine.delete([extra])
+                self.assertEqual(len(Bucket.search([])), 2)
+
+                # The buckets are rebuilt from the contracts
+                Bucket.delete(Bucket.search([]))
+                Bucket.rebuild(batch_size=1)
+                self.assertEqual(
+                    [b.rented_hours for b in Bucket.search([])], [72., 72.]
+                )
+
+                # The other companies are not reported
+                with Transaction().set_context(company=None):
+                    self.assertEqual(Utilization.search([]), [])
+
+    def test0290rental_availability(self):
+        '''
+        Test the availability and the first free slot of the products follow
+        the contracts
+        '''
+        Product = POOL.get('product.product')
+
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+            with Transaction().set_context(company=self.company.id):
+                # The indexes are cached per process
+                Product.clear_rental_index()
+                start = datetime.datetime(2015, 6, 1)
+                day = datetime.timedelta(days=1)
+
+                def availability(start, end):
+                    return Product.get_rental_availability(
+                        [self.product], start, end
+                    )[self.product.id]
+
+                def slot(quantity, duration):
+                    return Product.get_rental_slot(
+                        [self.product], quantity, duration, start
+                    )[self.product.id]
+
+                first = self.create_contract(start, start + 5 * day, 6)
+                self.assertEqual(availability(start, start + 5 * day), 10)
+                self.assertEqual(slot(6, 2 * day), start)
+
+                self.Contract.quote([first])
+                self.assertEqual(availability(start, start + 5 * day), 4)
+                self.assertEqual(slot(6, 2 * day), start + 5 * day)
+
+                self.Contract.write([first], {'end_date': start + 3 * day})
+                self.assertEqual(
+                    availability(start + 3 * day, start + 5 * day), 10
+                )
+                self.assertEqual(slot(6, 2 * day), start + 3 * day)
+
+                self.Contract.reserve([first])
+                second = self.create_contract(
+                    start + 3 * day, start + 5 * day, 5
+                )
+                self.Contract.quote([second])
+                self.assertEqual(availability(start, start + 5 * day), 4)
+                self.assertEqual(slot(6, 2 * day), start + 5 * day)
+                self.assertIsNone(slot(11, day))
+
+                self.Contract.cancel([first])
+                self.assertEqual(availability(start, start + 3 * day), 10)
+                self.assertEqual(slot(6, 2 * day), start)
+                self.assertEqual(slot(6, 4 * day), start + 5 * day)
+
+                Product.clear_rental_index()
+
+    def test0300bill_wizard(self):
+        '''
+        Test the recurring contracts are billed by the wizard and the
+        scheduler chunk by chunk without billing a period twice
+        '''
+        Configuration = POOL.get('rental.configuration')
+        BillContract = POOL.get('rental.contract.bill', type='wizard')
+
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+            with Transaction().set_context(company=self.company.id):
+                Configuration.write([Configuration(1)], {
+                    'billing_chunk_size': 1,
+                })
+                contracts = [
+                    self.create_contract(
+                        datetime.datetime(2015, 2, 1),
+                        datetime.datetime(2015, 4, 15),
+                        billing_method='monthly', billing_type='recurring',
+                        billing_frequency=1,
+                    ) for _ in range(2)
+                ]
+                self.Contract.quote(contracts)
+                self.Contract.reserve(contracts)
+
+                def bill(date):
+                    session_id, _, _ = BillContract.create()
+                    wizard = BillContract(session_id)
+                    wizard.start.date = date
+                    self.assertEqual(wizard.transition_bill(), 'end')
+
+                with self.record_commits() as calls:
+                    bill(datetime.date(2015, 2, 1))
+                    # One commit per chunk
+                    self.assertEqual(calls, ['commit', 'commit'])
+                    del calls[:]
+                    bill(datetime.date(2015, 2, 1))
+                    self.assertEqual(calls, [])
+                for contract in self.Contract.browse(contracts):
+                    self.assertEqual(len(contract.invoices), 1)
+                    self.assertEqual(
+                        contract.next_billing_date, datetime.date(2015, 3, 1)
+                    )
+                    line, = contract.lines
+                    self.assertEqual(
+                        line.billed_until, datetime.datetime(2015, 3, 1)
+                    )
+
+                # The scheduler bills the next period due today
+                with self.record_commits() as calls:
+                    self.Contract.cron_bill()
+                    self.assertEqual(calls, ['commit', 'commit'])
+                    self.Contract.cron_bill()
+                    self.Contract.cron_bill()
+                for contract in self.Contract.browse(contracts):
+                    self.assertEqual(len(contract.invoices), 2)
+                    self.assertIsNone(contract.next_billing_date)
+                    # The last period shorter than a month is not invoiced
+                    line, = contract.lines
+                    self.assertEqual(line.billed_until, contract.end_date)
+
+                # Drop the configuration cached for this test
+                Configuration._values_cache.clear()
+
+    def test0310check_overdue_twice(self):
+        '''
+        Test the scheduled checks of the overdue contracts commit each batch
+        and invoice only the late units since the previous check
+        '''
+        Configuration = POOL.get('rental.configuration')
+        Template = POOL.get('product.template')
+
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+            with Transaction().set_context(company=self.company.id):
+                template, = Template.create([{
+                    'name': 'Late Fee',
+                    'type': 'service',
+                    'default_uom': self.unit.id,
+                    'list_price': Decimal('0'),
+                    'cost_price': Decimal('0'),
+                    'account_revenue': self.revenue.id,
+                    'products': [('create', [{}])],
+                }])
+                late_fee, = template.products
+                Configuration.write([Configuration(1)], {
+                    'late_fee_product': late_fee.id,
+                    'overdue_batch_size': 1,
+                })
+
+                start = datetime.datetime(2015, 6, 1)
+                contracts = [
+                    self.create_contract(start, start + relativedelta(days=2))
+                    for _ in range(2)
+                ]
+                self.Contract.quote(contracts)
+                self.Contract.reserve(contracts)
+                self.Contract.active(contracts)
+
+                with self.record_commits() as calls:
+                    self.Contract.check_overdue(
+                        datetime.datetime(2015, 6, 5, 12), commit=True
+                    )
+                    # One commit per batch
+                    self.assertEqual(calls, ['commit', 'commit'])
+                    self.Contract.check_overdue(
+                        datetime.datetime(2015, 6, 8, 12), commit=True
+                    )
+                for contract in self.Contract.browse(contracts):
+                    self.assertEqual(
+                        [l.quantity for l in contract.late_fee_lines],
+                        [2, 3]
+                    )
+                    self.assertEqual(
+                        contract.late_fee_until, datetime.datetime(2015, 6, 8)
+                    )
+
+                # The scheduler invoices the late days up to now
+                with self.record_commits():
+                    self.Contract.cron_check_overdue()
+                now = datetime.datetime.now()
+                for contract in self.Contract.browse(contracts):
+                    self.assertEqual(len(contract.late_fee_lines), 3)
+                    days = contract.late_fee_lines[-1].quantity
+                    self.assertEqual(
+                        contract.late_fee_until,
+                        datetime.datetime(2015, 6, 8)
+                        + datetime.timedelta(days=days)
+                    )
+                    self.assertTrue(
+                        now - datetime.timedelta(days=1)
+                        < contract.late_fee_until <= now
+                    )
+
+                # Drop the configuration cached for this test
+                Configuration._values_cache.clear()
+
+    def test0320renew_wizard(self):
+        '''
+        Test the wizard renews or extends the selected contracts
+        '''
+        RenewContract = POOL.get('rental.contract.renew', type='wizard')
+        RenewContractStart = POOL.get('rental.contract.renew.start')
+
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+            with Transaction().set_context(company=self.company.id):
+                start = datetime.datetime(2015, 6, 1)
+                end = start + relativedelta(days=2)
+                contract = self.create_contract(start, end)
+                self.Contract.quote([contract])
+                self.Contract.reserve([contract])
+
+                def apply(method, periods):
+                    session_id, _, _ = RenewContract.create()
+                    wizard = RenewContract(session_id)
+                    wizard.start.method = method
+                    wizard.start.periods = periods
+                    with Transaction().set_context(active_ids=[contract.id]):
+                        self.assertEqual(wizard.transition_apply(), 'end')
+
+                self.assertEqual(RenewContractStart.default_method(), 'renew')
+                self.assertEqual(RenewContractStart.default_periods(), 1)
+                apply('renew', 3)
+                successor, = self.Contract.search([
+                    ('id', '!=', contract.id),
+                ])
+                self.assertEqual(successor.state, 'quotation')
+                self.assertEqual(successor.start_date, end)
+                self.assertEqual(
+                    successor.end_date, end + relativedelta(days=3)
+                )
+
+                apply('extend', 1)
+                self.assertEqual(
+                    self.Contract(contract.id).end_date,
+                    end + relativedelta(days=1)
+                )
+
+
+def suite():
+    """
+    Define suite
+    """
+    test_suite = trytond.tests.test_tryton.suite()
+    test_suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestContract)
+    )
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+    tests/test_exchange.py
+
+    :copyright: (C) 2015 by Fulfil.IO Inc.
+    :license: see LICENSE.
+"""
+import sys
+import os
+DIR = os.path.abspath(os.path.normpath(os.path.join(
+    __file__, '..', '..', '..', '..', '..', 'trytond'
+)))
+if os.path.isdir(DIR):
+    sys.path.insert(0, os.path.dirname(DIR))
+import unittest
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+import trytond.tests.test_tryton
+from trytond.modules.rental.exchange import json_default, parse_datetime
+
+
+class TestExchange(unittest.TestCase):
+    '''
+    Test the JSON Lines serialization of the rental contracts
+    '''
+
+    def test0010json_default(self):
+        '''
+        Test the serialization of the decimals and dates
+        '''
+        self.assertEqual(json.loads(json.dumps({
+            'unit_price': Decimal('10.50'),
+            'start_date': datetime(2015, 1, 2, 8, 30),
+            'date': date(2015, 1, 2),
+        }, default=json_default)), {
+            'unit_price': '10.50',
+            'start_date': '2015-01-02T08:30:00',
+            'date': '2015-01-02',
+        })
+        self.assertRaises(TypeError, json.dumps, object(), default=json_default)
+
+    def test0020parse_datetime(self):
+        '''
+        Test the parsing of the exported datetimes
+        '''
+        value = datetime(2015, 1, 2, 8, 30, 15)
+        self.assertEqual(parse_datetime(json_default(value)), value)
+        self.assertIsNone(parse_datetime(None))
+
+
+def suite():
+    """
+    Define suite
+    """
+    test_suite = trytond.tests.test_tryton.suite()
+    test_suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestExchange)
+    )
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
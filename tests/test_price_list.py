@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+    tests/test_price_list.py
+
+    :copyright: (C) 2015 by Fulfil.IO Inc.
+    :license: see LICENSE.
+"""
+import sys
+import os
+DIR = os.path.abspath(os.path.normpath(os.path.join(
+    __file__, '..', '..', '..', '..', '..', 'trytond'
+)))
+if os.path.isdir(DIR):
+    sys.path.insert(0, os.path.dirname(DIR))
+import unittest
+
+import trytond.tests.test_tryton
+
+from trytond.modules.rental.price_list import CompiledPriceList
+
+
+class TestPriceList(unittest.TestCase):
+    '''
+    Test the lookup of the compiled rental price lists
+    '''
+
+    def setUp(self):
+        # (product, billing method, (sequence, id, party, quantity,
+        # duration, rent))
+        self.compiled = CompiledPriceList([
+            (None, None, (100, 1, None, 0, 0, 10)),
+            (1, 'daily', (20, 2, None, 5, 0, 8)),
+            (1, None, (10, 3, None, 0, 30, 7)),
+            (None, 'daily', (5, 4, 42, 0, 0, 6)),
+        ])
+
+    def test0010lookup(self):
+        '''
+        Test the first matching rule by sequence is used
+        '''
+        lookup = self.compiled.lookup
+        self.assertEqual(lookup(1, 'daily', None, 1, 1), 10)
+        self.assertEqual(lookup(1, 'daily', None, 5, 1), 8)
+        self.assertEqual(lookup(1, 'daily', None, 5, 30), 7)
+        self.assertEqual(lookup(1, 'daily', 42, 5, 30), 6)
+        self.assertEqual(lookup(2, 'hourly', 42, 5, 30), 10)
+
+    def test0020no_rule(self):
+        '''
+        Test lookup without matching rule
+        '''
+        compiled = CompiledPriceList([(1, None, (10, 1, None, 5, 0, 7))])
+        self.assertIsNone(compiled.lookup(1, 'daily', None, 1, 0))
+        self.assertIsNone(compiled.lookup(2, 'daily', None, 5, 0))
+
+
+def suite():
+    """
+    Define suite
+    """
+    test_suite = trytond.tests.test_tryton.suite()
+    test_suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestPriceList)
+    )
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+    tests/test_profiling.py
+
+    :copyright: (C) 2015 by Fulfil.IO Inc.
+    :license: see LICENSE.
+"""
+import sys
+import os
+DIR = os.path.abspath(os.path.normpath(os.path.join(
+    __file__, '..', '..', '..', '..', '..', 'trytond'
+)))
+if os.path.isdir(DIR):
+    sys.path.insert(0, os.path.dirname(DIR))
+import logging
+import unittest
+
+import trytond.tests.test_tryton
+from trytond.modules.rental import profiling
+
+
+class Cursor(object):
+
+    def execute(self, query):
+        return query
+
+
+class Handler(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class TestProfiling(unittest.TestCase):
+    '''
+    Test the instrumentation of the rental workflow
+    '''
+
+    def setUp(self):
+        profiling.reset()
+
+    def test0010statistics(self):
+        '''
+        Test the aggregation of the measures
+        '''
+        profiling.record('reserve', 0.0015, 10, 2)
+        profiling.record('reserve', 0.5, 30, 3)
+        profiling.record('reserve', 1000, 1, 1)
+
+        statistics = profiling.snapshot()['reserve']
+        self.assertEqual(statistics['calls'], 3)
+        self.assertEqual(statistics['queries'], 41)
+        self.assertEqual(statistics['records'], 6)
+        self.assertAlmostEqual(statistics['seconds'], 1000.5015)
+        self.assertEqual(statistics['histogram'], {
+            '2': 1,
+            '512': 1,
+            'inf': 1,
+        })
+
+        profiling.reset()
+        self.assertEqual(profiling.snapshot(), {})
+
+    def test0020disabled(self):
+        '''
+        Test that a disabled profile only calls the method
+        '''
+        @profiling.profile
+        def transition(cls, records):
+            return len(records)
+
+        profiling.enable(False)
+        self.assertEqual(transition(None, [1, 2]), 2)
+        self.assertEqual(profiling.snapshot(), {})
+
+    def test0030query_count(self):
+        '''
+        Test the count of the queries of a cursor
+        '''
+        cursor = Cursor()
+        self.assertEqual(profiling.query_count(cursor), 0)
+        cursor.execute('SELECT 1')
+        cursor.execute('SELECT 2')
+        self.assertEqual(profiling.query_count(cursor), 2)
+
+    def test0040count_records(self):
+        '''
+        Test the count of the records of the arguments
+        '''
+        self.assertEqual(profiling.count_records([[1, 2, 3], 'out']), 3)
+        self.assertEqual(profiling.count_records(['out']), 1)
+
+    def test0050log_periodically(self):
+        '''
+        Test the statistics are logged and dropped once per interval
+        '''
+        handler = Handler()
+        profiling.logger.addHandler(handler)
+        level = profiling.logger.level
+        profiling.logger.setLevel(logging.INFO)
+        interval, last_log = profiling.LOG_INTERVAL, profiling._last_log
+        try:
+            profiling.LOG_INTERVAL = 60
+            profiling._last_log = 1000
+            profiling.record('reserve', 0.5, 30, 3)
+
+            profiling.log_periodically(1059)
+            self.assertEqual(handler.messages, [])
+            self.assertIn('reserve', profiling.snapshot())
+
+            profiling.log_periodically(1060)
+            message, = handler.messages
+            self.assertTrue(message.startswith('reserve: 1 calls'))
+            self.assertEqual(profiling.snapshot(), {})
+
+            profiling.record('reserve', 0.5, 30, 3)
+            profiling.log_periodically(1100)
+            self.assertEqual(len(handler.messages), 1)
+
+            profiling.LOG_INTERVAL = 0
+            profiling.log_periodically(5000)
+            self.assertEqual(len(handler.messages), 1)
+        finally:
+            profiling.LOG_INTERVAL, profiling._last_log = interval, last_log
+            profiling.logger.setLevel(level)
+            profiling.logger.removeHandler(handler)
+
+
+def suite():
+    """
+    Define suite
+    """
+    test_suite = trytond.tests.test_tryton.suite()
+    test_suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestProfiling)
+    )
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+    tests/test_utilization.py
+
+    :copyright: (C) 2015 by Fulfil.IO Inc.
+    :license: see LICENSE.
+"""
+import sys
+import os
+DIR = os.path.abspath(os.path.normpath(os.path.join(
+    __file__, '..', '..', '..', '..', '..', 'trytond'
+)))
+if os.path.isdir(DIR):
+    sys.path.insert(0, os.path.dirname(DIR))
+import unittest
+from datetime import date, datetime
+
+import trytond.tests.test_tryton
+from trytond.modules.rental.utilization import split_days
+
+
+class TestUtilization(unittest.TestCase):
+    '''
+    Test the daily buckets of the rental utilization
+    '''
+
+    def test0010split_days(self):
+        '''
+        Test the split of a period in hours per day
+        '''
+        self.assertEqual(split_days(
+            datetime(2015, 1, 1, 18), datetime(2015, 1, 3, 6)
+        ), [
+            (date(2015, 1, 1), 6.),
+            (date(2015, 1, 2), 24.),
+            (date(2015, 1, 3), 6.),
+        ])
+
+    def test0020split_days_within_day(self):
+        '''
+        Test the split of a period within a day
+        '''
+        self.assertEqual(split_days(
+            datetime(2015, 1, 1, 8), datetime(2015, 1, 1, 20)
+        ), [(date(2015, 1, 1), 12.)])
+
+    def test0030split_days_midnight(self):
+        '''
+        Test the split of a period ending at midnight
+        '''
+        self.assertEqual(split_days(
+            datetime(2015, 1, 1), datetime(2015, 1, 2)
+        ), [(date(2015, 1, 1), 24.)])
+        self.assertEqual(split_days(
+            datetime(2015, 1, 2), datetime(2015, 1, 1)
+        ), [])
+
+
+def suite():
+    """
+    Define suite
+    """
+    test_suite = trytond.tests.test_tryton.suite()
+    test_suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestUtilization)
+    )
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
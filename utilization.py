@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""
+    utilization.py
+
+    :copyright: (c) 2015 by Fulfil.IO Inc.
+    :license: see LICENSE.
+"""
+import datetime
+from decimal import Decimal
+from itertools import chain, groupby
+
+from sql import Column
+from sql.aggregate import Max, Min, Sum
+from sql.functions import Now
+
+from trytond import backend
+from trytond.model import ModelSQL, ModelView, fields
+from trytond.pool import Pool
+from trytond.tools import reduce_ids
+from trytond.transaction import Transaction
+
+__all__ = ['UtilizationBucket', 'Utilization']
+
+
+def split_days(start, end):
+    "Return the list of (date, hours) of the days overlapped by [start, end)"
+    result = []
+    while start < end:
+        day_end = min(end, datetime.datetime.combine(
+            start.date() + datetime.timedelta(days=1), datetime.time()
+        ))
+        result.append(
+            (start.date(), (day_end - start).total_seconds() / 3600.)
+        )
+        start = day_end
+    return result
+
+
+class UtilizationBucket(ModelSQL):
+    'Rental Utilization Bucket'
+    __name__ = 'rental.utilization.bucket'
+
+    contract = fields.Many2One(
+        'rental.contract', 'Contract', required=True, select=True,
+        ondelete='CASCADE'
+    )
+    contract_line = fields.Many2One(
+        'rental.contract.line', 'Contract Line', required=True,
+        ondelete='CASCADE'
+    )
+    company = fields.Many2One('company.company', 'Company', required=True)
+    product = fields.Many2One('product.product', 'Product', required=True)
+    warehouse = fields.Many2One('stock.location', 'Warehouse')
+    date = fields.Date('Date', required=True)
+    rented_hours = fields.Float('Rented Hours')
+    revenue = fields.Numeric('Revenue', digits=(16, 4))
+
+    # States of the contracts which are reported
+    _reported_states = ('reservation', 'active', 'close')
+
+    @classmethod
+    def __register__(cls, module_name):
+        TableHandler = backend.get('TableHandler')
+        cursor = Transaction().cursor
+
+        super(UtilizationBucket, cls).__register__(module_name)
+
+        table = TableHandler(cursor, cls, module_name)
+        table.index_action(['date', 'product', 'warehouse'], 'add')
+
+    @classmethod
+    def _get_buckets(cls, contract):
+        """
+        Return the list of the values of the buckets of the lines of the
+        contract: the quantity rented in the default unit of the product
+        times the hours of each day and the revenue of the line in the
+        currency of the company prorated over the hours.
+        The revenue is invoiced like the rent: the quantity times the unit
+        price times the duration of the contract.
+        """
+        pool = Pool()
+        Uom = pool.get('product.uom')
+        Currency = pool.get('currency.currency')
+
+        start, end = contract.start_date, contract.end_date
+        if not start or not end or end <= start:
+            return []
+        days = split_days(start, end)
+        total = Decimal(str((end - start).total_seconds() / 3600.))
+        company = contract.company
+        duration = contract.duration or 0
+        result = []
+        for line in contract.lines:
+            if line.type != 'line' or not line.product:
+                continue
+            quantity = Uom.compute_qty(
+                line.unit, line.quantity, line.product.default_uom
+            )
+            amount = (
+                Decimal(str(line.quantity or 0))
+                * (line.unit_price or Decimal('0')) * duration
+            )
+            if contract.currency != company.currency:
+                with Transaction().set_context(date=start.date()):
+                    amount = Currency.compute(
+                        contract.currency, amount, company.currency,
+                        round=False
+                    )
+            warehouse = line._get_warehouse()
+            for date, hours in days:
+                result.append({
+                    'contract': contract.id,
+                    'contract_line': line.id,
+                    'company': company.id,
+                    'product': line.product.id,
+                    'warehouse': warehouse.id if warehouse else None,
+                    'date': date,
+                    'rented_hours': quantity * hours,
+                    'revenue': (
+                        amount * Decimal(str(hours)) / total
+                    ).quantize(Decimal('0.0001')),
+                })
+        return result
+
+    @classmethod
+    def refresh(cls, contracts):
+        """
+        Replace the buckets of the contracts: the existing ones are deleted
+        with one query per chunk and the buckets of the contracts in the
+        reported states are inserted again with one query per chunk
+        """
+        Contract = Pool().get('rental.contract')
+        transaction = Transaction()
+        cursor = transaction.cursor
+
+        table = cls.__table__()
+        ids = list(set(c.id for c in contracts))
+        for i in range(0, len(ids), cursor.IN_MAX):
+            sub_ids = ids[i:i + cursor.IN_MAX]
+            cursor.execute(*table.delete(
+                where=reduce_ids(table.contract, sub_ids)
+            ))
+        vlist = list(chain.from_iterable(
+            cls._get_buckets(c) for c in Contract.browse(ids)
+            if c.state in cls._reported_states
+        ))
+        if not vlist:
+            return
+        names = sorted(vlist[0])
+        columns = [Column(table, n) for n in names] + [
+            table.create_uid, table.create_date,
+        ]
+        rows = [
+            [cls._fields[n].sql_format(v[n]) for n in names]
+            + [transaction.user, Now()]
+            for v in vlist
+        ]
+        # The parameters of a query are limited like the ids
+        size = max(cursor.IN_MAX // len(columns), 1)
+        for i in range(0, len(rows), size):
+            cursor.execute(*table.insert(columns, rows[i:i + size]))
+
+    @classmethod
+    def rebuild(cls, batch_size=1000):
+        "Refresh the buckets of all the contracts by batches of ids"
+        Contract = Pool().get('rental.contract')
+
+        last_id = 0
+        while True:
+            contracts = Contract.search([
+                ('id', '>', last_id),
+            ], order=[('id', 'ASC')], limit=batch_size)
+            if not contracts:
+                break
+            cls.refresh(contracts)
+            last_id = contracts[-1].id
+
+
+class Utilization(ModelSQL, ModelView):
+    'Rental Utilization'
+    __name__ = 'rental.utilization'
+
+    company = fields.Many2One('company.company', 'Company', readonly=True)
+    product = fields.Many2One('product.product', 'Product', readonly=True)
+    warehouse = fields.Many2One('stock.location', 'Warehouse', readonly=True)
+    date = fields.Date('Date', readonly=True)
+    rented_hours = fields.Float('Rented Hours', readonly=True)
+    revenue = fields.Numeric('Revenue', digits=(16, 2), readonly=True)
+    available_hours = fields.Function(
+        fields.Float('Available Hours'), 'get_available'
+    )
+    utilization = fields.Function(
+        fields.Float('Utilization'), 'get_available'
+    )
+
+    @classmethod
+    def __setup__(cls):
+        super(Utilization, cls).__setup__()
+        cls._order.insert(0, ('date', 'DESC'))
+
+    @classmethod
+    def table_query(cls):
+        Bucket = Pool().get('rental.utilization.bucket')
+        bucket = Bucket.__table__()
+        return bucket.select(
+            Min(bucket.id).as_('id'),
+            Max(bucket.create_uid).as_('create_uid'),
+            Max(bucket.create_date).as_('create_date'),
+            Max(bucket.write_uid).as_('write_uid'),
+            Max(bucket.write_date).as_('write_date'),
+            bucket.company, bucket.product, bucket.warehouse, bucket.date,
+            Sum(bucket.rented_hours).as_('rented_hours'),
+            Sum(bucket.revenue).as_('revenue'),
+            where=bucket.company == Transaction().context.get('company', -1),
+            group_by=[
+                bucket.company, bucket.product, bucket.warehouse,
+                bucket.date,
+            ]
+        )
+
+    @classmethod
+    def get_available(cls, records, names):
+        """
+        Return the hours of the day times the rental capacity of the product
+        in the warehouse and the ratio of the rented hours.
+        The capacity is the current one computed once per warehouse.
+        """
+        pool = Pool()
+        Product = pool.get('product.product')
+        Location = pool.get('stock.location')
+
+        def key(record):
+            return record.warehouse.id if record.warehouse else None
+
+        result = dict((n, {}) for n in names)
+        for warehouse_id, group in groupby(
+                sorted(records, key=key), key=key):
+            group = list(group)
+            locations = None
+            if warehouse_id:
+                locations = [Location(warehouse_id).storage_location.id]
+            with Transaction().set_context(locations=locations):
+                capacities = Product.get_rental_capacity(
+                    list(set(r.product for r in group))
+                )
+            for record in group:
+                available = capacities[record.product.id] * 24.
+                if 'available_hours' in names:
+                    result['available_hours'][record.id] = available
+                if 'utilization' in names:
+                    result['utilization'][record.id] = (
+                        record.rented_hours / available if available else 0.
+                    )
+        return result
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+    worker.py
+
+    Worker processes running the queued rental contract jobs of a database:
+
+        python worker.py -c trytond.conf -d database --processes 4
+
+    The jobs are claimed from the database so any number of workers can run
+    on one or several hosts beside the scheduler.
+
+    :copyright: (c) 2015 by Fulfil.IO Inc.
+    :license: see LICENSE.
+"""
+import argparse
+import logging
+import time
+from multiprocessing import Process
+
+logger = logging.getLogger(__name__)
+
+
+def run_jobs(database):
+    """
+    Run the next queued job of the database and return the number of jobs
+    run which is 0 when the queue is empty or when an error occurred
+    """
+    from trytond.cache import Cache
+    from trytond.pool import Pool
+    from trytond.transaction import Transaction
+
+    count = 0
+    with Transaction().start(database, 0) as transaction:
+        Cache.clean(database)
+        try:
+            Job = Pool().get('rental.contract.job')
+            count = Job.process(limit=1, commit=True)
+        except Exception:
+            transaction.cursor.rollback()
+            logger.exception('Rental contract jobs failed')
+        Cache.resets(database)
+    return count
+
+
+def work(config_file, database, interval):  # pragma: no cover
+    """
+    Run the queued jobs and wait interval seconds when there are none or
+    when an error occurred
+    """
+    from trytond.config import config
+    config.update_etc(config_file)
+    from trytond.pool import Pool
+
+    Pool.start()
+    Pool(database).init()
+    while True:
+        if not run_jobs(database):
+            time.sleep(interval)
+
+
+def get_parser():
+    "Return the parser of the command line arguments"
+    parser = argparse.ArgumentParser(
+        description='Run the queued rental contract jobs')
+    parser.add_argument('-c', '--config', dest='config_file', required=True)
+    parser.add_argument('-d', '--database', required=True)
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument(
+        '--interval', type=float, default=5,
+        help='seconds to wait when the queue is empty')
+    return parser
+
+
+def main():  # pragma: no cover
+    args = get_parser().parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    processes = [
+        Process(
+            target=work,
+            args=(args.config_file, args.database, args.interval)
+        ) for _ in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+if __name__ == '__main__':  # pragma: no cover
+    main()